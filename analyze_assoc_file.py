@@ -1,19 +1,31 @@
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-import numpy as np
+from gwas_cache import find_column, load_gwas
+from gwas_streaming_stats import DEFAULT_CHUNKSIZE, print_streaming_summary, streaming_gwas_summary
+from instrumentation import TRACER, add_arguments, configure_from_args, span
 
-def analyze_assoc_file():
+ASSOC_FILE = "/home/esp/data_analyze/01.06.2025_v2/data/init/gwas_results.assoc"
+
+def analyze_assoc_file(assoc_file=ASSOC_FILE, df=None, streaming=False, chunksize=DEFAULT_CHUNKSIZE):
     """
-    Детальный анализ .assoc файла
+    Детальный анализ .assoc файла.
+    df — уже загруженные данные (при запуске из общего конвейера);
+    streaming=True — потоковый режим блоками по chunksize строк для файлов,
+    не помещающихся в память (квантили describe() оцениваются по скетчу)
     """
     
-    assoc_file = "/home/esp/data_analyze/01.06.2025_v2/data/init/gwas_results.assoc"
-    
     try:
+        if streaming and df is None:
+            print(f"Потоковый анализ .assoc файла (блоки по {chunksize} строк)...")
+            with span('streaming_gwas_summary', file=assoc_file):
+                summary = streaming_gwas_summary(assoc_file, chunksize=chunksize)
+            print_streaming_summary(summary)
+            return summary
+        
         # Загрузка данных
-        print("Загрузка .assoc файла...")
-        df = pd.read_csv(assoc_file, sep='\t', low_memory=False)
+        if df is None:
+            print("Загрузка .assoc файла...")
+            with span('load_gwas', file=assoc_file) as s:
+                df = load_gwas(assoc_file)
+                s.count(rows=len(df))
         
         print(f"=== ОБЩАЯ ИНФОРМАЦИЯ ===")
         print(f"Размер данных: {df.shape}")
@@ -22,7 +34,8 @@ def analyze_assoc_file():
         print(df.head())
         
         print(f"\n=== СТАТИСТИЧЕСКАЯ СВОДКА ===")
-        print(df.describe())
+        with span('describe', rows=len(df)):
+            print(df.describe())
         
         # Анализ p-values если есть
         if 'P' in df.columns:
@@ -34,9 +47,11 @@ def analyze_assoc_file():
             print(f"Genome-wide significant (p < 5e-8): {len(p_values[p_values < 5e-8])}")
             
             # Топ значимые SNP
-            top_snps = df.nsmallest(10, 'P')
+            with span('nsmallest', rows=len(df)):
+                top_snps = df.nsmallest(10, 'P')
             print(f"\nТоп 10 наиболее значимых SNP:")
-            print(top_snps[['SNP', 'P'] if 'SNP' in df.columns else top_snps.iloc[:, [0, df.columns.get_loc('P')]]])
+            id_col = find_column(df.columns, 'id') or df.columns[0]
+            print(top_snps[[id_col, 'P']])
         
         # Анализ хромосом если есть
         if 'CHR' in df.columns:
@@ -47,7 +62,8 @@ def analyze_assoc_file():
         
         # Проверка на отсутствующие значения
         print(f"\n=== ОТСУТСТВУЮЩИЕ ЗНАЧЕНИЯ ===")
-        missing_data = df.isnull().sum()
+        with span('missing_values', rows=len(df)):
+            missing_data = df.isnull().sum()
         print(missing_data[missing_data > 0])
         
         return df
@@ -59,4 +75,15 @@ def analyze_assoc_file():
         return None
 
 if __name__ == "__main__":
-    df = analyze_assoc_file()
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description="Детальный анализ .assoc файла")
+    parser.add_argument('assoc_file', nargs='?', default=ASSOC_FILE)
+    parser.add_argument('--streaming', action='store_true',
+                        help="Потоковый режим с ограниченной памятью")
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE)
+    add_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+    with span('analyze_assoc_file'):
+        df = analyze_assoc_file(args.assoc_file, streaming=args.streaming, chunksize=args.chunksize)
+    TRACER.finish()
\ No newline at end of file
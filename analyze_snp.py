@@ -1,6 +1,7 @@
-import pandas as pd
-import numpy as np
-import os
+from candidate_lists import load_candidates
+from report_writer import ReportWriter
+from snp_index import SnpIndex
+from variant_matching import match_variants, summarize_matches
 
 def analyze_snp_data():
     """
@@ -12,30 +13,22 @@ def analyze_snp_data():
     gwas_file = "/home/esp/data_analyze/01.06.2025_v2/data/init/gwas_results.assoc"
     
     try:
-        # Чтение Excel файла с аллелями
+        # Чтение Excel файла с аллелями (колонки определяются по содержимому, результат кэшируется)
         print("Загрузка данных из Excel файла...")
-        df_excel = pd.read_excel(excel_file)
-        print(f"Структура Excel файла:")
-        print(df_excel.head())
-        print(f"Колонки: {df_excel.columns.tolist()}")
+        candidates = load_candidates(excel_file)
+        print(f"Определены колонки: {candidates.attrs['schema']}")
+        print(candidates.head())
         
-        # Попытка найти колонку с SNP ID
-        snp_columns = [col for col in df_excel.columns if 'snp' in col.lower() or 'rs' in col.lower()]
-        if not snp_columns:
-            # Если не найдены специфичные колонки, показываем первые несколько строк для ручного выбора
-            print("Автоматически не удалось определить колонку с SNP. Доступные колонки:")
-            for i, col in enumerate(df_excel.columns):
-                print(f"{i}: {col}")
-            return
-        
-        snp_column = snp_columns[0]
-        snp_list = df_excel[snp_column].dropna().unique().tolist()
-        print(f"Найдено {len(snp_list)} уникальных SNP в колонке '{snp_column}'")
+        snp_list = candidates['id'].tolist()
+        print(f"Найдено {len(snp_list)} уникальных SNP")
         
-        # Чтение GWAS результатов
-        print("\nЗагрузка GWAS результатов...")
-        df_gwas = pd.read_csv(gwas_file, sep='\t', low_memory=False)
-        print(f"Структура GWAS файла:")
+        # Чтение GWAS результатов: через индекс читаются только строки кандидатов
+        print("\nПоиск SNP в индексе GWAS результатов...")
+        index = SnpIndex(gwas_file)
+        matches = index.lookup(snp_list, candidates['chrom'], candidates['pos'])
+        df_gwas = index.fetch_rows(r for rows in matches['rows'] for r in rows)
+        print(f"Строк в GWAS файле: {index.n_rows}, прочитано по индексу: {len(df_gwas)}")
+        print(f"Структура GWAS файла (строки кандидатов):")
         print(df_gwas.head())
         print(f"Колонки: {df_gwas.columns.tolist()}")
         
@@ -50,23 +43,16 @@ def analyze_snp_data():
         
         # Поиск пересечений
         print("\nПоиск пересечений...")
-        found_snps = []
-        not_found_snps = []
-        
-        for snp in snp_list:
-            if pd.isna(snp):
-                continue
-            snp_str = str(snp).strip()
-            if snp_str in df_gwas[gwas_snp_column].values:
-                found_snps.append(snp_str)
-            else:
-                not_found_snps.append(snp_str)
+        matches = match_variants(candidates, df_gwas)
+        found_snps, not_found_snps, match_types = summarize_matches(candidates, matches)
         
         # Результаты поиска
         print(f"\n=== РЕЗУЛЬТАТЫ АНАЛИЗА ===")
         print(f"Всего SNP для поиска: {len(snp_list)}")
         print(f"Найдено в GWAS: {len(found_snps)}")
         print(f"Не найдено в GWAS: {len(not_found_snps)}")
+        for match_type, count in match_types.items():
+            print(f"  тип совпадения '{match_type}': {count}")
         
         if found_snps:
             print(f"\nНайденные SNP:")
@@ -85,7 +71,9 @@ def analyze_snp_data():
         # Создание детального отчета
         if found_snps:
             print("\nСоздание детального отчета...")
-            detailed_results = df_gwas[df_gwas[gwas_snp_column].isin(found_snps)].copy()
+            detailed_results = df_gwas.iloc[matches['gwas_row'].to_numpy()].copy()
+            detailed_results['QUERY'] = matches['query'].to_numpy()
+            detailed_results['MATCH_TYPE'] = matches['match_type'].astype(str).to_numpy()
             
             # Сохранение результатов
             output_file = "/home/esp/data_analyze/01.06.2025_v2/found_alzheimer_snps.csv"
@@ -100,21 +88,22 @@ def analyze_snp_data():
                 highly_significant = detailed_results[detailed_results['P'] < 0.001]
                 print(f"SNP с p-value < 0.001: {len(highly_significant)}")
         
-        # Создание сводного отчета
+        # Создание сводного отчета: списки SNP — в приложениях .ndjson рядом с JSON
+        summary_file = "/home/esp/data_analyze/01.06.2025_v2/snp_analysis_summary.json"
+        writer = ReportWriter(summary_file)
         summary_report = {
             'total_snps_searched': len(snp_list),
             'found_in_gwas': len(found_snps),
             'not_found_in_gwas': len(not_found_snps),
-            'found_snps_list': found_snps,
-            'not_found_snps_list': not_found_snps
+            'found_snps_list': writer.sidecar('found_snps', found_snps),
+            'not_found_snps_list': writer.sidecar('not_found_snps', not_found_snps),
+            'match_types': match_types
         }
         
         # Сохранение сводного отчета
-        import json
-        summary_file = "/home/esp/data_analyze/01.06.2025_v2/snp_analysis_summary.json"
-        with open(summary_file, 'w', encoding='utf-8') as f:
-            json.dump(summary_report, f, ensure_ascii=False, indent=2)
+        writer.write(summary_report)
         print(f"\nСводный отчет сохранен в: {summary_file}")
+        writer.print_timings()
         
     except Exception as e:
         print(f"Ошибка при анализе: {str(e)}")
@@ -0,0 +1,296 @@
+import argparse
+import contextlib
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from gwas_cache import ensure_cache, file_signature
+from instrumentation import TRACER, add_arguments, configure_from_args, span
+
+DEFAULT_MANIFEST = 'batch_manifest.json'
+COMPARISON_FILE = 'cohort_comparison.csv'
+SUMMARY_FILE = 'batch_summary.json'
+LOG_FILE = 'batch.log'
+# Стадии конвейера на уровне когорты (не зависят от списка кандидатов)
+COHORT_STAGES = ['loci']
+SIGNIFICANCE = 0.05
+
+
+def load_manifest(path):
+    """
+    Манифест пакетного запуска (JSON): когорты с генотипами, фенотипом и
+    списками кандидатов. Пути относительные к файлу манифеста; поля из
+    'defaults' применяются ко всем когортам. Когорта задается либо готовыми
+    результатами GWAS ('gwas'), либо генотипами ('bfile' + 'pheno') — тогда
+    GWAS считается в процессе (logistic_gwas.py).
+    """
+    with open(path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+
+    def resolve(value):
+        return value if value is None or os.path.isabs(value) else os.path.normpath(os.path.join(base, value))
+
+    defaults = manifest.get('defaults', {})
+    cohorts = []
+    for entry in manifest.get('cohorts', []):
+        cohort = {**defaults, **entry}
+        if 'name' not in cohort:
+            raise ValueError(f"Когорта без имени в манифесте: {entry}")
+        if not cohort.get('gwas') and not (cohort.get('bfile') and cohort.get('pheno')):
+            raise ValueError(f"Когорта '{cohort['name']}': нужен 'gwas' или пара 'bfile' + 'pheno'")
+        for key in ('gwas', 'bfile', 'pheno'):
+            cohort[key] = resolve(cohort.get(key))
+        cohort['candidates'] = [resolve(p) for p in cohort.get('candidates', [])]
+        if not cohort['candidates']:
+            raise ValueError(f"Когорта '{cohort['name']}': не заданы списки кандидатов")
+        names = [candidate_list_name(p) for p in cohort['candidates']]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Когорта '{cohort['name']}': совпадающие имена списков кандидатов {names}")
+        cohort.setdefault('pheno_name', 'PHENO')
+        cohorts.append(cohort)
+
+    names = [c['name'] for c in cohorts]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Повторяющиеся имена когорт: {names}")
+    output_dir = resolve(manifest.get('output_dir', 'batch_results'))
+    return cohorts, output_dir
+
+
+def candidate_list_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def _glm_key(cohort):
+    inputs = [cohort['bfile'] + ext for ext in ('.bed', '.bim', '.fam')] + [cohort['pheno']]
+    payload = {'inputs': {p: file_signature(p) for p in inputs}, 'pheno_name': cohort['pheno_name']}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def cohort_gwas(cohort, cohort_dir, glm_jobs=1, force=False):
+    """
+    Результаты GWAS когорты: заданный файл или GLM по генотипам (пересчет
+    только при изменении .bed/.bim/.fam, фенотипа или его имени)
+    """
+    if cohort.get('gwas'):
+        return cohort['gwas']
+    from logistic_gwas import run_glm
+    from run_pipeline import load_state, save_state
+    out_prefix = os.path.join(cohort_dir, cohort['name'])
+    out_file = f"{out_prefix}.{cohort['pheno_name']}.glm.logistic.hybrid"
+    state = load_state(cohort_dir)
+    key = _glm_key(cohort)
+    if not force and state.get('glm', {}).get('key') == key and os.path.exists(out_file):
+        print(f"[glm] входы не изменились — пропуск: {out_file}")
+        return out_file
+    out_file = run_glm(cohort['bfile'], cohort['pheno'], out_prefix, cohort['pheno_name'], jobs=glm_jobs)
+    state['glm'] = {'key': key, 'finished': datetime.now().isoformat()}
+    save_state(cohort_dir, state)
+    return out_file
+
+
+def run_cohort(cohort, output_dir, force=False, glm_jobs=1):
+    """
+    Анализ одной когорты (в процессе пула): GWAS при необходимости, стадии
+    уровня когорты и анализ по каждому списку кандидатов. Вывод пишется в
+    <когорта>/batch.log, чтобы логи параллельных когорт не перемешивались.
+    """
+    from run_pipeline import run_pipeline
+    cohort_dir = os.path.join(output_dir, cohort['name'])
+    os.makedirs(cohort_dir, exist_ok=True)
+    log_path = os.path.join(cohort_dir, LOG_FILE)
+    result = {'cohort': cohort['name'], 'dir': cohort_dir, 'log': log_path, 'lists': {}}
+    start = time.perf_counter()
+    with open(log_path, 'w', encoding='utf-8') as log, \
+            contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        try:
+            gwas = cohort_gwas(cohort, cohort_dir, glm_jobs, force)
+            result['gwas'] = gwas
+            # LD-кластеризация локусов по генотипам когорты, если .bed доступен
+            bfile = cohort['bfile'] if cohort.get('bfile') and os.path.exists(cohort['bfile'] + '.bed') else None
+            run_pipeline(gwas, None, cohort_dir, COHORT_STAGES, force, bfile=bfile)
+            for excel in cohort['candidates']:
+                list_dir = os.path.join(cohort_dir, candidate_list_name(excel))
+                run_pipeline(gwas, excel, list_dir, ['analysis'], force)
+                result['lists'][candidate_list_name(excel)] = list_dir
+            result['status'] = 'ok'
+        except Exception as e:
+            traceback.print_exc()
+            result.update(status='error', error=f'{type(e).__name__}: {e}')
+    result['seconds'] = round(time.perf_counter() - start, 2)
+    return result
+
+
+def prepare_shared_caches(cohorts):
+    """
+    Колоночные кэши GWAS строятся один раз в родительском процессе:
+    процессы пула только читают их (mmap) и не пересобирают одновременно
+    один и тот же файл, если несколько когорт ссылаются на общий GWAS
+    """
+    for gwas in sorted({c['gwas'] for c in cohorts if c.get('gwas')}):
+        if not os.path.exists(gwas):
+            # Ошибка будет отражена в результате когорты
+            continue
+        with span('ensure_cache', file=gwas):
+            ensure_cache(gwas)
+
+
+def _read_json(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _list_results(report_path):
+    """
+    Все кандидаты списка и лучшая (минимальное P) найденная строка GWAS по каждому
+    """
+    from report_writer import read_sidecar
+    report = _read_json(report_path)
+    details = report['detailed_results']
+    candidates = pd.concat([read_sidecar(report_path, details[key])
+                            for key in ('found_snps', 'not_found_snps')], ignore_index=True)
+    ids = candidates['SNP'].astype(str) if len(candidates) else pd.Series([], dtype=str)
+    found = pd.DataFrame(columns=['QUERY', 'MATCH_TYPE', 'P', 'OR'])
+    detailed = os.path.join(os.path.dirname(report_path), 'found_alzheimer_snps_detailed.csv')
+    if details.get('found_variants') and os.path.exists(detailed):
+        found = pd.read_csv(detailed, usecols=lambda c: c in ('QUERY', 'MATCH_TYPE', 'P', 'OR'))
+        found['QUERY'] = found['QUERY'].astype(str)
+        found = found.sort_values('P', kind='stable', na_position='last').drop_duplicates('QUERY')
+    found = found.reindex(columns=['QUERY', 'MATCH_TYPE', 'P', 'OR'])
+    return report['summary'], ids, found
+
+
+def cohort_comparison(results):
+    """
+    Сводная таблица по когортам: для каждого кандидата из каждого списка —
+    P, OR и тип совпадения в каждой когорте, число когорт, где вариант найден
+    и значим, минимальное P и согласованность направления эффекта (OR)
+    """
+    long_parts = []
+    for result in results:
+        if result.get('status') != 'ok':
+            continue
+        for list_name, list_dir in result['lists'].items():
+            summary, ids, found = _list_results(os.path.join(list_dir, 'complete_analysis_report.json'))
+            result.setdefault('list_summary', {})[list_name] = summary
+            part = pd.DataFrame({'SNP': ids}).merge(found, how='left', left_on='SNP', right_on='QUERY')
+            part = part.drop(columns='QUERY').assign(LIST=list_name, COHORT=result['cohort'])
+            long_parts.append(part)
+    if not long_parts:
+        return pd.DataFrame(columns=['LIST', 'SNP'])
+
+    long = pd.concat(long_parts, ignore_index=True).drop_duplicates(['LIST', 'SNP', 'COHORT'])
+    for column in ('P', 'OR'):
+        long[column] = pd.to_numeric(long[column], errors='coerce')
+    cohorts = list(dict.fromkeys(long['COHORT']))
+    wide = long.set_index(['LIST', 'SNP', 'COHORT'])[['P', 'OR', 'MATCH_TYPE']].unstack('COHORT')
+    table = pd.DataFrame(index=wide.index)
+    for cohort in cohorts:
+        for column in ('P', 'OR', 'MATCH_TYPE'):
+            table[f'{column}_{cohort}'] = wide[(column, cohort)]
+
+    p_columns = [f'P_{c}' for c in cohorts]
+    odds = table[[f'OR_{c}' for c in cohorts]].to_numpy(dtype='float64')
+    risk = (odds > 1).sum(1)
+    protective = (odds < 1).sum(1)
+    table['N_COHORTS_FOUND'] = table[[f'MATCH_TYPE_{c}' for c in cohorts]].notna().sum(1)
+    table[f'N_COHORTS_P<{SIGNIFICANCE}'] = (table[p_columns] < SIGNIFICANCE).sum(1)
+    table['MIN_P'] = table[p_columns].min(axis=1)
+    table['OR_CONSISTENT'] = np.where((risk + protective) > 0, (risk == 0) | (protective == 0), pd.NA)
+    table = table.reset_index().sort_values(
+        ['LIST', f'N_COHORTS_P<{SIGNIFICANCE}', 'N_COHORTS_FOUND', 'MIN_P'],
+        ascending=[True, False, False, True], kind='stable', na_position='last')
+    return table.reset_index(drop=True)
+
+
+def run_batch(manifest_path=DEFAULT_MANIFEST, output_dir=None, jobs=None, force=False, glm_jobs=1):
+    """
+    Пакетный анализ всех когорт манифеста в пуле процессов и сводная
+    таблица сравнения когорт (cohort_comparison.csv, batch_summary.json)
+    """
+    print("=== ПАКЕТНЫЙ АНАЛИЗ КОГОРТ ===")
+    print(f"Время начала: {datetime.now()}")
+    cohorts, manifest_output = load_manifest(manifest_path)
+    output_dir = os.path.abspath(output_dir or manifest_output)
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = jobs or min(len(cohorts), os.cpu_count() or 1)
+    print(f"Когорт: {len(cohorts)}, процессов: {jobs}, результаты: {output_dir}")
+
+    prepare_shared_caches(cohorts)
+
+    results = {}
+    with span('cohorts', jobs=jobs), ProcessPoolExecutor(
+            max_workers=jobs, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = {pool.submit(run_cohort, cohort, output_dir, force, glm_jobs): cohort['name']
+                   for cohort in cohorts}
+        for future in as_completed(futures):
+            result = future.result()
+            results[result['cohort']] = result
+            if result['status'] == 'ok':
+                print(f"✅ {result['cohort']}: {result['seconds']:.1f} с")
+            else:
+                print(f"❌ {result['cohort']}: {result['error']} (лог: {result['log']})")
+    results = [results[c['name']] for c in cohorts]
+
+    with span('cohort_comparison') as s:
+        comparison = cohort_comparison(results)
+        comparison_file = os.path.join(output_dir, COMPARISON_FILE)
+        comparison.to_csv(comparison_file, index=False)
+        s.count(rows=len(comparison))
+
+    for result in results:
+        loci = _read_json(os.path.join(result['dir'], 'post_gwas_summary.json'))
+        if loci:
+            result['genomic_control_lambda'] = loci['genomic_control_lambda']
+            result['n_loci'] = loci['n_loci']
+    summary = {
+        'analysis_date': datetime.now().isoformat(),
+        'manifest': os.path.abspath(manifest_path),
+        'output_dir': output_dir,
+        'cohorts': results,
+        'comparison_file': COMPARISON_FILE,
+    }
+    summary_file = os.path.join(output_dir, SUMMARY_FILE)
+    tmp_path = summary_file + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2, default=str)
+    os.replace(tmp_path, summary_file)
+
+    print("\n=== ИТОГИ ПО КОГОРТАМ ===")
+    for result in results:
+        lists = ', '.join(f"{name}: {s['found_snps_count']}/{s['total_snps_from_excel']}"
+                          for name, s in result.get('list_summary', {}).items())
+        print(f"  {result['cohort']:<16} {result['status']:<6} {result['seconds']:8.1f} с   {lists}")
+    print(f"Сравнение когорт: {comparison_file}")
+    print(f"Сводка: {summary_file}")
+    print(f"Время завершения: {datetime.now()}")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Пакетный анализ нескольких когорт по манифесту")
+    parser.add_argument('manifest', nargs='?', default=DEFAULT_MANIFEST, help="JSON-манифест когорт")
+    parser.add_argument('--output-dir', default=None, help="Директория результатов (по умолчанию из манифеста)")
+    parser.add_argument('--jobs', type=int, default=None, help="Число процессов (по умолчанию — по числу когорт)")
+    parser.add_argument('--glm-jobs', type=int, default=1, help="Потоков GLM внутри каждого процесса")
+    parser.add_argument('--force', action='store_true', help="Пересчитать все стадии")
+    add_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+    try:
+        summary = run_batch(args.manifest, args.output_dir, args.jobs, args.force, args.glm_jobs)
+    finally:
+        TRACER.finish()
+    if any(r['status'] != 'ok' for r in summary['cohorts']):
+        sys.exit(1)
@@ -0,0 +1,250 @@
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import synthetic_data
+
+DEFAULT_VARIANTS = [10_000, 100_000]
+DEFAULT_SAMPLES = [100, 1000]
+# Допустимый рост относительно эталона, прежде чем стадия считается регрессией
+TIME_TOLERANCE = 0.25
+MEMORY_TOLERANCE = 0.25
+# Стадии короче этого времени не сравниваются (шум таймера)
+MIN_COMPARABLE_SECONDS = 0.5
+
+
+def _stage_analysis(paths, work_dir):
+    from complete_analysis import complete_snp_analysis
+    if complete_snp_analysis(paths['excel'], paths['assoc'], work_dir) is None:
+        raise RuntimeError('complete_snp_analysis завершился с ошибкой')
+
+
+def _stage_plots(paths, work_dir):
+    from create_visualizations import create_gwas_visualizations
+    if create_gwas_visualizations(paths['assoc'], os.path.join(work_dir, 'plots.pdf')) is None:
+        raise RuntimeError('create_gwas_visualizations завершился с ошибкой')
+
+
+def _stage_assoc_report(paths, work_dir):
+    from analyze_assoc_file import analyze_assoc_file
+    if analyze_assoc_file(paths['assoc']) is None:
+        raise RuntimeError('analyze_assoc_file завершился с ошибкой')
+
+
+def _stage_loci(paths, work_dir):
+    from post_gwas import post_gwas_report
+    post_gwas_report(paths['glm'], work_dir)
+
+
+def _stage_glm(paths, work_dir):
+    # Ассоциация в процессе — то, что first_step.py делает через plink2 --glm
+    from logistic_gwas import run_glm
+    run_glm(paths['bfile'], paths['pheno'], os.path.join(work_dir, 'bench'))
+
+
+def _stage_plink2_glm(paths, work_dir):
+    subprocess.run([paths['plink2'], '--bfile', paths['bfile'], '--pheno', paths['pheno'],
+                    '--pheno-name', 'PHENO', '--glm', 'allow-no-covars',
+                    '--out', os.path.join(work_dir, 'plink2')],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def _stage_pheno_sync(paths, work_dir):
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'code'))
+    from pheno_sync import sync_phenotypes
+    fam_copy = os.path.join(work_dir, 'bench.fam')
+    shutil.copy(paths['bfile'] + '.fam', fam_copy)
+    sync_phenotypes(paths['pheno'], [fam_copy])
+
+
+# Стадия -> (функция, требуются ли генотипы)
+STAGES = {
+    'analysis': (_stage_analysis, False),
+    'plots': (_stage_plots, False),
+    'assoc_report': (_stage_assoc_report, False),
+    'loci': (_stage_loci, False),
+    'glm': (_stage_glm, True),
+    'pheno_sync': (_stage_pheno_sync, True),
+    'plink2_glm': (_stage_plink2_glm, True),
+}
+
+
+def _peak_rss_mb():
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / 1024
+
+
+def _worker(stage, paths, work_dir, conn):
+    """
+    Стадия в отдельном процессе (spawn): пиковая память не включает
+    память родителя и предыдущих стадий
+    """
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            STAGES[stage][0](paths, work_dir)
+            elapsed = time.perf_counter() - start
+        conn.send({'status': 'ok', 'seconds': elapsed, 'peak_rss_mb': _peak_rss_mb()})
+    except Exception as e:
+        conn.send({'status': 'error', 'error': f'{type(e).__name__}: {e}'})
+    finally:
+        conn.close()
+
+
+def run_stage(stage, paths, work_dir):
+    ctx = multiprocessing.get_context('spawn')
+    parent, child = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_worker, args=(stage, paths, work_dir, child))
+    process.start()
+    child.close()
+    result = parent.recv() if parent.poll(None) else {'status': 'error', 'error': 'нет ответа'}
+    process.join()
+    return result
+
+
+def prepare_data(data_dir, n_variants, n_samples=None, n_candidates=100, hit_rate=0.3, seed=0):
+    """
+    Синтетические входы сценария; уже сгенерированные файлы переиспользуются
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    base = os.path.join(data_dir, f'synthetic_{n_variants}')
+    paths = {'assoc': base + '.assoc', 'glm': base + '.PHENO.glm.logistic.hybrid',
+             'excel': f'{base}_candidates_{n_candidates}_{hit_rate}.xlsx'}
+    if not os.path.exists(paths['assoc']):
+        synthetic_data.generate_gwas(paths['assoc'], n_variants, 'assoc', seed)
+    if not os.path.exists(paths['glm']):
+        synthetic_data.generate_gwas(paths['glm'], n_variants, 'glm', seed)
+    if not os.path.exists(paths['excel']):
+        synthetic_data.generate_candidates(paths['excel'], n_variants, n_candidates, hit_rate, seed)
+    if n_samples:
+        prefix = f'{base}_{n_samples}'
+        if not os.path.exists(prefix + '.bed'):
+            synthetic_data.generate_bfile(prefix, n_variants, n_samples, seed)
+        paths.update(bfile=prefix, pheno=prefix + '.phenotype')
+    return paths
+
+
+def run_benchmarks(variants, samples, stages, data_dir, repeat=1, plink2=None,
+                   n_candidates=100, hit_rate=0.3):
+    """
+    Все сценарии (число вариантов x число образцов) и стадии. Стадии по
+    файлам GWAS зависят только от числа вариантов и запускаются один раз
+    на размер. Первый запуск — «холодный» (строятся кэш и индекс).
+    """
+    results = []
+    for n_variants in variants:
+        for n_samples in ([None] + list(samples)):
+            for stage in stages:
+                needs_genotypes = STAGES[stage][1]
+                if needs_genotypes != (n_samples is not None):
+                    continue
+                if stage == 'plink2_glm' and not plink2:
+                    continue
+                paths = prepare_data(data_dir, n_variants, n_samples, n_candidates, hit_rate)
+                paths['plink2'] = plink2
+                work_dir = os.path.join(data_dir, 'work', f'{stage}_{n_variants}_{n_samples}')
+                # Холодный старт: кэш и индекс GWAS строятся в первом повторе
+                for suffix in ('.cache', '.snpidx'):
+                    for key in ('assoc', 'glm'):
+                        shutil.rmtree(paths[key] + suffix, ignore_errors=True)
+                os.makedirs(work_dir, exist_ok=True)
+                runs = [run_stage(stage, paths, work_dir) for _ in range(repeat)]
+                ok = [r for r in runs if r['status'] == 'ok']
+                entry = {'stage': stage, 'variants': n_variants, 'samples': n_samples,
+                         'runs': runs}
+                if ok:
+                    entry.update(seconds=min(r['seconds'] for r in ok),
+                                 cold_seconds=ok[0]['seconds'],
+                                 peak_rss_mb=max(r['peak_rss_mb'] for r in ok))
+                    print(f"{stage:<13} variants={n_variants:<10} samples={n_samples or '—':<7} "
+                          f"{entry['seconds']:9.2f} с  (холодный {entry['cold_seconds']:.2f} с)  "
+                          f"пик {entry['peak_rss_mb']:.0f} МБ")
+                else:
+                    print(f"{stage:<13} variants={n_variants:<10} samples={n_samples or '—':<7} "
+                          f"ОШИБКА: {runs[0].get('error')}")
+                results.append(entry)
+    return results
+
+
+def _scenario_key(entry):
+    return (entry['stage'], entry['variants'], entry['samples'])
+
+
+def compare_with_baseline(results, baseline, time_tolerance=TIME_TOLERANCE,
+                          memory_tolerance=MEMORY_TOLERANCE):
+    """
+    Регрессии относительно эталона: рост времени или пиковой памяти сверх допуска
+    """
+    reference = {_scenario_key(e): e for e in baseline['results'] if 'seconds' in e}
+    regressions = []
+    for entry in results:
+        ref = reference.get(_scenario_key(entry))
+        if ref is None or 'seconds' not in entry:
+            continue
+        if (max(entry['seconds'], ref['seconds']) >= MIN_COMPARABLE_SECONDS
+                and entry['seconds'] > ref['seconds'] * (1 + time_tolerance)):
+            regressions.append({**dict(zip(('stage', 'variants', 'samples'), _scenario_key(entry))),
+                                'metric': 'seconds', 'baseline': ref['seconds'], 'current': entry['seconds']})
+        if entry['peak_rss_mb'] > ref['peak_rss_mb'] * (1 + memory_tolerance):
+            regressions.append({**dict(zip(('stage', 'variants', 'samples'), _scenario_key(entry))),
+                                'metric': 'peak_rss_mb', 'baseline': ref['peak_rss_mb'],
+                                'current': entry['peak_rss_mb']})
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Бенчмарк стадий анализа на синтетических данных')
+    parser.add_argument('--variants', type=float, nargs='+', default=DEFAULT_VARIANTS,
+                        help='Числа вариантов (1e4 ... 1e8)')
+    parser.add_argument('--samples', type=float, nargs='+', default=DEFAULT_SAMPLES,
+                        help='Числа образцов для стадий по генотипам (1e2 ... 1e5)')
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), default=list(STAGES))
+    parser.add_argument('--data-dir', default='benchmark_data', help='Синтетические данные (переиспользуются)')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--candidates', type=int, default=100, help='Размер списка кандидатов в Excel')
+    parser.add_argument('--hit-rate', type=float, default=0.3, help='Доля кандидатов, присутствующих в GWAS')
+    parser.add_argument('--plink2', default=None, help='Путь к plink2 для стадии plink2_glm')
+    parser.add_argument('--baseline', default=None, help='Эталонный JSON для поиска регрессий')
+    parser.add_argument('--save-baseline', default=None, help='Сохранить результаты как эталон')
+    parser.add_argument('--time-tolerance', type=float, default=TIME_TOLERANCE)
+    parser.add_argument('--memory-tolerance', type=float, default=MEMORY_TOLERANCE)
+    args = parser.parse_args()
+
+    results = run_benchmarks([int(v) for v in args.variants], [int(s) for s in args.samples],
+                             args.stages, args.data_dir, args.repeat, args.plink2,
+                             args.candidates, args.hit_rate)
+    report = {
+        'created': datetime.now().isoformat(),
+        'host': {'platform': platform.platform(), 'python': platform.python_version(),
+                 'cpus': os.cpu_count()},
+        'results': results,
+    }
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        report['regressions'] = compare_with_baseline(results, baseline, args.time_tolerance,
+                                                      args.memory_tolerance)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f'Результаты: {args.output}')
+    if args.save_baseline:
+        shutil.copy(args.output, args.save_baseline)
+        print(f'Эталон сохранен: {args.save_baseline}')
+
+    if report.get('regressions'):
+        print('❌ Регрессии относительно эталона:')
+        for r in report['regressions']:
+            print(f"   {r['stage']} variants={r['variants']} samples={r['samples']}: "
+                  f"{r['metric']} {r['baseline']:.2f} -> {r['current']:.2f}")
+        sys.exit(1)
@@ -0,0 +1,292 @@
+import io
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from gwas_cache import file_hash, file_signature
+from snp_index import ID_POSITION_PATTERN, normalize_chrom
+
+# Версия формата кэша списков: при изменении разбора старые кэши пересобираются
+CANDIDATE_CACHE_VERSION = 1
+
+# Колонки нормализованного списка (как ожидает variant_matching.match_variants)
+CANDIDATE_COLUMNS = ['id', 'chrom', 'pos', 'ref', 'alt']
+
+# Слова заголовков по ролям (сравниваются целые слова заголовка, а не подстроки)
+HEADER_KEYWORDS = {
+    'id': {'snp', 'snps', 'rs', 'rsid', 'rs_id', 'id', 'snp_id', 'variant', 'variant_id',
+           'marker', 'name', 'snp_name', 'полиморфизм', 'маркер'},
+    'chrom': {'chr', 'chrom', '#chrom', 'chromosome', 'хромосома', 'хр'},
+    'pos': {'pos', 'bp', 'position', 'base_pair', 'позиция', 'координата'},
+    'alt': {'a1', 'alt', 'effect', 'effect_allele', 'risk', 'risk_allele', 'minor',
+            'minor_allele', 'риск', 'аллель_риска'},
+    'ref': {'a2', 'ref', 'other', 'other_allele', 'non_effect_allele', 'major', 'major_allele'},
+}
+
+# Доля непустых значений колонки, которая должна соответствовать роли по содержимому
+CONTENT_THRESHOLD = 0.8
+
+_RSID = re.compile(r'^rs\d+$')
+_CHROM = re.compile(r'^(?:chr)?([0-9]{1,2}|x|y|xy|mt|m)$')
+_ALLELE = re.compile(r'^[acgt]+$|^[-.id]$')
+
+
+def default_cache_path(path):
+    """
+    Кэш списка рядом с исходным файлом: <файл>.candidates.npz
+    """
+    return os.path.abspath(path) + '.candidates.npz'
+
+
+def _header_words(name):
+    words = re.split(r'[\s/()]+', str(name).strip().lower())
+    return {w for w in words if w} | {str(name).strip().lower().replace(' ', '_')}
+
+
+def _text(series):
+    """
+    Строковые значения колонки без пробелов (включая неразрывные) и без '.0' от Excel
+    """
+    text = series.dropna().astype(str).str.replace('\xa0', ' ').str.strip().str.lower()
+    return text[text != ''].str.replace(r'^(\d+)\.0$', r'\1', regex=True)
+
+
+def content_scores(series):
+    """
+    Доли значений колонки, похожих на rsID, ID с позицией, хромосому, позицию и аллель
+    """
+    text = _text(series)
+    if text.empty:
+        return dict.fromkeys(['rsid', 'id_position', 'id', 'chrom', 'pos', 'allele'], 0.0)
+    compact = text.str.replace(r'\s+', '', regex=True)
+    numeric = pd.to_numeric(text, errors='coerce')
+    rsid = compact.str.match(_RSID)
+    id_position = compact.str.replace('-', ':', regex=False).str.match(ID_POSITION_PATTERN)
+    return {
+        'rsid': rsid.mean(),
+        'id_position': id_position.mean(),
+        # Любая форма ID, включая номера rsID без префикса
+        'id': (rsid | id_position | compact.str.fullmatch(r'\d+')).mean(),
+        'chrom': text.str.match(_CHROM).mean(),
+        'pos': (numeric.gt(1000) & (numeric % 1 == 0)).mean(),
+        'allele': text.str.match(_ALLELE).mean(),
+    }
+
+
+def detect_schema(table):
+    """
+    Определение колонок ID / CHR / POS / аллелей по заголовку и содержимому.
+    Содержимое решает, заголовок лишь добавляет вес: колонка 'Variant' с
+    позициями вида chr1:12345 будет ID, колонка 'SNP' с rsID — тоже, а
+    текстовый столбец 'Gene' с подстрокой 'n' в заголовке — нет.
+    Возвращает {роль: имя колонки}.
+    """
+    scores = {col: content_scores(table[col]) for col in table.columns}
+    headers = {col: _header_words(col) for col in table.columns}
+
+    def header(col, role):
+        return 0.5 if headers[col] & HEADER_KEYWORDS[role] else 0.0
+
+    # ID: почти все значения — ID, и хотя бы половина — rsID или позиции (а не просто числа)
+    schema = {}
+    ids = [c for c in table.columns if scores[c]['id'] >= CONTENT_THRESHOLD
+           and scores[c]['rsid'] + scores[c]['id_position'] >= 0.5]
+    if ids:
+        schema['id'] = max(ids, key=lambda c: scores[c]['id'] + header(c, 'id'))
+
+    # Позиция — крупные целые, хромосома — 1..26/X/Y/MT (мелкие целые без заголовка
+    # не считаются хромосомой: это может быть номер строки)
+    free = [c for c in table.columns if c not in schema.values()]
+    pos = [c for c in free if scores[c]['pos'] >= CONTENT_THRESHOLD]
+    chrom = [c for c in free if scores[c]['chrom'] >= CONTENT_THRESHOLD
+             and (header(c, 'chrom') or scores[c]['chrom'] > scores[c]['pos'] and
+                  table[c].dtype == object)]
+    if pos and chrom:
+        schema['pos'] = max(pos, key=lambda c: header(c, 'pos'))
+        schema['chrom'] = max(chrom, key=lambda c: header(c, 'chrom'))
+
+    # ID произвольного вида (Affx-..., внутренние названия) — по заголовку;
+    # без заголовка и позиций — первая колонка, как раньше
+    if 'id' not in schema:
+        named = [c for c in table.columns if header(c, 'id') and c not in schema.values()]
+        if named:
+            schema['id'] = named[0]
+        elif 'chrom' not in schema and len(table.columns):
+            schema['id'] = table.columns[0]
+
+    alleles = [c for c in table.columns if c not in schema.values()
+               and scores[c]['allele'] >= CONTENT_THRESHOLD]
+    # Порядок аллелей важен только при явном заголовке: сравнение аллелей не учитывает порядок
+    for role in ('alt', 'ref'):
+        named = [c for c in alleles if header(c, role)]
+        if named:
+            schema[role] = named[0]
+            alleles.remove(named[0])
+    if 'alt' not in schema and 'ref' not in schema and len(alleles) >= 2:
+        schema['alt'], schema['ref'] = alleles[0], alleles[1]
+    if ('alt' in schema) != ('ref' in schema):
+        schema.pop('alt', None)
+        schema.pop('ref', None)
+    return schema
+
+
+def normalize_ids(values):
+    """
+    Единый вид ID: без пробелов, 'RS 123' / 'Rs123' -> 'rs123', числа
+    в колонке rsID -> 'rs<число>', позиции 'chr1-12345' / '1_12345_A_G' -> '1:12345'.
+    Остальные ID (1kg_1_159759291, imm_9_34822919, Affx-...) — как есть,
+    без лишних пробелов: они разбираются при сопоставлении.
+    """
+    raw = pd.Series(values).astype(str).str.replace('\xa0', ' ').str.strip()
+    ids = raw.str.replace(r'^(\d+)\.0$', r'\1', regex=True)
+    compact = ids.str.replace(r'\s+', '', regex=True)
+    lower = compact.str.lower()
+    rsid = lower.str.match(_RSID)
+    ids = ids.where(~rsid, lower)
+    # Номера без префикса — только если остальные ID в основном rsID
+    digits = lower.str.fullmatch(r'\d+')
+    if (~digits).any() and rsid[~digits].mean() >= 0.5:
+        ids = ids.where(~digits, 'rs' + lower)
+    plain_position = lower.str.fullmatch(r'(?:chr)?([0-9]{1,2}|x|y|xy|mt|m)[:_\-](\d+)(?:[:_\-][a-z]+[:_\-][a-z]+)?')
+    parts = lower[plain_position].str.extract(r'^(?:chr)?([0-9a-z]{1,2})[:_\-](\d+)')
+    if len(parts):
+        ids[plain_position] = normalize_chrom(parts[0]) + ':' + parts[1]
+    return ids
+
+
+def parse_candidate_table(table):
+    """
+    Нормализованный список кандидатов из произвольной таблицы: колонки
+    id, chrom, pos, ref, alt (отсутствующие — пустые), по одной строке на ID.
+    Если ID нет, но есть хромосома и позиция, ID = '<CHR>:<BP>'.
+    """
+    table = table.dropna(how='all').dropna(axis=1, how='all')
+    # Заголовок, похожий на данные (rs123 / 1:12345), — значит, в файле нет строки заголовка
+    header_scores = content_scores(pd.Series([str(c) for c in table.columns]))
+    if header_scores['rsid'] + header_scores['id_position'] > 0:
+        first = pd.DataFrame([list(table.columns)], columns=range(table.shape[1]))
+        table = pd.concat([first, table.set_axis(range(table.shape[1]), axis=1)], ignore_index=True)
+    schema = detect_schema(table)
+
+    result = pd.DataFrame(index=table.index, columns=CANDIDATE_COLUMNS, dtype=object)
+    if 'chrom' in schema:
+        result['chrom'] = normalize_chrom(table[schema['chrom']].where(table[schema['chrom']].notna(), '0'))
+        result['pos'] = pd.to_numeric(table[schema['pos']], errors='coerce')
+    for role in ('ref', 'alt'):
+        if role in schema:
+            result[role] = table[schema[role]].astype(str).str.strip().str.upper()
+    if 'id' in schema:
+        result['id'] = normalize_ids(table[schema['id']]).where(table[schema['id']].notna())
+    elif 'chrom' in schema:
+        known = result['pos'].gt(0) & result['chrom'].ne('0')
+        result.loc[known, 'id'] = (result.loc[known, 'chrom'] + ':'
+                                   + result.loc[known, 'pos'].astype('int64').astype(str))
+    else:
+        raise ValueError(f"Не найдена колонка с ID SNP или CHR/POS (колонки: {list(table.columns)})")
+
+    result['pos'] = pd.to_numeric(result['pos'], errors='coerce').fillna(0).astype('int64')
+    result = result[result['id'].notna() & result['id'].ne('') & result['id'].str.lower().ne('nan')]
+    result = result.drop_duplicates('id', keep='first').reset_index(drop=True)
+    result.attrs['schema'] = {role: str(col) for role, col in schema.items()}
+    return result
+
+
+def read_table(path, sheet=0):
+    """
+    Исходная таблица списка: Excel (.xlsx/.xls), иначе CSV/TSV/текст с автоопределением разделителя
+    """
+    if path.lower().endswith(('.xlsx', '.xls', '.xlsm')):
+        return pd.read_excel(path, sheet_name=sheet)
+    return pd.read_csv(path, sep=None, engine='python')
+
+
+def _save_cache(cache_path, candidates, meta):
+    arrays = {col: candidates[col].fillna('').astype(str).str.encode('utf-8').to_numpy(dtype='S')
+              for col in ('id', 'chrom', 'ref', 'alt')}
+    arrays['pos'] = candidates['pos'].to_numpy(dtype='int64')
+    arrays['meta'] = np.frombuffer(json.dumps(meta, ensure_ascii=False).encode('utf-8'), dtype='uint8')
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    # Атомарная запись: кэш либо прежний, либо новый целиком
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(buffer.getvalue())
+    os.replace(tmp_path, cache_path)
+
+
+def _load_cache(cache_path):
+    with np.load(cache_path, allow_pickle=False) as data:
+        meta = json.loads(data['meta'].tobytes().decode('utf-8'))
+        candidates = pd.DataFrame({col: np.char.decode(data[col], 'utf-8').astype(object)
+                                   for col in ('id', 'chrom', 'ref', 'alt')})
+        candidates['pos'] = data['pos']
+    candidates = candidates[CANDIDATE_COLUMNS].replace({'chrom': {'': None}, 'ref': {'': None},
+                                                       'alt': {'': None}})
+    return candidates, meta
+
+
+def load_candidates(path, sheet=0, cache_path=None, refresh=False):
+    """
+    Список SNP-кандидатов из Excel/CSV: колонки определяются по содержимому
+    и заголовку, ID нормализуются. Разобранный список сохраняется рядом
+    с файлом (.candidates.npz) с SHA-256 источника: повторная загрузка
+    не разбирает Excel, пока содержимое файла не изменилось.
+    Возвращает DataFrame (id, chrom, pos, ref, alt); attrs['schema'] —
+    найденные колонки, attrs['cached'] — взят ли результат из кэша.
+    """
+    cache_path = cache_path or default_cache_path(path)
+    signature = file_signature(path)
+    source_hash = None
+    if not refresh and os.path.exists(cache_path):
+        try:
+            candidates, meta = _load_cache(cache_path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️ Кэш списка {cache_path} поврежден, пересборка: {e}")
+            meta = None
+        if meta and meta.get('version') == CANDIDATE_CACHE_VERSION and meta.get('sheet') == sheet:
+            fresh = all(meta.get(k) == v for k, v in signature.items())
+            if not fresh and meta.get('size') == signature['size']:
+                source_hash = file_hash(path)
+                fresh = meta.get('source_sha256') == source_hash
+            if fresh:
+                candidates.attrs.update(schema=meta['schema'], cached=True)
+                return candidates
+
+    candidates = parse_candidate_table(read_table(path, sheet))
+    meta = {'version': CANDIDATE_CACHE_VERSION, 'source': os.path.abspath(path),
+            'source_sha256': source_hash or file_hash(path), 'sheet': sheet,
+            'schema': candidates.attrs['schema'], 'n_rows': int(len(candidates))}
+    meta.update(signature)
+    try:
+        _save_cache(cache_path, candidates, meta)
+    except OSError as e:
+        # Каталог только для чтения — работаем без кэша
+        print(f"⚠️ Не удалось сохранить кэш списка {cache_path}: {e}")
+    candidates.attrs['cached'] = False
+    return candidates
+
+
+def candidate_ids(path, sheet=0):
+    """
+    Только нормализованные ID кандидатов (в порядке файла, без повторов)
+    """
+    return load_candidates(path, sheet)['id'].tolist()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Разбор и кэширование списков SNP-кандидатов")
+    parser.add_argument('files', nargs='+', help="Excel/CSV со списками SNP")
+    parser.add_argument('--sheet', default=0, help="Лист Excel (номер или имя)")
+    parser.add_argument('--refresh', action='store_true', help="Пересобрать кэш")
+    args = parser.parse_args()
+    sheet = int(args.sheet) if str(args.sheet).isdigit() else args.sheet
+
+    for path in args.files:
+        candidates = load_candidates(path, sheet, refresh=args.refresh)
+        source = 'кэш' if candidates.attrs['cached'] else 'разбор'
+        print(f"{path}: {len(candidates)} SNP ({source}), колонки: {candidates.attrs['schema']}")
+        print(candidates.head().to_string(index=False))
@@ -1,7 +1,32 @@
-import pandas as pd
+import argparse
 import glob
 import os
 import subprocess
+import sys
+
+from pheno_sync import print_sync_report, sync_phenotypes
+from plink_shards import run_glm_sharded
+from step_cache import StepManifest
+
+parser = argparse.ArgumentParser(description='Обновление фенотипов, объединение батчей и GWAS (PLINK)')
+parser.add_argument('--glm-jobs', type=int, default=1,
+                    help='Число параллельных заданий GLM по хромосомам (1 — один процесс на весь геном)')
+parser.add_argument('--glm-threads', type=int, default=None, help='--threads для каждого задания plink2')
+parser.add_argument('--glm-memory', type=int, default=None, help='--memory (МБ) для каждого задания plink2')
+parser.add_argument('--shard-window', type=int, default=None,
+                    help='Делить хромосомы на диапазоны позиций такой длины (п.н.)')
+parser.add_argument('--glm-retries', type=int, default=1, help='Повторы упавшего задания GLM')
+parser.add_argument('--glm-engine', choices=['plink2', 'python'], default='plink2',
+                    help='python — логистическая регрессия в процессе по merged_all_bed (logistic_gwas.py)')
+parser.add_argument('--force', action='store_true', help='Выполнить все шаги, игнорируя манифест')
+parser.add_argument('--skip-fam-update', action='store_true',
+                    help='Не переписывать .fam: GLM все равно получает фенотип через --pheno')
+parser.add_argument('--skip-qc', action='store_true', help='Не выполнять QC генотипов перед GLM')
+parser.add_argument('--geno', type=float, default=0.05, help='QC: максимальная доля пропусков варианта')
+parser.add_argument('--mind', type=float, default=0.1, help='QC: максимальная доля пропусков образца')
+parser.add_argument('--maf', type=float, default=0.01, help='QC: минимальная частота минорного аллеля')
+parser.add_argument('--hwe', type=float, default=1e-6, help='QC: порог p-value HWE (по контролям)')
+args = parser.parse_args()
 
 # Пути
 base_dir = os.path.abspath(os.path.dirname(__file__))
@@ -12,17 +37,24 @@ os.makedirs(out_dir, exist_ok=True)
 pheno_path = os.path.join(data_dir, 'merged_all.phenotype')
 plink2_path = os.path.join(base_dir, '../plink2_linux_avx2_20250411', 'plink2')
 
-# 1. Обновление .fam-файлов с фенотипами
-print('Обновление .fam-файлов с фенотипами...')
-pheno = pd.read_csv(pheno_path, delim_whitespace=True)
-pheno_dict = dict(zip(pheno['IID'], pheno['PHENO']))
+# Манифест шагов: шаг пропускается, если его команда и входы не изменились
+manifest = StepManifest(os.path.join(out_dir, 'steps_manifest.json'))
+if args.force:
+    manifest.data['steps'] = {}
 
-fam_files = glob.glob(os.path.join(data_dir, '*', '*.fam'))
-for fam_path in fam_files:
-    fam = pd.read_csv(fam_path, delim_whitespace=True, header=None)
-    fam[5] = fam[1].map(pheno_dict).fillna(-9).astype(int)
-    fam.to_csv(fam_path, sep=' ', header=False, index=False)
-    print(f'Обновлен: {fam_path}')
+# 1. Обновление .fam-файлов с фенотипами: одно соединение по (FID, IID) для всех батчей
+fam_files = sorted(glob.glob(os.path.join(data_dir, '*', '*.fam')))
+if args.skip_fam_update:
+    print('Обновление .fam пропущено (фенотип передается в GLM через --pheno)')
+else:
+    print('Обновление .fam-файлов с фенотипами...')
+    manifest.run('fam_update', ['pheno_sync', 'FID+IID->PHENO', '-9'],
+                 [pheno_path] + [(p, 'fam_identity') for p in fam_files], fam_files,
+                 lambda: print_sync_report(sync_phenotypes(pheno_path, fam_files)))
+
+def bfile_inputs(prefix):
+    # Фенотип в .fam не учитывается: GLM берет его из --pheno
+    return [prefix + '.bed', prefix + '.bim', (prefix + '.fam', 'fam_identity')]
 
 # 2. Объединение .bed файлов через PLINK 1.9 (так как PLINK 2.0 не поддерживает merge)
 print('Объединение .bed-файлов с помощью PLINK 1.9...')
@@ -33,41 +65,105 @@ bfiles = [
     os.path.join(data_dir, '3.2-zapusk', '13-sample_binary'),
 ]
 bmerge_list_path = os.path.join(base_dir, 'bmerge_list.txt')
-with open(bmerge_list_path, 'w') as f:
-    for b in bfiles[1:]:
-        f.write(b + '\n')
 merged_prefix_bed = os.path.join(out_dir, 'merged_all_bed')
 
 plink1_9_path = '../plink_1.9/plink'
-subprocess.run([
+bmerge_cmd = [
     plink1_9_path,
     '--bfile', bfiles[0],
     '--merge-list', bmerge_list_path,
     '--make-bed',
     '--allow-no-sex',
     '--out', merged_prefix_bed
-], check=True)
+]
+
+def run_bmerge():
+    with open(bmerge_list_path, 'w') as f:
+        for b in bfiles[1:]:
+            f.write(b + '\n')
+    subprocess.run(bmerge_cmd, check=True)
+
+manifest.run('bmerge', bmerge_cmd + bfiles[1:],
+             [p for b in bfiles for p in bfile_inputs(b)],
+             [merged_prefix_bed + ext for ext in ('.bed', '.bim', '.fam')], run_bmerge)
+
+# 3. QC генотипов объединенного набора: MAF и HWE имеют смысл только по всей
+# когорте, поэтому QC идет после объединения, но до конвертации и GLM
+if args.skip_qc:
+    print('QC генотипов пропущен')
+    analysis_prefix_bed = merged_prefix_bed
+else:
+    print('QC генотипов (пропуски, MAF, HWE, гетерозиготные гаплоидные)...')
+    sys.path.insert(0, os.path.join(base_dir, '..'))
+    from genotype_qc import genotype_qc, write_filtered_bfile
+    qc_prefix = os.path.join(out_dir, 'merged_all_qc')
+    analysis_prefix_bed = qc_prefix
 
-# 3. Конвертация merged_all_bed в форматы PLINK 2.0
+    def run_qc():
+        genotype_qc(merged_prefix_bed, qc_prefix, pheno_path, 'PHENO',
+                    geno=args.geno, mind=args.mind, maf=args.maf, hwe=args.hwe)
+        write_filtered_bfile(merged_prefix_bed, qc_prefix, qc_prefix + '.exclude', qc_prefix + '.remove')
+
+    manifest.run('qc', ['genotype_qc', '--geno', str(args.geno), '--mind', str(args.mind),
+                        '--maf', str(args.maf), '--hwe', str(args.hwe)],
+                 bfile_inputs(merged_prefix_bed) + [pheno_path],
+                 [qc_prefix + ext for ext in ('.bed', '.bim', '.fam', '.qc_summary.json')], run_qc)
+
+# 4. Конвертация набора после QC в форматы PLINK 2.0
 print('Конвертация в pgen формат (PLINK 2.0)...')
 merged_prefix_pgen = os.path.join(out_dir, 'merged_all')
-subprocess.run([
+make_pgen_cmd = [
     plink2_path,
-    '--bfile', merged_prefix_bed,
+    '--bfile', analysis_prefix_bed,
     '--make-pgen',
     '--out', merged_prefix_pgen
-], check=True)
+]
+manifest.run('make_pgen', make_pgen_cmd, bfile_inputs(analysis_prefix_bed),
+             [merged_prefix_pgen + ext for ext in ('.pgen', '.pvar', '.psam')],
+             lambda: subprocess.run(make_pgen_cmd, check=True))
 
-# 4. GWAS-анализ через PLINK 2.0 (--glm)
+# 5. GWAS-анализ через PLINK 2.0 (--glm)
 print('Запуск GWAS-анализа (PLINK 2.0)...')
 plink2_out = os.path.join(out_dir, 'gwas_results')
-subprocess.run([
+glm_cmd = [
     plink2_path,
     '--pfile', merged_prefix_pgen,
     '--pheno', pheno_path,
     '--pheno-name', 'PHENO',
     '--glm', 'allow-no-covars',
     '--out', plink2_out
-], check=True)
+]
+
+def run_glm():
+    if args.glm_engine == 'python':
+        sys.path.insert(0, os.path.join(base_dir, '..'))
+        from logistic_gwas import run_glm as run_glm_python
+        run_glm_python(analysis_prefix_bed, pheno_path, plink2_out, pheno_name='PHENO',
+                       jobs=max(args.glm_jobs, args.glm_threads or 1))
+        return
+    if args.glm_jobs > 1 or args.shard_window:
+        # Параллельно по хромосомам; упавшие задания можно перезапустить отдельно
+        run_glm_sharded(plink2_path, merged_prefix_pgen, pheno_path, plink2_out,
+                        pheno_name='PHENO', jobs=args.glm_jobs, threads=args.glm_threads or 1,
+                        memory_mb=args.glm_memory, window_bp=args.shard_window,
+                        retries=args.glm_retries)
+        return
+    cmd = list(glm_cmd)
+    if args.glm_threads:
+        cmd += ['--threads', str(args.glm_threads)]
+    if args.glm_memory:
+        cmd += ['--memory', str(args.glm_memory)]
+    subprocess.run(cmd, check=True)
+
+# Число потоков и заданий не влияет на результат и в ключ не входит
+if args.glm_engine == 'python':
+    glm_key_cmd = ['logistic_gwas', '--bfile', analysis_prefix_bed, '--pheno', pheno_path,
+                   '--pheno-name', 'PHENO', '--out', plink2_out]
+    glm_inputs = bfile_inputs(analysis_prefix_bed) + [pheno_path]
+else:
+    glm_key_cmd = glm_cmd
+    glm_inputs = [merged_prefix_pgen + ext for ext in ('.pgen', '.pvar', '.psam')] + [pheno_path]
+manifest.run('glm', glm_key_cmd, glm_inputs,
+             [plink2_out + '.PHENO.glm.logistic.hybrid'], run_glm)
 
 print('✅ Готово! Все результаты сохранены в', out_dir)
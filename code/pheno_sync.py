@@ -0,0 +1,87 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+FAM_COLUMNS = ['FID', 'IID', 'PAT', 'MAT', 'SEX', 'PHENO']
+MISSING_PHENO = '-9'
+
+
+def read_fam(path):
+    """
+    .fam как строки (форматирование значений сохраняется при перезаписи)
+    """
+    return pd.read_csv(path, sep=r'\s+', header=None, names=FAM_COLUMNS, dtype=str)
+
+
+def read_phenotype(pheno_path, pheno_name='PHENO'):
+    pheno = pd.read_csv(pheno_path, sep=r'\s+', dtype=str)
+    missing = [c for c in ('FID', 'IID', pheno_name) if c not in pheno.columns]
+    if missing:
+        raise ValueError(f'В файле фенотипов нет колонок {missing}: {pheno_path}')
+    return pheno[['FID', 'IID', pheno_name]].rename(columns={pheno_name: 'NEW_PHENO'})
+
+
+def write_fam_atomic(path, fam):
+    """
+    Запись .fam через временный файл и os.replace (файл не остается недописанным)
+    """
+    tmp_path = path + '.tmp'
+    fam[FAM_COLUMNS].to_csv(tmp_path, sep=' ', header=False, index=False)
+    os.replace(tmp_path, path)
+
+
+def sync_phenotypes(pheno_path, fam_files, pheno_name='PHENO', jobs=4, dry_run=False):
+    """
+    Перенос фенотипов в .fam всех батчей одним соединением по (FID, IID).
+    Файлы читаются и пишутся параллельно; файл перезаписывается только
+    если в нем действительно изменились значения. Отсутствующие в файле
+    фенотипов образцы получают -9 и попадают в отчет вместе с дубликатами.
+    """
+    pheno = read_phenotype(pheno_path, pheno_name)
+    pheno_dups = pheno[pheno.duplicated(['FID', 'IID'], keep=False)]
+    pheno = pheno.drop_duplicates(['FID', 'IID'], keep='first')
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        fams = list(pool.map(read_fam, fam_files))
+    all_fam = pd.concat([fam.assign(FILE=path) for path, fam in zip(fam_files, fams)],
+                        ignore_index=True)
+
+    merged = all_fam.merge(pheno, on=['FID', 'IID'], how='left', indicator=True)
+    unmatched = merged['_merge'] == 'left_only'
+    merged['NEW_PHENO'] = merged['NEW_PHENO'].fillna(MISSING_PHENO)
+    merged['CHANGED'] = merged['NEW_PHENO'] != merged['PHENO']
+    merged['PHENO'] = merged['NEW_PHENO']
+
+    changed_files = merged.loc[merged['CHANGED'], 'FILE'].unique().tolist()
+    if not dry_run and changed_files:
+        groups = dict(tuple(merged[merged['FILE'].isin(changed_files)].groupby('FILE', sort=False)))
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            list(pool.map(lambda path: write_fam_atomic(path, groups[path]), changed_files))
+
+    fam_dups = all_fam[all_fam.duplicated(['FID', 'IID'], keep=False)]
+    return {
+        'fam_files': len(fam_files),
+        'samples': int(len(all_fam)),
+        'changed_values': int(merged['CHANGED'].sum()),
+        'changed_files': changed_files,
+        'unmatched': merged.loc[unmatched, ['FILE', 'FID', 'IID']].reset_index(drop=True),
+        'duplicate_pheno_ids': pheno_dups.reset_index(drop=True),
+        'duplicate_fam_ids': fam_dups[['FILE', 'FID', 'IID']].reset_index(drop=True),
+    }
+
+
+def print_sync_report(report):
+    print(f"Образцов в {report['fam_files']} .fam: {report['samples']}, "
+          f"изменено значений: {report['changed_values']}")
+    for path in report['changed_files']:
+        print(f'Обновлен: {path}')
+    if len(report['unmatched']):
+        print(f"⚠️ Нет в файле фенотипов ({len(report['unmatched'])}, записано -9):")
+        print(report['unmatched'].to_string(index=False))
+    if len(report['duplicate_pheno_ids']):
+        print(f"⚠️ Дубликаты (FID, IID) в файле фенотипов (используется первое значение):")
+        print(report['duplicate_pheno_ids'].to_string(index=False))
+    if len(report['duplicate_fam_ids']):
+        print(f"⚠️ Образцы, встречающиеся в нескольких .fam:")
+        print(report['duplicate_fam_ids'].to_string(index=False))
@@ -0,0 +1,207 @@
+import glob
+import heapq
+import json
+import os
+import re
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from gwas_cache import chrom_sort_key
+
+# Сообщения лога PLINK 2, при которых код 13 означает пустой диапазон, а не ошибку
+EMPTY_SHARD_PATTERN = re.compile(r'no variants (?:remaining|in|loaded)|\b0 variants remaining', re.I)
+
+
+def read_pvar_layout(pvar_path):
+    """
+    Хромосомы .pvar с минимальной и максимальной позицией (строки '##' пропускаются)
+    """
+    layout = {}
+    reader = pd.read_csv(pvar_path, sep='\t', usecols=[0, 1],
+                         skiprows=_count_meta_lines(pvar_path), chunksize=1_000_000)
+    for chunk in reader:
+        chunk.columns = ['CHROM', 'POS']
+        chunk['CHROM'] = chunk['CHROM'].astype(str)
+        agg = chunk.groupby('CHROM')['POS'].agg(['min', 'max'])
+        for chrom, row in agg.iterrows():
+            lo, hi = layout.get(chrom, (row['min'], row['max']))
+            layout[chrom] = (min(lo, row['min']), max(hi, row['max']))
+    return dict(sorted(layout.items(), key=lambda kv: chrom_sort_key(kv[0])))
+
+
+def _count_meta_lines(pvar_path):
+    count = 0
+    with open(pvar_path) as f:
+        for line in f:
+            if not line.startswith('##'):
+                break
+            count += 1
+    return count
+
+
+def plan_shards(pvar_path, window_bp=None):
+    """
+    Разбиение GLM на задания: по хромосомам или по диапазонам позиций
+    длиной window_bp внутри хромосомы
+    """
+    shards = []
+    for chrom, (lo, hi) in read_pvar_layout(pvar_path).items():
+        if not window_bp:
+            shards.append({'name': f'chr{chrom}', 'args': ['--chr', chrom]})
+            continue
+        start = int(lo)
+        while start <= hi:
+            end = start + int(window_bp) - 1
+            shards.append({'name': f'chr{chrom}_{start}_{end}',
+                           'args': ['--chr', chrom, '--from-bp', str(start), '--to-bp', str(end)]})
+            start = end + 1
+    return shards
+
+
+def run_shard(plink2_path, pfile, pheno_path, pheno_name, shard, shard_dir,
+              threads=1, memory_mb=None, retries=1):
+    """
+    GLM одного задания. Готовые задания (маркер .done с той же командой и
+    теми же входами) не перезапускаются, упавшее повторяется до retries раз.
+    """
+    out_prefix = os.path.join(shard_dir, shard['name'])
+    done_marker = out_prefix + '.done'
+
+    cmd = [plink2_path, '--pfile', pfile,
+           '--pheno', pheno_path, '--pheno-name', pheno_name,
+           '--glm', 'allow-no-covars'] + shard['args']
+    marker = json.dumps({'cmd': cmd, 'inputs': [_signature(p) for p in
+                                                (pfile + '.pgen', pfile + '.pvar', pheno_path)]})
+    if os.path.exists(done_marker):
+        with open(done_marker) as f:
+            status = f.readline().strip()
+            same_inputs = f.read() == marker
+        # Маркеру верим, только если результаты задания на месте
+        if same_inputs and status == 'empty':
+            return None
+        if same_inputs and status == 'ok' and shard_outputs(out_prefix):
+            return out_prefix
+
+    cmd += ['--threads', str(threads)]
+    if memory_mb:
+        cmd += ['--memory', str(memory_mb)]
+    cmd += ['--out', out_prefix]
+    # Результаты прошлого запуска не должны выдать себя за новые
+    for path in shard_outputs(out_prefix):
+        os.remove(path)
+
+    for attempt in range(retries + 1):
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if result.returncode == 0 and shard_outputs(out_prefix):
+            with open(done_marker, 'w') as f:
+                f.write('ok\n' + marker)
+            return out_prefix
+        # Код 13 у PLINK 2 — пустое задание, только если лог подтверждает отсутствие вариантов
+        if result.returncode == 13 and is_empty_shard(out_prefix):
+            with open(done_marker, 'w') as f:
+                f.write('empty\n' + marker)
+            return None
+        print(f'⚠️ Задание {shard["name"]} упало (попытка {attempt + 1}): {result.stderr.strip()[-500:]}')
+    raise RuntimeError(f'Задание GLM {shard["name"]} не выполнено после {retries + 1} попыток')
+
+
+def shard_outputs(out_prefix):
+    """
+    Файлы результатов задания (<prefix>.<PHENO>.glm.*)
+    """
+    return [p for p in glob.glob(out_prefix + '.*.glm.*') if not p.endswith('.id')]
+
+
+def is_empty_shard(out_prefix):
+    """
+    Пустое задание: в логе PLINK 2 сказано, что вариантов в диапазоне нет, и результатов нет
+    """
+    log_path = out_prefix + '.log'
+    if not os.path.exists(log_path) or shard_outputs(out_prefix):
+        return False
+    with open(log_path, errors='replace') as f:
+        return EMPTY_SHARD_PATTERN.search(f.read()) is not None
+
+
+def _signature(path):
+    st = os.stat(path) if os.path.exists(path) else None
+    return [path, st.st_size, st.st_mtime_ns] if st else [path, None, None]
+
+
+def _result_rows(path):
+    """
+    Строки результата с ключом сортировки (хромосома, позиция, порядок в файле)
+    """
+    with open(path) as f:
+        next(f)
+        for i, line in enumerate(f):
+            fields = line.split('\t', 2)
+            yield (chrom_sort_key(fields[0]), int(fields[1]), i), line
+
+
+def merge_shard_results(shard_prefixes, out_prefix):
+    """
+    Слияние результатов заданий в один отсортированный файл на каждый тип
+    вывода (*.PHENO.glm.logistic.hybrid и т.п.): k-путевое устойчивое слияние
+    по (хромосома, позиция) без разбора чисел, текст строк сохраняется как есть
+    """
+    outputs = {}
+    for prefix in shard_prefixes:
+        for path in shard_outputs(prefix):
+            suffix = path[len(prefix):]
+            outputs.setdefault(suffix, []).append(path)
+
+    merged = []
+    for suffix, paths in outputs.items():
+        with open(paths[0]) as f:
+            header = f.readline()
+        target = out_prefix + suffix
+        tmp_path = target + '.tmp'
+        with open(tmp_path, 'w') as out:
+            out.write(header)
+            streams = [_result_rows(p) for p in paths]
+            for _, line in heapq.merge(*streams, key=lambda item: item[0]):
+                out.write(line)
+        os.replace(tmp_path, target)
+        merged.append(target)
+    return merged
+
+
+def run_glm_sharded(plink2_path, pfile, pheno_path, out_prefix, pheno_name='PHENO',
+                    jobs=4, threads=1, memory_mb=None, window_bp=None, retries=1):
+    """
+    GLM по хромосомам (или диапазонам позиций) параллельно: каждое задание —
+    отдельный процесс plink2 со своими --threads/--memory. Результаты
+    сливаются в <out_prefix>.<PHENO>.glm.*
+    """
+    shard_dir = out_prefix + '_shards'
+    os.makedirs(shard_dir, exist_ok=True)
+    shards = plan_shards(pfile + '.pvar', window_bp)
+    print(f'GLM: {len(shards)} заданий, {jobs} параллельно, --threads {threads}')
+
+    prefixes = {}
+    failed = []
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(run_shard, plink2_path, pfile, pheno_path, pheno_name,
+                               shard, shard_dir, threads, memory_mb, retries): shard['name']
+                   for shard in shards}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                prefixes[name] = future.result()
+            except RuntimeError as e:
+                failed.append(name)
+                print(f'❌ {e}')
+    if failed:
+        raise RuntimeError(f'Не выполнены задания GLM: {failed}. '
+                           f'Повторный запуск пересчитает только их.')
+
+    ordered = [prefixes[s['name']] for s in shards if prefixes.get(s['name'])]
+    merged = merge_shard_results(ordered, out_prefix)
+    for path in merged:
+        print(f'Объединенный результат: {path}')
+    return merged
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+from datetime import datetime
+
+
+def fam_identity_digest(path):
+    """
+    Хэш .fam без колонки фенотипа (FID, IID, родители, пол).
+    Фенотип в .fam не влияет на GLM — он передается через --pheno, —
+    поэтому смена фенотипов не должна перезапускать объединение и конвертацию.
+    """
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for line in f:
+            h.update(b' '.join(line.split()[:5]) + b'\n')
+    return h.hexdigest()
+
+
+def _full_digest(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class StepManifest:
+    """
+    Манифест шагов конвейера PLINK: для каждого шага хранится ключ
+    (хэш команды и содержимого входов) и сигнатуры выходов. Шаг пропускается,
+    если ключ совпал, а выходы существуют и не менялись после записи.
+    Хэши файлов запоминаются по (размер, mtime), чтобы не перечитывать
+    неизменные .bed при каждом запуске.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.data = {'steps': {}, 'digests': {}}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.data = json.load(f)
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def digest(self, path, mode='full'):
+        """
+        Хэш содержимого файла (mode='fam_identity' — .fam без фенотипа)
+        """
+        st = os.stat(path)
+        memo_key = f'{mode}:{os.path.abspath(path)}'
+        memo = self.data['digests'].get(memo_key)
+        if memo and memo['size'] == st.st_size and memo['mtime_ns'] == st.st_mtime_ns:
+            return memo['sha256']
+        value = fam_identity_digest(path) if mode == 'fam_identity' else _full_digest(path)
+        self.data['digests'][memo_key] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+                                          'sha256': value}
+        return value
+
+    def step_key(self, cmd, inputs):
+        """
+        Ключ шага: команда + хэши входов. inputs — список путей или пар (путь, mode)
+        """
+        payload = {'cmd': [str(c) for c in cmd], 'inputs': []}
+        for item in inputs:
+            path, mode = item if isinstance(item, tuple) else (item, 'full')
+            payload['inputs'].append([os.path.abspath(path), mode, self.digest(path, mode)])
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _output_signatures(self, outputs):
+        signatures = {}
+        for path in outputs:
+            st = os.stat(path)
+            signatures[os.path.abspath(path)] = [st.st_size, st.st_mtime_ns]
+        return signatures
+
+    def is_fresh(self, name, key, outputs):
+        step = self.data['steps'].get(name)
+        if step is None or step['key'] != key:
+            return False
+        if not all(os.path.exists(p) for p in outputs):
+            return False
+        return step['outputs'] == self._output_signatures(outputs)
+
+    def record(self, name, key, outputs):
+        self.data['steps'][name] = {'key': key, 'outputs': self._output_signatures(outputs),
+                                    'finished': datetime.now().isoformat()}
+        self.save()
+
+    def run(self, name, cmd, inputs, outputs, action):
+        """
+        Выполнение шага action(), если он не актуален. Возвращает True, если шаг выполнялся.
+        """
+        key = self.step_key(cmd, inputs)
+        if self.is_fresh(name, key, outputs):
+            print(f'⏭  {name}: входы и команда не изменились — пропуск')
+            return False
+        action()
+        self.record(name, key, outputs)
+        return True
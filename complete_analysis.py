@@ -1,24 +1,74 @@
 import pandas as pd
 import numpy as np
-import json
 import os
 from datetime import datetime
 
-def complete_snp_analysis():
+from candidate_lists import load_candidates
+from gwas_cache import find_column, read_gwas_text
+from instrumentation import TRACER, configure_from_env, span
+from report_writer import ReportWriter
+from snp_index import SnpIndex, id_keys, id_position_keys, position_keys
+from variant_matching import match_variants, summarize_matches
+
+# Пути к файлам по умолчанию
+EXCEL_FILE = "/home/esp/data_analyze/01.06.2025_v2/data/init/Аллели по болезни Альцгеймера .xlsx"
+GWAS_FILE = "/home/esp/data_analyze/01.06.2025_v2/data/init/gwas_results.assoc"
+OUTPUT_DIR = "/home/esp/data_analyze/01.06.2025_v2/results"
+
+def find_gwas_snp_column(columns):
+    """
+    Колонка с SNP ID в GWAS (первая по ключевым словам, иначе первая колонка)
+    """
+    gwas_snp_columns = [col for col in columns 
+                       if any(keyword in col.lower() for keyword in ['snp', 'rs', 'id', 'variant'])]
+    
+    if not gwas_snp_columns:
+        print("   ВНИМАНИЕ: Не найдена колонка с SNP ID в GWAS. Используется первая колонка.")
+        return columns[0]
+    return gwas_snp_columns[0]
+
+def read_gwas_candidates(gwas_file, candidates, chunksize):
+    """
+    Потоковое чтение GWAS блоками: в памяти остаются только строки,
+    совпадающие с кандидатами (таблица load_candidates) по ID или по позиции
+    (колонки CHR/POS списка, CHR:BP, 1kg_*, imm_* в ID).
+    Возвращает (строки-кандидаты, общее число строк).
     """
-    Полный анализ SNP данных с созданием итогового отчета
+    with span('build_candidate_set', rows=len(candidates)):
+        snp_list = candidates['id']
+        wanted = (set(id_keys(snp_list)) | set(id_position_keys(snp_list).dropna())
+                  | set(position_keys(candidates['chrom'], candidates['pos']).dropna()))
+    total_rows = 0
+    parts = []
+    for chunk in read_gwas_text(gwas_file, chunksize=chunksize):
+        with span('match_chunk', rows=len(chunk)) as s:
+            total_rows += len(chunk)
+            ids = chunk[find_gwas_snp_column(chunk.columns.tolist())]
+            mask = id_keys(ids).isin(wanted) | id_position_keys(ids).isin(wanted)
+            chrom_col = find_column(chunk.columns, 'chrom')
+            pos_col = find_column(chunk.columns, 'pos')
+            if chrom_col and pos_col:
+                mask |= position_keys(chunk[chrom_col], chunk[pos_col]).isin(wanted)
+            parts.append(chunk[mask.to_numpy()])
+            s.count(matched=len(parts[-1]))
+    return pd.concat(parts, ignore_index=True), total_rows
+
+def complete_snp_analysis(excel_file=EXCEL_FILE, gwas_file=GWAS_FILE, output_dir=OUTPUT_DIR,
+                          df_gwas=None, chunksize=None, sidecar_format='ndjson'):
+    """
+    Полный анализ SNP данных с созданием итогового отчета.
+    df_gwas — уже загруженные результаты GWAS (при запуске из общего конвейера);
+    chunksize — потоковое чтение GWAS блоками для файлов больше памяти;
+    sidecar_format — формат приложений с большими разделами отчета (ndjson или parquet)
     """
     
     print("=== НАЧАЛО ПОЛНОГО АНАЛИЗА SNP ===")
     print(f"Время начала: {datetime.now()}")
     
-    # Пути к файлам
-    excel_file = "/home/esp/data_analyze/01.06.2025_v2/data/init/Аллели по болезни Альцгеймера .xlsx"
-    gwas_file = "/home/esp/data_analyze/01.06.2025_v2/data/init/gwas_results.assoc"
-    output_dir = "/home/esp/data_analyze/01.06.2025_v2/results"
-    
     # Создание директории для результатов
     os.makedirs(output_dir, exist_ok=True)
+    # Основной JSON — сводка и ссылки; списки и записи по SNP — в приложениях
+    writer = ReportWriter(os.path.join(output_dir, 'complete_analysis_report.json'), sidecar_format)
     
     results = {
         'analysis_date': datetime.now().isoformat(),
@@ -33,78 +83,77 @@ def complete_snp_analysis():
     try:
         # 1. Анализ Excel файла
         print("\n1. Анализ Excel файла с аллелями Альцгеймера...")
-        df_excel = pd.read_excel(excel_file)
-        
-        print(f"   Размер Excel файла: {df_excel.shape}")
-        print(f"   Колонки: {df_excel.columns.tolist()}")
-        
-        # Поиск колонки с SNP
-        snp_columns = [col for col in df_excel.columns 
-                      if any(keyword in col.lower() for keyword in ['snp', 'rs', 'variant', 'id'])]
-        
-        if not snp_columns:
-            print("   ВНИМАНИЕ: Не найдена колонка с SNP ID. Используется первая колонка.")
-            snp_column = df_excel.columns[0]
-        else:
-            snp_column = snp_columns[0]
+        with span('read_excel', file=excel_file) as s:
+            candidates = load_candidates(excel_file)
+            s.count(rows=len(candidates), cached=int(candidates.attrs['cached']))
         
-        print(f"   Используется колонка: '{snp_column}'")
+        source = 'кэш' if candidates.attrs['cached'] else 'разбор Excel'
+        print(f"   Загружено: {len(candidates)} SNP ({source})")
+        print(f"   Определены колонки: {candidates.attrs['schema']}")
         
-        # Извлечение списка SNP
-        snp_list = df_excel[snp_column].dropna().astype(str).str.strip().unique().tolist()
-        snp_list = [snp for snp in snp_list if snp and snp != 'nan']
+        # Список нормализованных ID SNP
+        snp_list = candidates['id'].tolist()
         
         results['summary']['total_snps_from_excel'] = len(snp_list)
         print(f"   Найдено уникальных SNP: {len(snp_list)}")
         
         # 2. Анализ GWAS файла
         print("\n2. Анализ GWAS результатов...")
-        df_gwas = pd.read_csv(gwas_file, sep='\t', low_memory=False)
+        if df_gwas is None and chunksize:
+            with span('read_gwas_streaming', file=gwas_file) as s:
+                df_gwas, total_gwas_rows = read_gwas_candidates(gwas_file, candidates, chunksize)
+                s.count(rows=total_gwas_rows, matched=len(df_gwas))
+            print(f"   Потоковое чтение: {total_gwas_rows} строк, кандидатов: {len(df_gwas)}")
+        elif df_gwas is None:
+            # Индекс вместо загрузки всей таблицы: читаются только строки кандидатов
+            with span('snp_index_lookup', file=gwas_file) as s:
+                index = SnpIndex(gwas_file)
+                matches = index.lookup(snp_list, candidates['chrom'], candidates['pos'])
+                s.count(rows=len(snp_list))
+            with span('snp_index_fetch_rows') as s:
+                df_gwas = index.fetch_rows(r for rows in matches['rows'] for r in rows)
+                s.count(rows=len(df_gwas))
+            total_gwas_rows = index.n_rows
+            print(f"   Строк в GWAS файле: {total_gwas_rows}, прочитано по индексу: {len(df_gwas)}")
+        else:
+            total_gwas_rows = len(df_gwas)
+            print(f"   Размер GWAS файла: {df_gwas.shape}")
         
-        print(f"   Размер GWAS файла: {df_gwas.shape}")
         print(f"   Колонки: {df_gwas.columns.tolist()}")
         
         # Поиск колонки с SNP в GWAS
-        gwas_snp_columns = [col for col in df_gwas.columns 
-                           if any(keyword in col.lower() for keyword in ['snp', 'rs', 'id', 'variant'])]
-        
-        if not gwas_snp_columns:
-            print("   ВНИМАНИЕ: Не найдена колонка с SNP ID в GWAS. Используется первая колонка.")
-            gwas_snp_column = df_gwas.columns[0]
-        else:
-            gwas_snp_column = gwas_snp_columns[0]
+        gwas_snp_column = find_gwas_snp_column(df_gwas.columns.tolist())
         
         print(f"   Используется колонка: '{gwas_snp_column}'")
         
-        results['summary']['total_snps_in_gwas'] = len(df_gwas)
+        results['summary']['total_snps_in_gwas'] = total_gwas_rows
         
         # 3. Поиск пересечений
         print("\n3. Поиск пересечений...")
         
-        # Создание множества для быстрого поиска
-        gwas_snps_set = set(df_gwas[gwas_snp_column].astype(str).str.strip())
-        
-        found_snps = []
-        not_found_snps = []
-        
-        for snp in snp_list:
-            if snp in gwas_snps_set:
-                found_snps.append(snp)
-            else:
-                not_found_snps.append(snp)
+        # Сопоставление по ID, затем по позиции (CHR:BP, 1kg_*, imm_*)
+        with span('match_variants', rows=len(df_gwas)) as s:
+            matches = match_variants(candidates, df_gwas)
+            found_snps, not_found_snps, match_types = summarize_matches(candidates, matches)
+            s.count(matched=len(found_snps))
         
         results['summary']['found_snps_count'] = len(found_snps)
         results['summary']['not_found_snps_count'] = len(not_found_snps)
         results['summary']['match_percentage'] = (len(found_snps) / len(snp_list)) * 100 if snp_list else 0
+        results['summary']['match_types'] = match_types
         
         print(f"   Найдено в GWAS: {len(found_snps)} ({results['summary']['match_percentage']:.1f}%)")
         print(f"   Не найдено: {len(not_found_snps)}")
+        for match_type, count in match_types.items():
+            print(f"   - тип совпадения '{match_type}': {count}")
         
         # 4. Детальный анализ найденных SNP
         if found_snps:
             print("\n4. Детальный анализ найденных SNP...")
             
-            found_gwas_data = df_gwas[df_gwas[gwas_snp_column].isin(found_snps)].copy()
+            found_gwas_data = df_gwas.iloc[matches['gwas_row'].to_numpy()].copy()
+            found_gwas_data['QUERY'] = matches['query'].to_numpy()
+            found_gwas_data['MATCH_TYPE'] = matches['match_type'].astype(str).to_numpy()
             
             # Статистический анализ
             if 'P' in found_gwas_data.columns:
@@ -127,29 +176,32 @@ def complete_snp_analysis():
                 
                 # Топ значимые SNP
                 if len(p_values) > 0:
-                    top_significant = found_gwas_data.nsmallest(min(10, len(found_gwas_data)), 'P')
+                    with span('nsmallest', rows=len(found_gwas_data)):
+                        top_significant = found_gwas_data.nsmallest(min(10, len(found_gwas_data)), 'P')
                     results['detailed_results']['top_10_significant'] = top_significant.to_dict('records')
             
             # Сохранение детальных результатов
             output_file = os.path.join(output_dir, 'found_alzheimer_snps_detailed.csv')
-            found_gwas_data.to_csv(output_file, index=False)
+            with writer.section('detailed_csv'):
+                found_gwas_data.to_csv(output_file, index=False)
             print(f"   Детальные результаты сохранены: {output_file}")
-        
+            results['detailed_results']['found_variants'] = writer.sidecar('found_variants',
+                                                                           found_gwas_data)
+        else:
+            # Пустая таблица вместо устаревшей от прошлого запуска (файл — выход стадии конвейера)
+            output_file = os.path.join(output_dir, 'found_alzheimer_snps_detailed.csv')
+            df_gwas.iloc[0:0].assign(QUERY=[], MATCH_TYPE=[]).to_csv(output_file, index=False)
+
         # 5. Сохранение всех результатов
         print("\n5. Сохранение результатов...")
         
         # Списки SNP
-        results['detailed_results']['found_snps'] = found_snps
-        results['detailed_results']['not_found_snps'] = not_found_snps
-        
-        # JSON отчет
-        json_file = os.path.join(output_dir, 'complete_analysis_report.json')
-        with open(json_file, 'w', encoding='utf-8') as f:
-            json.dump(results, f, ensure_ascii=False, indent=2, default=str)
+        results['detailed_results']['found_snps'] = writer.sidecar('found_snps', found_snps)
+        results['detailed_results']['not_found_snps'] = writer.sidecar('not_found_snps', not_found_snps)
         
         # Текстовый отчет
         txt_file = os.path.join(output_dir, 'analysis_summary.txt')
-        with open(txt_file, 'w', encoding='utf-8') as f:
+        with writer.section('text_report'), open(txt_file, 'w', encoding='utf-8') as f:
             f.write("=== ОТЧЕТ ПО АНАЛИЗУ SNP АЛЬЦГЕЙМЕРА ===\n\n")
             f.write(f"Дата анализа: {results['analysis_date']}\n\n")
             f.write("ИСХОДНЫЕ ДАННЫЕ:\n")
@@ -183,8 +235,12 @@ def complete_snp_analysis():
             if len(not_found_snps) > 20:
                 f.write(f"... и еще {len(not_found_snps) - 20} SNP\n")
         
+        # JSON отчет
+        json_file = writer.write(results)
+        
         print(f"   JSON отчет: {json_file}")
         print(f"   Текстовый отчет: {txt_file}")
+        writer.print_timings()
         
         print(f"\n=== АНАЛИЗ ЗАВЕРШЕН ===")
         print(f"Время завершения: {datetime.now()}")
@@ -199,4 +255,8 @@ def complete_snp_analysis():
         return None
 
 if __name__ == "__main__":
-    results = complete_snp_analysis()
\ No newline at end of file
+    # Трассировка по переменным окружения (GWAS_TRACE=trace.json, GWAS_PROFILE=1)
+    configure_from_env()
+    with span('complete_snp_analysis'):
+        results = complete_snp_analysis()
+    TRACER.finish()
\ No newline at end of file
@@ -1,4 +1,4 @@
-import pandas as pd
+from gwas_cache import load_gwas
 
 # Путь к исходному файлу
 input_path = "/home/esp/data_analyze/01.06.2025_v2/data/init/gwas_results.assoc"
@@ -7,8 +7,8 @@ input_path = "/home/esp/data_analyze/01.06.2025_v2/data/init/gwas_results.assoc"
 output_path = "/home/esp/data_analyze/01.06.2025_v2/data/output/gwas_results.csv"
 
 # Загрузка файла
-# Предположим, что разделитель — пробел или табуляция, и нужно обработать заголовки
-df = pd.read_csv(input_path, delim_whitespace=True)
+# Разбор текста выполняется один раз, далее используется колоночный кэш
+df = load_gwas(input_path)
 
 # Сохранение в CSV с разделителем ';'
 df.to_csv(output_path, sep=';', index=False)
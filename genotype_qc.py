@@ -0,0 +1,401 @@
+import argparse
+import json
+import os
+import re
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from scipy.special import gammaln
+
+from plink_bed import BED_MAGIC, BedReader, encode_block
+from snp_index import normalize_chrom
+
+# Пороги по умолчанию (как распространенные значения --geno / --mind / --maf / --hwe)
+GENO = 0.05
+MIND = 0.1
+MAF = 0.01
+HWE = 1e-6
+# Байт генотипов на блок при подсчете (не зависит от числа образцов)
+BLOCK_BYTES = 32 << 20
+
+# Гаплоидные хромосомы: у мужчин — X и Y, у всех — MT
+MALE_HAPLOID = ('X', 'Y')
+ALL_HAPLOID = ('MT',)
+
+VARIANT_COLUMNS = ['CHR', 'SNP', 'A1', 'A2', 'OBS_CT', 'MISSING_RATE', 'A1_FREQ', 'MAF',
+                   'HET_CT', 'HWE_P', 'HH_CT', 'FAIL']
+FAIL_REASONS = np.array(['geno', 'maf', 'hwe'])
+SAMPLE_COLUMNS = ['FID', 'IID', 'SEX', 'MISSING_CT', 'CALL_RATE', 'HET_RATE', 'HH_CT', 'FAIL']
+
+# Число единичных битов в байте
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype='uint8')
+# Младшие биты всех четырех 2-битных кодов байта
+_LOW_BITS = np.uint8(0x55)
+
+
+def code_masks(packed):
+    """
+    Битовые маски кодов .bed на месте младшего бита каждого генотипа:
+    пропуск (01), гетерозигота (10), гомозигота A2 (11). Гомозигота A1 (00)
+    не выделяется — это остаток, в который попадают и биты выравнивания.
+    """
+    low = packed & _LOW_BITS
+    high = (packed >> 1) & _LOW_BITS
+    return low & (high ^ _LOW_BITS), high & (low ^ _LOW_BITS), low & high
+
+
+def sample_bits(selected, n_bytes):
+    """
+    Маска образцов в раскладке .bed: младший бит кода каждого выбранного образца
+    """
+    selected = np.flatnonzero(selected)
+    bits = np.zeros(n_bytes, dtype='uint8')
+    np.bitwise_or.at(bits, selected >> 2, (1 << (2 * (selected & 3))).astype('uint8'))
+    return bits
+
+
+def count_variants(mask, bits=None):
+    """
+    Число установленных генотипов в каждой строке (варианте), при bits — только среди выбранных образцов
+    """
+    if bits is not None:
+        mask = mask & bits
+    return _POPCOUNT[mask].sum(axis=1, dtype='int64')
+
+
+def count_samples(mask, n_samples):
+    """
+    Число установленных генотипов по образцам (суммы столбцов без распаковки блока)
+    """
+    counts = np.empty(mask.shape[1] * 4, dtype='int64')
+    for k in range(4):
+        counts[k::4] = ((mask >> (2 * k)) & 1).sum(axis=0, dtype='int64')
+    return counts[:n_samples]
+
+
+def hwe_exact(het, hom1, hom2):
+    """
+    Точный тест Харди–Вайнберга (Wigginton et al., 2005). Распределение
+    числа гетерозигот строится один раз на уникальную пару (число
+    генотипов, число минорных аллелей) в закрытой форме через gammaln,
+    p-value всех вариантов пары — бинарным поиском по отсортированным вероятностям.
+    """
+    het, hom1, hom2 = (np.asarray(a, dtype='int64') for a in (het, hom1, hom2))
+    n = het + hom1 + hom2
+    rare = np.minimum(2 * hom1 + het, 2 * hom2 + het)
+    p = np.full(len(n), np.nan)
+    valid = np.flatnonzero(n > 0)
+    if not len(valid):
+        return p
+    pairs, inverse, counts = np.unique(np.stack([n[valid], rare[valid]], axis=1), axis=0,
+                                       return_inverse=True, return_counts=True)
+    # Варианты группируются по паре одной сортировкой, а не просмотром всего массива на каждую пару
+    order = np.argsort(inverse.ravel(), kind='stable')
+    groups = np.split(valid[order], np.cumsum(counts)[:-1])
+    for (n_obs, n_rare), members in zip(pairs, groups):
+        k = np.arange(n_rare % 2, n_rare + 1, 2)
+        hom_rare = (n_rare - k) // 2
+        hom_common = n_obs - k - hom_rare
+        log_prob = (k * np.log(2.0) - gammaln(hom_rare + 1) - gammaln(k + 1) - gammaln(hom_common + 1))
+        prob = np.exp(log_prob - log_prob.max())
+        prob /= prob.sum()
+        ordered = np.sort(prob)
+        cumulative = np.cumsum(ordered)
+        observed = prob[(het[members] - n_rare % 2) // 2]
+        # Допуск на ошибку округления, как в реализации PLINK
+        position = np.searchsorted(ordered, observed * (1 + 1e-7), side='right')
+        p[members] = np.minimum(cumulative[position - 1], 1.0)
+    return p
+
+
+def parse_hh(path):
+    """
+    Сводка файла .hh PLINK (FID IID SNP на строку — гетерозиготные гаплоидные генотипы)
+    """
+    hh = pd.read_csv(path, sep=r'\s+', header=None, names=['FID', 'IID', 'SNP'], dtype=str)
+    by_sample = hh.groupby(['FID', 'IID']).size().sort_values(ascending=False)
+    by_variant = hh['SNP'].value_counts()
+    return {
+        'file': path,
+        'n_genotypes': int(len(hh)),
+        'n_samples': int(len(by_sample)),
+        'n_variants': int(len(by_variant)),
+        'top_samples': [{'FID': f, 'IID': i, 'count': int(c)} for (f, i), c in by_sample.head(10).items()],
+        'top_variants': [{'SNP': s, 'count': int(c)} for s, c in by_variant.head(10).items()],
+    }
+
+
+_LOG_PATTERNS = {
+    'plink_version': r'^(PLINK v\S+)',
+    'variants_loaded': r'^(\d+) variants loaded from',
+    'people_loaded': r'^(\d+) people \(',
+    'males': r'^\d+ people \((\d+) males?',
+    'females': r'(\d+) females?',
+    'ambiguous_sex': r'(\d+) ambiguous\)',
+    'genotyping_rate': r'^Total genotyping rate is (\d*\.?\d+)',
+    'cases': r'^Among remaining phenotypes, (\d+) are cases',
+    'controls': r'(\d+) are controls',
+    'het_haploid': r'^Warning: (\d+) het\. haploid genotypes',
+    'pass_variants': r'^(\d+) variants and \d+ people pass',
+    'pass_people': r'^\d+ variants and (\d+) people pass',
+}
+
+
+def parse_plink_log(path):
+    """
+    Сводка .log PLINK: версия, число вариантов и людей, пол, доля генотипов,
+    случаи/контроли и предупреждения, сгруппированные по типу
+    (предупреждение может занимать несколько строк — они склеиваются до точки)
+    """
+    with open(path, encoding='utf-8', errors='replace') as f:
+        lines = f.read().splitlines()
+    summary = {'file': path}
+    for key, pattern in _LOG_PATTERNS.items():
+        for line in lines:
+            match = re.search(pattern, line)
+            if match:
+                value = match.group(1)
+                summary[key] = float(value) if key == 'genotyping_rate' else (
+                    value if key == 'plink_version' else int(value))
+                break
+
+    warnings, current = [], None
+    for line in lines:
+        if line.startswith(('Warning:', 'Error:')):
+            current = [line]
+            warnings.append(current)
+        elif current is not None and line and _continues(current):
+            current.append(line)
+        else:
+            current = None
+    groups = {}
+    for parts in warnings:
+        text = ' '.join(parts)
+        kind = re.sub(r"'[^']*'", "'…'", text)
+        kind = re.sub(r'\d+', 'N', kind)
+        kind = re.sub(r'\(see .*', '', kind).strip()
+        group = groups.setdefault(kind, {'count': 0, 'examples': []})
+        group['count'] += 1
+        if len(group['examples']) < 5:
+            group['examples'].append(text)
+    summary['warnings'] = sorted(({'type': k, **v} for k, v in groups.items()), key=lambda g: -g['count'])
+    return summary
+
+
+def _continues(parts):
+    # Запись PLINK продолжается, пока не завершена точкой
+    return not parts[-1].rstrip().endswith('.')
+
+
+def genotype_qc(bfile, out_prefix, pheno=None, pheno_name='PHENO', geno=GENO, mind=MIND,
+                maf=MAF, hwe=HWE, block_bytes=BLOCK_BYTES):
+    """
+    Контроль качества генотипов .bed: доля пропусков по вариантам и образцам,
+    MAF, точный тест HWE (по контролям, если фенотип бинарный) и
+    гетерозиготные гаплоидные генотипы. Подсчет — по битовым маскам упакованных
+    блоков .bed, без распаковки и циклов по образцам.
+    Пишет <out>.vqc.tsv, <out>.sqc.tsv, <out>.exclude (ID вариантов, формат
+    --exclude), <out>.remove (FID IID, формат --remove) и <out>.qc_summary.json.
+    """
+    reader = BedReader(bfile)
+    n_samples, n_bytes = reader.n_samples, reader.bytes_per_variant
+    fam = reader.fam
+    has_bim = reader.bim['SNP'].notna().all()
+    chrom = normalize_chrom(reader.bim['CHR']).to_numpy() if has_bim else np.full(reader.n_variants, '0')
+
+    males = fam['SEX'].to_numpy() == 1
+    if pheno:
+        from logistic_gwas import read_binary_phenotype
+        y = read_binary_phenotype(fam, pheno, pheno_name)
+    else:
+        y = pd.to_numeric(fam['PHENO'], errors='coerce').to_numpy()
+        y = np.where(y == 2, 1.0, np.where(y == 1, 0.0, np.nan))
+    controls = y == 0
+    # HWE по контролям, только если есть и случаи, и контроли (как --hwe в PLINK)
+    hwe_samples = controls if controls.any() and (y == 1).any() else np.ones(n_samples, dtype=bool)
+    male_bits = sample_bits(males, n_bytes)
+    hwe_bits = sample_bits(hwe_samples, n_bytes)
+    n_hwe = int(hwe_samples.sum())
+
+    sample_missing = np.zeros(n_samples, dtype='int64')
+    sample_het = np.zeros(n_samples, dtype='int64')
+    sample_called_diploid = np.zeros(n_samples, dtype='int64')
+    sample_hh = np.zeros(n_samples, dtype='int64')
+    reasons = {'geno': 0, 'maf': 0, 'hwe': 0}
+    exclude = []
+    total_missing = 0
+
+    variant_path = out_prefix + '.vqc.tsv'
+    os.makedirs(os.path.dirname(os.path.abspath(out_prefix)), exist_ok=True)
+    block_size = max(1, block_bytes // max(n_bytes, 1))
+    with open(variant_path + '.tmp', 'w') as out:
+        out.write('\t'.join(VARIANT_COLUMNS) + '\n')
+        for rows, packed in reader.iter_packed(block_size):
+            missing, het, hom2 = code_masks(packed)
+            block_chrom = chrom[rows]
+            male_haploid = np.isin(block_chrom, MALE_HAPLOID)
+            all_haploid = np.isin(block_chrom, ALL_HAPLOID)
+            diploid = ~(male_haploid | all_haploid)
+
+            # По вариантам: счетчики кодов по всем образцам и по подмножествам
+            n_missing = count_variants(missing)
+            n_het = count_variants(het)
+            n_hom2 = count_variants(hom2)
+            obs = n_samples - n_missing
+            n_hom1 = obs - n_het - n_hom2
+            hh = np.where(male_haploid, count_variants(het, male_bits), np.where(all_haploid, n_het, 0))
+            hwe_het = count_variants(het, hwe_bits)
+            hwe_hom2 = count_variants(hom2, hwe_bits)
+            hwe_hom1 = n_hwe - count_variants(missing, hwe_bits) - hwe_het - hwe_hom2
+            hwe_p = np.full(len(rows), np.nan)
+            hwe_p[diploid] = hwe_exact(hwe_het[diploid], hwe_hom1[diploid], hwe_hom2[diploid])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                a1_freq = (2 * n_hom1 + n_het) / (2 * obs)
+            minor = np.minimum(a1_freq, 1 - a1_freq)
+            missing_rate = n_missing / n_samples
+
+            fail_geno = missing_rate > geno
+            fail_maf = ~(minor >= maf)
+            fail_hwe = hwe_p < hwe
+            reasons['geno'] += int(fail_geno.sum())
+            reasons['maf'] += int(fail_maf.sum())
+            reasons['hwe'] += int(fail_hwe.sum())
+            flags = np.stack([fail_geno, fail_maf, fail_hwe], axis=1)
+            failed = flags.any(axis=1)
+            fail = np.full(len(rows), '.', dtype=object)
+            fail[failed] = [';'.join(FAIL_REASONS[f]) for f in flags[failed]]
+            if has_bim:
+                exclude.append(reader.bim['SNP'].to_numpy()[rows[failed]])
+            total_missing += int(n_missing.sum())
+
+            # По образцам: суммы столбцов битовых масок
+            sample_missing += count_samples(missing, n_samples)
+            if diploid.any():
+                sample_het += count_samples(het[diploid], n_samples)
+                sample_called_diploid += int(diploid.sum()) - count_samples(missing[diploid], n_samples)
+            if male_haploid.any():
+                sample_hh += count_samples(het[male_haploid], n_samples) * males
+            if all_haploid.any():
+                sample_hh += count_samples(het[all_haploid], n_samples)
+
+            bim = reader.bim.iloc[rows]
+            pd.DataFrame({
+                'CHR': bim['CHR'].to_numpy(), 'SNP': bim['SNP'].to_numpy(),
+                'A1': bim['A1'].to_numpy(), 'A2': bim['A2'].to_numpy(), 'OBS_CT': obs,
+                'MISSING_RATE': missing_rate, 'A1_FREQ': a1_freq, 'MAF': minor, 'HET_CT': n_het,
+                'HWE_P': hwe_p, 'HH_CT': hh, 'FAIL': fail,
+            }).to_csv(out, sep='\t', header=False, index=False, na_rep='NA', float_format='%.6g')
+    os.replace(variant_path + '.tmp', variant_path)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        call_rate = 1 - sample_missing / max(reader.n_variants, 1)
+        het_rate = sample_het / sample_called_diploid
+    fail_mind = (1 - call_rate) > mind
+    samples = pd.DataFrame({
+        'FID': fam['FID'], 'IID': fam['IID'], 'SEX': fam['SEX'], 'MISSING_CT': sample_missing,
+        'CALL_RATE': call_rate, 'HET_RATE': het_rate, 'HH_CT': sample_hh,
+        'FAIL': np.where(fail_mind, 'mind', '.'),
+    })[SAMPLE_COLUMNS]
+    samples.to_csv(out_prefix + '.sqc.tsv', sep='\t', index=False, na_rep='NA', float_format='%.6g')
+
+    exclude = np.concatenate(exclude) if exclude else np.array([], dtype=object)
+    pd.Series(exclude, dtype=object).to_csv(out_prefix + '.exclude', index=False, header=False)
+    samples.loc[fail_mind, ['FID', 'IID']].to_csv(out_prefix + '.remove', sep='\t', index=False, header=False)
+
+    summary = {
+        'analysis_date': datetime.now().isoformat(),
+        'bfile': bfile,
+        'thresholds': {'geno': geno, 'mind': mind, 'maf': maf, 'hwe': hwe},
+        'hwe_samples': 'controls' if n_hwe < n_samples else 'all',
+        'n_variants': int(reader.n_variants),
+        'n_samples': int(n_samples),
+        'genotyping_rate': 1 - total_missing / max(reader.n_variants * n_samples, 1),
+        'variant_failures': reasons,
+        'n_exclude_variants': int(len(exclude)),
+        'n_remove_samples': int(fail_mind.sum()),
+        'het_haploid_genotypes': int(sample_hh.sum()),
+        'files': {k: out_prefix + ext for k, ext in (('variants', '.vqc.tsv'), ('samples', '.sqc.tsv'),
+                                                      ('exclude', '.exclude'), ('remove', '.remove'))},
+    }
+    if not has_bim:
+        print(f"⚠️ {bfile}.bim не найден: хромосомы неизвестны, список исключений вариантов пуст")
+        summary['warning'] = 'нет .bim: гаплоидные хромосомы не учтены, исключения вариантов не записаны'
+    for ext, parser in (('.hh', parse_hh), ('.log', parse_plink_log)):
+        if os.path.exists(bfile + ext):
+            summary[ext.lstrip('.')] = parser(bfile + ext)
+    if 'hh' in summary:
+        summary['hh']['computed'] = summary['het_haploid_genotypes']
+
+    tmp_path = out_prefix + '.qc_summary.json.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2, default=str)
+    os.replace(tmp_path, out_prefix + '.qc_summary.json')
+    print_qc_summary(summary)
+    return summary
+
+
+def print_qc_summary(summary):
+    print(f"QC {summary['bfile']}: {summary['n_variants']} вариантов, {summary['n_samples']} образцов")
+    print(f"   Доля генотипов: {summary['genotyping_rate']:.6f} (HWE по: {summary['hwe_samples']})")
+    for reason, count in summary['variant_failures'].items():
+        print(f"   Не прошли {reason} ({summary['thresholds'][reason]}): {count}")
+    print(f"   Вариантов к исключению: {summary['n_exclude_variants']}, "
+          f"образцов к удалению (mind {summary['thresholds']['mind']}): {summary['n_remove_samples']}")
+    print(f"   Гетерозиготных гаплоидных генотипов: {summary['het_haploid_genotypes']}"
+          + (f" (в .hh: {summary['hh']['n_genotypes']})" if 'hh' in summary else ''))
+    for warning in summary.get('log', {}).get('warnings', [])[:5]:
+        print(f"   .log: {warning['count']} × {warning['type'][:100]}")
+
+
+def write_filtered_bfile(bfile, out_prefix, exclude=None, remove=None, block_bytes=BLOCK_BYTES):
+    """
+    Набор .bed/.bim/.fam без исключенных вариантов и образцов (списки — пути
+    к файлам .exclude / .remove). Без удаления образцов строки .bed копируются
+    без перекодирования.
+    """
+    reader = BedReader(bfile)
+    keep_variants = np.ones(reader.n_variants, dtype=bool)
+    if exclude and os.path.getsize(exclude):
+        ids = pd.read_csv(exclude, header=None, dtype=str)[0]
+        keep_variants &= ~reader.bim['SNP'].isin(ids).to_numpy()
+    keep_samples = np.ones(reader.n_samples, dtype=bool)
+    if remove and os.path.getsize(remove):
+        removed = pd.read_csv(remove, sep=r'\s+', header=None, names=['FID', 'IID'], dtype=str)
+        keys = reader.fam['FID'].astype(str) + '\t' + reader.fam['IID'].astype(str)
+        keep_samples &= ~keys.isin(removed['FID'] + '\t' + removed['IID']).to_numpy()
+    variants = np.flatnonzero(keep_variants)
+    samples = np.flatnonzero(keep_samples)
+
+    block_size = max(1, block_bytes // max(reader.bytes_per_variant, 1))
+    with open(out_prefix + '.bed.tmp', 'wb') as bed:
+        bed.write(BED_MAGIC)
+        if len(samples) == reader.n_samples:
+            for _, packed in reader.iter_packed(block_size, variants):
+                bed.write(packed.tobytes())
+        else:
+            for _, genotypes in reader.iter_blocks(block_size, samples, variants):
+                bed.write(encode_block(genotypes).tobytes())
+    reader.bim.iloc[variants].to_csv(out_prefix + '.bim', sep='\t', header=False, index=False)
+    reader.fam.iloc[samples].to_csv(out_prefix + '.fam', sep=' ', header=False, index=False)
+    os.replace(out_prefix + '.bed.tmp', out_prefix + '.bed')
+    print(f"Отфильтрованный набор: {out_prefix} ({len(variants)} вариантов, {len(samples)} образцов)")
+    return out_prefix
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='QC генотипов .bed: пропуски, MAF, HWE, гетерозиготные гаплоидные')
+    parser.add_argument('--bfile', required=True)
+    parser.add_argument('--out', required=True, help='Префикс выходных файлов')
+    parser.add_argument('--pheno', default=None, help='Файл фенотипов (HWE по контролям)')
+    parser.add_argument('--pheno-name', default='PHENO')
+    parser.add_argument('--geno', type=float, default=GENO, help='Максимальная доля пропусков варианта')
+    parser.add_argument('--mind', type=float, default=MIND, help='Максимальная доля пропусков образца')
+    parser.add_argument('--maf', type=float, default=MAF)
+    parser.add_argument('--hwe', type=float, default=HWE)
+    parser.add_argument('--make-bed', action='store_true',
+                        help='Записать <out>.bed/.bim/.fam без исключенных вариантов и образцов')
+    args = parser.parse_args()
+    genotype_qc(args.bfile, args.out, args.pheno, args.pheno_name, args.geno, args.mind, args.maf, args.hwe)
+    if args.make_bed:
+        write_filtered_bfile(args.bfile, args.out, args.out + '.exclude', args.out + '.remove')
@@ -0,0 +1,278 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+# Файл результатов GWAS по умолчанию
+DEFAULT_GWAS_FILE = "/home/esp/data_analyze/01.06.2025_v2/data/init/gwas_results.assoc"
+
+# Версия формата кэша: при изменении схемы старые кэши пересобираются
+CACHE_VERSION = 2
+
+# Типы колонок .assoc (PLINK 1.9) и .glm.logistic.hybrid (PLINK 2.0)
+CATEGORY_COLUMNS = {'CHR', '#CHROM', 'A1', 'A2', 'REF', 'ALT', 'OMITTED',
+                    'PROVISIONAL_REF?', 'FIRTH?', 'TEST', 'ERRCODE'}
+INT_COLUMNS = {'BP': 'int32', 'POS': 'int32', 'OBS_CT': 'int32'}
+FLOAT_COLUMNS = {'P': 'float64', 'OR': 'float64', 'LOG(OR)_SE': 'float64',
+                 'Z_STAT': 'float64', 'CHISQ': 'float64', 'SE': 'float64',
+                 'A1_FREQ': 'float32', 'F_A': 'float32', 'F_U': 'float32'}
+
+# Названия колонок одной и той же роли в выводе PLINK 1.9 и PLINK 2.0
+COLUMN_ROLES = {
+    'chrom': ['CHR', '#CHROM', 'CHROM'],
+    'pos': ['BP', 'POS'],
+    'id': ['SNP', 'ID'],
+    'a1': ['A1'],
+    'ref': ['REF', 'A2'],
+    'alt': ['ALT'],
+}
+
+
+def find_column(columns, role):
+    """
+    Имя колонки с заданной ролью ('chrom', 'pos', 'id', ...) или None
+    """
+    for name in COLUMN_ROLES[role]:
+        if name in columns:
+            return name
+    return None
+
+
+def chrom_sort_key(value):
+    """
+    Естественный порядок хромосом: 1..22, затем X, Y, XY, MT и прочие
+    """
+    text = str(value)
+    if text.isdigit():
+        return (0, int(text), '')
+    return (1, 0, text)
+
+
+def file_signature(path):
+    """
+    Размер и время изменения файла (быстрая проверка актуальности)
+    """
+    st = os.stat(path)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """
+    SHA-256 содержимого файла (читается блоками)
+    """
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def default_cache_dir(path):
+    """
+    Директория кэша рядом с исходным файлом: <файл>.cache
+    """
+    return os.path.abspath(path) + '.cache'
+
+
+def read_gwas_text(path, usecols=None, chunksize=None):
+    """
+    Разбор текстового файла .assoc / .glm.logistic.hybrid.
+    Разделитель — любые пробельные символы (PLINK 1.9 выравнивает пробелами,
+    PLINK 2.0 пишет табуляцию), пропуски PLINK ('NA', '.') -> NaN.
+    """
+    return pd.read_csv(path, sep=r'\s+', usecols=usecols, chunksize=chunksize,
+                       na_values=['NA', 'nan', '.'], low_memory=False)
+
+
+def _encode_column(series):
+    """
+    Преобразование колонки в набор numpy-массивов для сохранения.
+    Возвращает (описание колонки, {суффикс файла: массив}).
+    """
+    name = series.name
+    if name in INT_COLUMNS and not series.isnull().any():
+        return {'kind': 'numeric'}, {'': series.to_numpy(dtype=INT_COLUMNS[name])}
+    if name in FLOAT_COLUMNS:
+        values = pd.to_numeric(series, errors='coerce')
+        return {'kind': 'numeric'}, {'': values.to_numpy(dtype=FLOAT_COLUMNS[name])}
+    if pd.api.types.is_numeric_dtype(series) and name not in CATEGORY_COLUMNS:
+        return {'kind': 'numeric'}, {'': series.to_numpy()}
+
+    # Категориальные и строковые колонки: коды + словарь значений
+    if name in CATEGORY_COLUMNS or series.nunique(dropna=True) < 0.5 * len(series):
+        cat = series.astype('category')
+        categories = sorted(cat.cat.categories, key=chrom_sort_key)
+        cat = cat.cat.reorder_categories(categories)
+        codes = cat.cat.codes.to_numpy()
+        if pd.api.types.is_integer_dtype(cat.cat.categories):
+            cats = np.asarray(categories, dtype='int64')
+            cats_kind = 'int'
+        else:
+            cats = np.asarray([str(c) for c in categories], dtype='S')
+            cats_kind = 'bytes'
+        return ({'kind': 'category', 'categories': cats_kind},
+                {'.codes': codes, '.categories': cats})
+
+    # Уникальные строки (ID вариантов): байтовый массив фиксированной ширины
+    values = series.fillna('').astype(str).str.encode('utf-8').to_numpy(dtype='S')
+    return {'kind': 'bytes'}, {'': values}
+
+
+def _column_file(cache_dir, index, suffix):
+    return os.path.join(cache_dir, f'col{index:03d}{suffix}.npy')
+
+
+def build_cache(path, cache_dir=None, source_hash=None):
+    """
+    Однократный разбор текстового файла GWAS и запись типизированного
+    колоночного кэша (по одному .npy на колонку + meta.json).
+    Запись атомарная: кэш собирается во временной директории и подменяется целиком.
+    """
+    cache_dir = cache_dir or default_cache_dir(path)
+    df = read_gwas_text(path)
+
+    parent = os.path.dirname(os.path.abspath(cache_dir))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix='.gwas_cache_', dir=parent)
+    try:
+        columns = []
+        for i, col in enumerate(df.columns):
+            info, arrays = _encode_column(df[col])
+            info['name'] = col
+            for suffix, arr in arrays.items():
+                np.save(_column_file(tmp_dir, i, suffix), arr, allow_pickle=False)
+            columns.append(info)
+
+        meta = {
+            'version': CACHE_VERSION,
+            'source': os.path.abspath(path),
+            'source_sha256': source_hash or file_hash(path),
+            'n_rows': int(len(df)),
+            'columns': columns,
+        }
+        meta.update(file_signature(path))
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+
+        if os.path.isdir(cache_dir):
+            shutil.rmtree(cache_dir)
+        os.replace(tmp_dir, cache_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return cache_dir
+
+
+def read_cache_meta(cache_dir):
+    meta_path = os.path.join(cache_dir, 'meta.json')
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def cache_is_fresh(path, cache_dir=None, version=CACHE_VERSION):
+    """
+    Проверка актуальности кэша: сначала по размеру и mtime, при расхождении —
+    по SHA-256 содержимого (файл мог быть скопирован без изменений).
+    """
+    cache_dir = cache_dir or default_cache_dir(path)
+    meta = read_cache_meta(cache_dir)
+    if meta is None or meta.get('version') != version:
+        return False
+    signature = file_signature(path)
+    if all(meta.get(k) == v for k, v in signature.items()):
+        return True
+    if meta.get('size') != signature['size']:
+        return False
+    if meta.get('source_sha256') != file_hash(path):
+        return False
+
+    # Содержимое не изменилось — обновляем mtime в метаданных
+    meta.update(signature)
+    with open(os.path.join(cache_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return True
+
+
+def ensure_cache(path, cache_dir=None):
+    """
+    Возвращает путь к актуальному кэшу, при необходимости пересобирая его
+    """
+    cache_dir = cache_dir or default_cache_dir(path)
+    if not cache_is_fresh(path, cache_dir):
+        print(f"   Построение колоночного кэша GWAS: {cache_dir}")
+        build_cache(path, cache_dir)
+    return cache_dir
+
+
+def read_cache_column(cache_dir, name, meta=None, mmap=True):
+    """
+    Сырые массивы одной колонки кэша без сборки DataFrame:
+    ('numeric', значения), ('category', коды, категории) или ('bytes', значения).
+    Позволяет вычислять условия прямо по кодам и байтовым строкам.
+    """
+    meta = meta or read_cache_meta(cache_dir)
+    mmap_mode = 'r' if mmap else None
+    for i, info in enumerate(meta['columns']):
+        if info['name'] != name:
+            continue
+        if info['kind'] == 'category':
+            cats = np.load(_column_file(cache_dir, i, '.categories'))
+            if info['categories'] == 'bytes':
+                cats = cats.astype(str)
+            return ('category', np.load(_column_file(cache_dir, i, '.codes'), mmap_mode=mmap_mode), cats)
+        return (info['kind'], np.load(_column_file(cache_dir, i, ''), mmap_mode=mmap_mode))
+    raise KeyError(f"Колонка отсутствует в кэше GWAS: {name}")
+
+
+def load_cache(cache_dir, columns=None, mmap=True, rows=None):
+    """
+    Загрузка DataFrame из кэша. Числовые колонки отображаются в память (mmap),
+    поэтому загрузка подмножества колонок не читает остальные.
+    rows — номера строк: читаются и декодируются только они.
+    """
+    meta = read_cache_meta(cache_dir)
+    if meta is None:
+        raise FileNotFoundError(f"Кэш GWAS не найден: {cache_dir}")
+    mmap_mode = 'r' if mmap else None
+    take = (lambda arr: arr) if rows is None else (lambda arr: np.asarray(arr[rows]))
+
+    data = {}
+    for i, info in enumerate(meta['columns']):
+        name = info['name']
+        if columns is not None and name not in columns:
+            continue
+        if info['kind'] == 'numeric':
+            data[name] = take(np.load(_column_file(cache_dir, i, ''), mmap_mode=mmap_mode))
+        elif info['kind'] == 'category':
+            codes = take(np.load(_column_file(cache_dir, i, '.codes'), mmap_mode=mmap_mode))
+            cats = np.load(_column_file(cache_dir, i, '.categories'))
+            if info['categories'] == 'bytes':
+                cats = cats.astype(str)
+            data[name] = pd.Categorical.from_codes(codes, categories=cats, ordered=True)
+        else:
+            values = take(np.load(_column_file(cache_dir, i, ''), mmap_mode=mmap_mode))
+            data[name] = values.astype(str).astype(object)
+
+    if columns is not None:
+        missing = [c for c in columns if c not in data]
+        if missing:
+            raise KeyError(f"Колонки отсутствуют в кэше GWAS: {missing}")
+        data = {c: data[c] for c in columns}
+    return pd.DataFrame(data, copy=False)
+
+
+def load_gwas(path=DEFAULT_GWAS_FILE, columns=None, cache_dir=None, use_cache=True):
+    """
+    Загрузка результатов GWAS (.assoc или .glm.logistic.hybrid).
+    Текстовый файл разбирается один раз; последующие вызовы читают
+    колоночный кэш, который пересобирается только при изменении исходника.
+    """
+    if not use_cache:
+        return read_gwas_text(path, usecols=columns)
+    return load_cache(ensure_cache(path, cache_dir), columns=columns)
@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+
+from gwas_cache import chrom_sort_key
+
+# Пороги линий значимости
+GENOME_WIDE_P = 5e-8
+NOMINAL_P = 0.05
+
+# Точки с P < THIN_BELOW_P рисуются все; остальные прореживаются по пикселям
+THIN_BELOW_P = 1e-3
+
+CHROM_COLORS = ['#1f77b4', '#ff7f0e']  # Чередующиеся цвета
+CHROM_GAP = 1_000_000
+
+
+def manhattan_coordinates(chrom, pos, gap=CHROM_GAP):
+    """
+    Сквозные координаты по геному одним groupby: смещение хромосомы —
+    накопленная сумма максимумов BP предыдущих хромосом плюс зазор.
+    Возвращает (x, номер хромосомы по порядку, позиции подписей, подписи).
+    """
+    labels = pd.Series(chrom).astype(str).to_numpy()
+    uniques = sorted(pd.unique(labels), key=chrom_sort_key)
+    codes = pd.Categorical(labels, categories=uniques).codes
+    pos = np.asarray(pos, dtype='float64')
+
+    per_chrom = pd.DataFrame({'code': codes, 'pos': pos}).groupby('code')['pos'].agg(['max', 'median'])
+    per_chrom = per_chrom.reindex(range(len(uniques)), fill_value=0)
+    offsets = np.concatenate([[0.0], np.cumsum(per_chrom['max'].to_numpy() + gap)[:-1]])
+
+    x = pos + offsets[codes]
+    ticks = offsets + per_chrom['median'].to_numpy()
+    return x, codes, ticks, [str(u) for u in uniques]
+
+
+def thin_points(x, y, groups, keep, width_px, height_px):
+    """
+    Прореживание плотного слоя: из точек, не отмеченных в keep, остается
+    по одной на ячейку сетки width_px x height_px (и группу цвета).
+    Возвращает индексы оставленных точек.
+    """
+    idx = np.flatnonzero(~keep)
+    if len(idx) == 0:
+        return np.flatnonzero(keep)
+    x_min, x_max = np.min(x), np.max(x)
+    y_max = max(np.max(y), 1e-12)
+    px = ((x[idx] - x_min) / max(x_max - x_min, 1e-12) * (width_px - 1)).astype('int64')
+    py = (y[idx] / y_max * (height_px - 1)).astype('int64')
+    cell = (px * height_px + py) * 2 + (groups[idx] % 2)
+    _, first = np.unique(cell, return_index=True)
+    return np.concatenate([idx[np.sort(first)], np.flatnonzero(keep)])
+
+
+def _grid_size(ax, dpi, marker_size):
+    """
+    Сетка прореживания: ячейка — половина диаметра маркера в пикселях,
+    так что прореживание не видно на итоговом изображении
+    """
+    width, height = ax.figure.get_size_inches()
+    cell_px = max(1.0, np.sqrt(marker_size) * dpi / 72 / 2)
+    return max(1, int(width * dpi / cell_px)), max(1, int(height * dpi / cell_px))
+
+
+def plot_manhattan(ax, chrom, pos, p, thin_below=THIN_BELOW_P, dpi=150):
+    """
+    Manhattan plot: прореженный растровый слой незначимых точек и
+    векторный слой всех точек с P < thin_below
+    """
+    # P, равные 0 из-за потери точности, — самые сильные сигналы: ограничиваются снизу, а не отбрасываются
+    p = np.clip(np.asarray(p, dtype='float64'), np.finfo(float).tiny, 1)
+    valid = ~np.isnan(p) & ~pd.isnull(pd.Series(chrom)).to_numpy() & ~np.isnan(np.asarray(pos, dtype='float64'))
+    x, codes, ticks, labels = manhattan_coordinates(np.asarray(chrom)[valid], np.asarray(pos)[valid])
+    y = -np.log10(p[valid])
+
+    keep = y >= -np.log10(thin_below)
+    shown = thin_points(x, y, codes, keep, *_grid_size(ax, dpi, 10))
+    dense = shown[~keep[shown]]
+    sparse = shown[keep[shown]]
+
+    colors = np.array(CHROM_COLORS)
+    ax.scatter(x[dense], y[dense], c=colors[codes[dense] % 2], alpha=0.6, s=10,
+               rasterized=True, linewidths=0)
+    ax.scatter(x[sparse], y[sparse], c=colors[codes[sparse] % 2], alpha=0.6, s=10,
+               linewidths=0)
+
+    ax.axhline(y=-np.log10(GENOME_WIDE_P), color='red', linestyle='--',
+               label='Genome-wide significance (5e-8)')
+    ax.axhline(y=-np.log10(NOMINAL_P), color='blue', linestyle='--',
+               label='Nominal significance (0.05)')
+    ax.set_xlabel('Chromosome')
+    ax.set_ylabel('-log10(P-value)')
+    ax.set_title('Manhattan Plot')
+    ax.set_xticks(ticks)
+    ax.set_xticklabels(labels)
+    ax.legend()
+    return len(shown), int(valid.sum())
+
+
+def plot_qq(ax, p, thin_below=THIN_BELOW_P, dpi=150):
+    """
+    QQ plot с тем же прореживанием: хвост (P < thin_below) рисуется полностью
+    """
+    p = np.clip(np.asarray(p, dtype='float64'), np.finfo(float).tiny, 1)
+    p = np.sort(p[~np.isnan(p)])
+    n = len(p)
+    if n == 0:
+        return 0, 0
+    observed = -np.log10(p)
+    expected = -np.log10(np.arange(1, n + 1) / n)
+
+    keep = observed >= -np.log10(thin_below)
+    shown = thin_points(expected, observed, np.zeros(n, dtype='int64'), keep,
+                        *_grid_size(ax, dpi, 36))
+    dense = shown[~keep[shown]]
+    sparse = shown[keep[shown]]
+
+    ax.scatter(expected[dense], observed[dense], alpha=0.6, color='#1f77b4',
+               rasterized=True, linewidths=0)
+    ax.scatter(expected[sparse], observed[sparse], alpha=0.6, color='#1f77b4',
+               linewidths=0)
+    max_expected = expected[0]
+    ax.plot([0, max_expected], [0, max_expected], 'r--', label='Expected')
+    ax.set_xlabel('Expected -log10(P)')
+    ax.set_ylabel('Observed -log10(P)')
+    ax.set_title('QQ Plot')
+    ax.legend()
+    return len(shown), n
+
+
+def plot_pvalue_histogram(ax, p, bins=50):
+    """
+    Гистограмма p-values: интервалы считаются заранее (np.histogram)
+    """
+    p = np.asarray(p, dtype='float64')
+    counts, edges = np.histogram(p[~np.isnan(p)], bins=bins)
+    ax.stairs(counts, edges, fill=True, alpha=0.7, edgecolor='black')
+    ax.axvline(x=0.05, color='red', linestyle='--', label='p = 0.05')
+    ax.axvline(x=5e-8, color='orange', linestyle='--', label='p = 5e-8')
+    ax.set_xlabel('P-value')
+    ax.set_ylabel('Frequency')
+    ax.set_title('Distribution of P-values')
+    ax.legend()
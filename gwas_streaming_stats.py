@@ -0,0 +1,245 @@
+import heapq
+
+import numpy as np
+import pandas as pd
+
+from gwas_cache import CATEGORY_COLUMNS, find_column, read_gwas_text
+
+# Размер блока строк при потоковом чтении
+DEFAULT_CHUNKSIZE = 1_000_000
+
+# Пороги значимости, как в complete_analysis.py / analyze_assoc_file.py
+P_THRESHOLDS = {'significant_005': 0.05, 'significant_001': 0.001,
+                'genome_wide_significant': 5e-8}
+
+DESCRIBE_PERCENTILES = (0.25, 0.5, 0.75)
+
+
+class QuantileSketch:
+    """
+    Потоковый скетч квантилей (KLL-подобный): значения накапливаются
+    по уровням, переполненный уровень сортируется и каждая вторая точка
+    переносится на следующий уровень с удвоенным весом.
+    Память — O(k · log(n / k)), ошибка ранга — порядка 1/k.
+    """
+
+    def __init__(self, k=4096, seed=0):
+        self.k = k
+        self.n = 0
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, values):
+        values = np.asarray(values, dtype='float64')
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        self.n += len(values)
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compact()
+
+    def _compact(self):
+        h = 0
+        while h < len(self.levels):
+            buf = self.levels[h]
+            if len(buf) > self.k:
+                buf = np.sort(buf)
+                odd = len(buf) % 2
+                offset = self._rng.integers(2)
+                promoted = buf[offset:len(buf) - odd:2]
+                self.levels[h] = buf[len(buf) - odd:]
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                self.levels[h + 1] = np.concatenate([self.levels[h + 1], promoted])
+            h += 1
+
+    def quantiles(self, qs):
+        """
+        Оценка квантилей qs (доли от 0 до 1)
+        """
+        if self.n == 0:
+            return [np.nan for _ in qs]
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(buf), 2.0 ** h)
+                                  for h, buf in enumerate(self.levels)])
+        order = np.argsort(values, kind='stable')
+        values = values[order]
+        cum = np.cumsum(weights[order])
+        total = cum[-1]
+        return [float(values[min(np.searchsorted(cum, q * total), len(values) - 1)])
+                for q in qs]
+
+
+class RunningMoments:
+    """
+    Точные count / mean / std / min / max с объединением по блокам (Chan et al.)
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values):
+        values = np.asarray(values, dtype='float64')
+        values = values[~np.isnan(values)]
+        n_b = len(values)
+        if n_b == 0:
+            return
+        mean_b = values.mean()
+        m2_b = ((values - mean_b) ** 2).sum()
+        n_a = self.count
+        n = n_a + n_b
+        delta = mean_b - self.mean
+        self.mean += delta * n_b / n
+        self.m2 += m2_b + delta ** 2 * n_a * n_b / n
+        self.count = n
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    @property
+    def std(self):
+        return float(np.sqrt(self.m2 / (self.count - 1))) if self.count > 1 else np.nan
+
+
+class TopK:
+    """
+    k строк с наименьшим P (куча ограниченного размера, при равных P
+    сохраняются более ранние строки — как в DataFrame.nsmallest)
+    """
+
+    def __init__(self, k=10):
+        self.k = k
+        self._heap = []
+        self._seen = 0
+
+    def update(self, chunk, column='P'):
+        candidates = chunk.dropna(subset=[column]).nsmallest(self.k, column)
+        for offset, row in zip(candidates.index, candidates.to_dict('records')):
+            item = (-row[column], -(self._seen + offset), row)
+            if len(self._heap) < self.k:
+                heapq.heappush(self._heap, item)
+            elif item[:2] > self._heap[0][:2]:
+                heapq.heapreplace(self._heap, item)
+        self._seen += len(chunk)
+
+    def result(self):
+        rows = [row for _, _, row in sorted(self._heap, key=lambda x: (-x[0], -x[1]))]
+        return pd.DataFrame(rows)
+
+
+def streaming_gwas_summary(path, chunksize=DEFAULT_CHUNKSIZE, top_k=10, sketch_k=4096):
+    """
+    Сводка по файлу GWAS за один проход с ограниченной памятью:
+    точные счетчики (строки, пропуски, SNP по хромосомам, пороги p-value),
+    top-k по P и квантили (describe(), медиана P) по скетчу.
+    """
+    n_rows = 0
+    columns = None
+    numeric_columns = None
+    missing = None
+    chr_counts = pd.Series(dtype='int64')
+    p_counts = dict.fromkeys(P_THRESHOLDS, 0)
+    moments = {}
+    sketches = {}
+    top = TopK(top_k)
+    head = None
+
+    for chunk in read_gwas_text(path, chunksize=chunksize):
+        if columns is None:
+            columns = chunk.columns.tolist()
+            numeric_columns = [c for c in chunk.select_dtypes(include='number').columns
+                               if c not in CATEGORY_COLUMNS]
+            missing = pd.Series(0, index=columns, dtype='int64')
+            moments = {c: RunningMoments() for c in numeric_columns}
+            sketches = {c: QuantileSketch(sketch_k) for c in numeric_columns}
+            head = chunk.head()
+
+        chunk.index = pd.RangeIndex(0, len(chunk))
+        n_rows += len(chunk)
+        missing = missing.add(chunk.isnull().sum(), fill_value=0).astype('int64')
+
+        for col in numeric_columns:
+            values = pd.to_numeric(chunk[col], errors='coerce').to_numpy(dtype='float64')
+            moments[col].update(values)
+            sketches[col].update(values)
+
+        if 'CHR' in chunk.columns:
+            chr_counts = chr_counts.add(chunk['CHR'].value_counts(), fill_value=0)
+
+        if 'P' in chunk.columns:
+            p_values = pd.to_numeric(chunk['P'], errors='coerce')
+            chunk['P'] = p_values
+            for name, threshold in P_THRESHOLDS.items():
+                p_counts[name] += int((p_values < threshold).sum())
+            top.update(chunk, 'P')
+
+    if columns is None:
+        raise ValueError(f"Файл GWAS пуст: {path}")
+
+    describe = {}
+    for col in numeric_columns:
+        m = moments[col]
+        q = sketches[col].quantiles(DESCRIBE_PERCENTILES)
+        describe[col] = {'count': m.count, 'mean': m.mean if m.count else np.nan,
+                         'std': m.std, 'min': m.min if m.count else np.nan,
+                         '25%': q[0], '50%': q[1], '75%': q[2],
+                         'max': m.max if m.count else np.nan}
+
+    summary = {
+        'n_rows': n_rows,
+        'columns': columns,
+        'head': head,
+        'describe': pd.DataFrame(describe),
+        'missing': missing,
+        'chr_counts': chr_counts.astype('int64').sort_index(),
+    }
+    if 'P' in columns:
+        summary['p_value_statistics'] = dict(
+            total_with_pvalue=moments['P'].count if 'P' in moments else n_rows - int(missing['P']),
+            **p_counts,
+            min_pvalue=moments['P'].min if 'P' in moments and moments['P'].count else None,
+            median_pvalue=describe['P']['50%'] if 'P' in describe else None,
+        )
+        summary['top_significant'] = top.result()
+    return summary
+
+
+def print_streaming_summary(summary):
+    """
+    Печать сводки в том же виде, что и analyze_assoc_file()
+    """
+    print(f"=== ОБЩАЯ ИНФОРМАЦИЯ ===")
+    print(f"Размер данных: ({summary['n_rows']}, {len(summary['columns'])})")
+    print(f"Колонки: {summary['columns']}")
+    print(f"\nПервые 5 строк:")
+    print(summary['head'])
+
+    print(f"\n=== СТАТИСТИЧЕСКАЯ СВОДКА ===")
+    print(summary['describe'])
+
+    if 'p_value_statistics' in summary:
+        stats = summary['p_value_statistics']
+        print(f"\n=== АНАЛИЗ P-VALUES ===")
+        print(f"Всего p-values: {stats['total_with_pvalue']}")
+        print(f"Значимые (p < 0.05): {stats['significant_005']}")
+        print(f"Высоко значимые (p < 0.001): {stats['significant_001']}")
+        print(f"Genome-wide significant (p < 5e-8): {stats['genome_wide_significant']}")
+        print(f"Медианное p-value (оценка): {stats['median_pvalue']}")
+
+        top_snps = summary['top_significant']
+        print(f"\nТоп {len(top_snps)} наиболее значимых SNP:")
+        id_column = find_column(top_snps.columns, 'id') or top_snps.columns[0]
+        if len(top_snps):
+            print(top_snps[[id_column, 'P']])
+
+    if len(summary['chr_counts']):
+        print(f"\n=== АНАЛИЗ ПО ХРОМОСОМАМ ===")
+        print("Количество SNP по хромосомам:")
+        print(summary['chr_counts'])
+
+    print(f"\n=== ОТСУТСТВУЮЩИЕ ЗНАЧЕНИЯ ===")
+    missing = summary['missing']
+    print(missing[missing > 0])
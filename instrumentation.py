@@ -0,0 +1,180 @@
+import contextlib
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+# Переменные окружения для скриптов без своих аргументов командной строки
+ENV_TRACE = 'GWAS_TRACE'
+ENV_PROFILE = 'GWAS_PROFILE'
+ENV_TRACEMALLOC = 'GWAS_TRACEMALLOC'
+
+
+def _read_proc(path, keys):
+    values = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                name, _, rest = line.partition(':')
+                if name in keys:
+                    values[name] = int(rest.split()[0])
+    except OSError:
+        pass
+    return values
+
+
+def process_counters():
+    """
+    Текущий и пиковый RSS (МБ) и прочитанные байты процесса (Linux /proc)
+    """
+    status = _read_proc('/proc/self/status', ('VmRSS', 'VmHWM'))
+    io = _read_proc('/proc/self/io', ('rchar',))
+    return {'rss_mb': status.get('VmRSS', 0) / 1024, 'peak_rss_mb': status.get('VmHWM', 0) / 1024,
+            'bytes_read': io.get('rchar', 0)}
+
+
+class Span:
+    """
+    Открытый участок трассы: счетчики (строки, байты и т.п.) добавляются через count()
+    """
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = dict(args)
+        # Пик tracemalloc вложенных участков (reset_peak внутри них сбрасывает общий счетчик)
+        self.memory_peak = 0
+
+    def count(self, **counters):
+        for key, value in counters.items():
+            self.args[key] = self.args.get(key, 0) + int(value)
+
+
+class Tracer:
+    """
+    Легкая трассировка этапов: время, RSS и его пик, прочитанные байты,
+    пользовательские счетчики. Сохраняется в формате Chrome trace-event
+    (chrome://tracing, Perfetto). cProfile и tracemalloc включаются по флагу.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.origin = time.perf_counter()
+        self.trace_file = None
+        self.profiler = None
+        self.profile_file = None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def configure(self, trace_file=None, profile=False, trace_memory=False):
+        self.trace_file = trace_file
+        if profile:
+            self.profile_file = (os.path.splitext(trace_file)[0] if trace_file else 'gwas') + '.prof'
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def span(self, name, **args):
+        record = Span(name, args)
+        stack = self.local.__dict__.setdefault('stack', [])
+        stack.append(record)
+        before = process_counters()
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            end = time.perf_counter()
+            after = process_counters()
+            # Пик вырос (или сброшен конвейером) — он достигнут внутри участка;
+            # иначе известна только нижняя оценка по текущему RSS
+            if after['peak_rss_mb'] != before['peak_rss_mb']:
+                peak_delta = after['peak_rss_mb'] - before['rss_mb']
+            else:
+                peak_delta = max(0.0, after['rss_mb'] - before['rss_mb'])
+            record.args.update(
+                rss_delta_mb=round(after['rss_mb'] - before['rss_mb'], 2),
+                peak_rss_delta_mb=round(peak_delta, 2),
+                bytes_read=after['bytes_read'] - before['bytes_read'] + record.args.get('bytes_read', 0),
+            )
+            stack.pop()
+            if tracemalloc.is_tracing():
+                peak = max(tracemalloc.get_traced_memory()[1], record.memory_peak)
+                record.args['tracemalloc_peak_mb'] = round(peak / 2**20, 2)
+                for parent in stack:
+                    parent.memory_peak = max(parent.memory_peak, peak)
+            with self.lock:
+                self.events.append({
+                    'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': threading.get_ident(),
+                    'ts': round((start - self.origin) * 1e6, 1), 'dur': round((end - start) * 1e6, 1),
+                    'args': record.args,
+                })
+
+    def timed(self, name=None):
+        """
+        Декоратор: каждый вызов функции — участок трассы
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name or func.__qualname__):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def summary(self):
+        """
+        Суммарное время и число вызовов по именам участков
+        """
+        totals = {}
+        for event in self.events:
+            item = totals.setdefault(event['name'], {'calls': 0, 'seconds': 0.0})
+            item['calls'] += 1
+            item['seconds'] += event['dur'] / 1e6
+        return totals
+
+    def finish(self):
+        """
+        Запись трассы и профиля (если включены); вызывается в конце запуска
+        """
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile_file)
+            print(f"Профиль cProfile: {self.profile_file}")
+            self.profiler = None
+        if self.trace_file:
+            tmp_path = self.trace_file + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+            os.replace(tmp_path, self.trace_file)
+            print(f"Трасса (Chrome trace-event): {self.trace_file}")
+            for name, item in sorted(self.summary().items(), key=lambda kv: -kv[1]['seconds']):
+                print(f"   {name:<40} {item['calls']:>5} × {item['seconds']:9.3f} с")
+
+
+TRACER = Tracer()
+span = TRACER.span
+timed = TRACER.timed
+
+
+def add_arguments(parser):
+    parser.add_argument('--trace', default=None, help='Записать трассу этапов (Chrome trace-event JSON)')
+    parser.add_argument('--profile', action='store_true', help='Профиль cProfile рядом с трассой')
+    parser.add_argument('--tracemalloc', action='store_true', help='Пики выделений памяти по этапам')
+
+
+def configure_from_args(args):
+    TRACER.configure(args.trace, args.profile, args.tracemalloc)
+
+
+def configure_from_env():
+    """
+    Включение по переменным окружения: GWAS_TRACE=trace.json, GWAS_PROFILE=1, GWAS_TRACEMALLOC=1
+    """
+    TRACER.configure(os.environ.get(ENV_TRACE), bool(os.environ.get(ENV_PROFILE)),
+                     bool(os.environ.get(ENV_TRACEMALLOC)))
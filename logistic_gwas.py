@@ -0,0 +1,222 @@
+import argparse
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+
+from plink_bed import MISSING_GENOTYPE, BedReader
+
+# Колонки как в plink2 --glm (*.glm.logistic.hybrid)
+GLM_COLUMNS = ['#CHROM', 'POS', 'ID', 'REF', 'ALT', 'PROVISIONAL_REF?', 'A1', 'OMITTED',
+               'A1_FREQ', 'FIRTH?', 'TEST', 'OBS_CT', 'OR', 'LOG(OR)_SE', 'Z_STAT', 'P', 'ERRCODE']
+
+MAX_ITER = 25
+TOLERANCE = 1e-6
+# Ограничение шага Ньютона (в единицах log OR), чтобы при разделении не улетать
+MAX_STEP = 5.0
+
+
+def read_binary_phenotype(fam, pheno_path, pheno_name='PHENO'):
+    """
+    Бинарный фенотип в порядке образцов .fam: 1 — случай, 0 — контроль,
+    NaN — пропуск. Кодировка PLINK: 2 — случай, 1 — контроль, 0/-9 — пропуск.
+    """
+    pheno = pd.read_csv(pheno_path, sep=r'\s+', dtype={'FID': str, 'IID': str, '#FID': str})
+    pheno = pheno.rename(columns={'#FID': 'FID'})
+    if pheno_name not in pheno.columns:
+        raise ValueError(f'В {pheno_path} нет колонки {pheno_name}')
+    pheno = pheno.drop_duplicates(['FID', 'IID'], keep='first')
+    merged = fam[['FID', 'IID']].merge(pheno[['FID', 'IID', pheno_name]],
+                                       on=['FID', 'IID'], how='left')
+    values = pd.to_numeric(merged[pheno_name], errors='coerce').to_numpy()
+    return np.where(values == 2, 1.0, np.where(values == 1, 0.0, np.nan))
+
+
+def fit_logistic_batch(g, y, mask, firth=False, max_iter=MAX_ITER, tol=TOLERANCE):
+    """
+    Аддитивная логистическая модель y ~ 1 + g сразу для многих вариантов
+    (IRLS, по строке на вариант). Матрица информации 2x2 обращается явно,
+    поэтому вся итерация — несколько векторных операций над блоком.
+    firth=True — штрафованное правдоподобие Фирта (устойчиво при разделении).
+    y — фенотип образцов или матрица того же размера, что g (свой фенотип
+    у каждой строки — перестановки одного варианта).
+    Возвращает (beta, se, converged).
+    """
+    n_var = g.shape[0]
+    beta = np.zeros((n_var, 2))
+    # Старт: логит доли случаев среди наблюдений варианта
+    case_frac = (y * mask).sum(1) / mask.sum(1)
+    beta[:, 0] = np.log(case_frac / (1 - case_frac))
+    converged = np.zeros(n_var, dtype=bool)
+    active = np.arange(n_var)
+
+    for _ in range(max_iter):
+        ga, ma, ba = g[active], mask[active], beta[active]
+        ya = _rows(y, active)
+        p = 1 / (1 + np.exp(-(ba[:, [0]] + ba[:, [1]] * ga)))
+        w = p * (1 - p) * ma
+        a, b, c = w.sum(1), (w * ga).sum(1), (w * ga * ga).sum(1)
+        det = a * c - b * b
+        resid = (ya - p) * ma
+        if firth:
+            # Диагональ матрицы-шляпы: h_i = w_i * x_i' (X'WX)^-1 x_i
+            h = w * (c[:, None] - 2 * b[:, None] * ga + a[:, None] * ga * ga) / det[:, None]
+            resid = resid + h * (0.5 - p)
+        u0, u1 = resid.sum(1), (resid * ga).sum(1)
+        step = np.column_stack([(c * u0 - b * u1) / det, (a * u1 - b * u0) / det])
+        size = np.abs(step).max(1)
+        step *= np.minimum(1.0, MAX_STEP / np.maximum(size, 1e-300))[:, None]
+        beta[active] = ba + step
+
+        done = size < tol
+        converged[active[done]] = True
+        active = active[~done & np.isfinite(size)]
+        if not len(active):
+            break
+
+    p = 1 / (1 + np.exp(-(beta[:, [0]] + beta[:, [1]] * g)))
+    w = p * (1 - p) * mask
+    a, b, c = w.sum(1), (w * g).sum(1), (w * g * g).sum(1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        se = np.sqrt(a / (a * c - b * b))
+    return beta, se, converged & np.isfinite(beta).all(1)
+
+
+def _rows(y, idx):
+    return y[idx] if y.ndim == 2 else y
+
+
+def _needs_firth(g, y, mask, converged, beta):
+    """
+    Режим hybrid: Фирт, если обычная регрессия не сошлась или в таблице
+    (случай/контроль x носитель/не носитель аллеля A1) есть нулевая клетка
+    """
+    carrier = (g > 0) & (mask > 0)
+    non_carrier = (g < 2) & (mask > 0)
+    cells = [(carrier * y).sum(1), (carrier * (1 - y)).sum(1),
+             (non_carrier * y).sum(1), (non_carrier * (1 - y)).sum(1)]
+    zero_cell = np.min(cells, axis=0) == 0
+    return ~converged | zero_cell | ~np.isfinite(beta[:, 1])
+
+
+def association_block(genotypes, y):
+    """
+    GLM для блока генотипов (варианты x образцы, int8): словарь колонок
+    A1_FREQ, FIRTH?, OBS_CT, OR, LOG(OR)_SE, Z_STAT, P, ERRCODE.
+    y — фенотип образцов или матрица (строки x образцы) с фенотипом на строку
+    """
+    observed = (genotypes != MISSING_GENOTYPE) & ~np.isnan(y)
+    mask = observed.astype('float64')
+    g = np.where(observed, genotypes, 0).astype('float64')
+    y0 = np.nan_to_num(y)
+
+    n_var = len(genotypes)
+    obs_ct = observed.sum(1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        a1_freq = g.sum(1) / (2 * obs_ct)
+        mean_g = g.sum(1) / obs_ct
+        n_case = (mask * y0).sum(1)
+    const = ((g - mean_g[:, None]) ** 2 * mask).sum(1) <= 0
+    no_outcome_var = (n_case == 0) | (n_case == obs_ct)
+    fit = ~const & ~no_outcome_var
+
+    beta = np.full(n_var, np.nan)
+    se = np.full(n_var, np.nan)
+    firth = np.zeros(n_var, dtype=bool)
+    failed = np.zeros(n_var, dtype=bool)
+
+    idx = np.flatnonzero(fit)
+    if len(idx):
+        b, s, ok = fit_logistic_batch(g[idx], _rows(y0, idx), mask[idx])
+        retry = _needs_firth(g[idx], _rows(y0, idx), mask[idx], ok, b)
+        if retry.any():
+            ridx = idx[retry]
+            fb, fs, fok = fit_logistic_batch(g[ridx], _rows(y0, ridx), mask[ridx], firth=True)
+            b[retry], s[retry] = fb, fs
+            ok[retry] = fok
+            firth[ridx] = True
+        beta[idx], se[idx] = b[:, 1], s
+        failed[idx] = ~ok
+
+    beta[failed] = np.nan
+    se[failed] = np.nan
+    z = beta / se
+    errcode = np.full(n_var, '.', dtype=object)
+    errcode[const] = 'CONST_OMITTED_ALLELE'
+    errcode[~const & no_outcome_var] = 'CONST_PHENO'
+    errcode[failed & firth] = 'FIRTH_CONVERGE_FAIL'
+    errcode[failed & ~firth] = 'LOGISTIC_CONVERGE_FAIL'
+    return {
+        'A1_FREQ': a1_freq,
+        'FIRTH?': np.where(firth, 'Y', 'N'),
+        'OBS_CT': obs_ct,
+        'OR': np.exp(beta),
+        'LOG(OR)_SE': se,
+        'Z_STAT': z,
+        'P': 2 * norm.sf(np.abs(z)),
+        'ERRCODE': errcode,
+    }
+
+
+def run_glm(bfile, pheno_path, out_prefix, pheno_name='PHENO', block_size=10_000, jobs=4):
+    """
+    Логистический GWAS по .bed без plink2: блоки вариантов считаются
+    параллельно (NumPy отпускает GIL), результат пишется в
+    <out_prefix>.<pheno_name>.glm.logistic.hybrid с колонками plink2.
+    A1 — первый аллель .bim (ALT при импорте .bed в plink2), OMITTED — второй.
+    """
+    start = time.time()
+    reader = BedReader(bfile)
+    y = read_binary_phenotype(reader.fam, pheno_path, pheno_name)
+    n_obs = int((~np.isnan(y)).sum())
+    print(f'GLM: {reader.n_variants} вариантов, {n_obs} образцов с фенотипом, '
+          f'блоки по {block_size}, потоков {jobs}')
+
+    def run_block(item):
+        variants, genotypes = item
+        return variants, association_block(genotypes, y)
+
+    # Окно из 2 x jobs заданий: в памяти одновременно не больше 2 x jobs декодированных
+    # блоков; следующий блок читается по мере получения результатов (порядок сохраняется)
+    parts = []
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        for item in reader.iter_blocks(block_size):
+            if len(pending) >= 2 * jobs:
+                parts.append(pending.popleft().result())
+            pending.append(pool.submit(run_block, item))
+        while pending:
+            parts.append(pending.popleft().result())
+
+    stats = {col: np.concatenate([part[col] for _, part in parts]) for col in parts[0][1]}
+    bim = reader.bim
+    result = pd.DataFrame({
+        '#CHROM': bim['CHR'], 'POS': bim['BP'], 'ID': bim['SNP'],
+        'REF': bim['A2'], 'ALT': bim['A1'], 'PROVISIONAL_REF?': 'Y',
+        'A1': bim['A1'], 'OMITTED': bim['A2'], 'TEST': 'ADD',
+        **stats,
+    })[GLM_COLUMNS]
+
+    out_file = f'{out_prefix}.{pheno_name}.glm.logistic.hybrid'
+    tmp_path = out_file + '.tmp'
+    result.to_csv(tmp_path, sep='\t', index=False, na_rep='NA', float_format='%.6g')
+    os.replace(tmp_path, out_file)
+    print(f'Результаты: {out_file} ({time.time() - start:.1f} с, '
+          f"Firth: {(result['FIRTH?'] == 'Y').sum()})")
+    return out_file
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Логистический GWAS по .bed (альтернатива plink2 --glm)')
+    parser.add_argument('--bfile', required=True, help='Префикс .bed/.bim/.fam')
+    parser.add_argument('--pheno', required=True, help='Файл фенотипов (FID IID PHENO)')
+    parser.add_argument('--pheno-name', default='PHENO')
+    parser.add_argument('--out', required=True, help='Префикс результатов')
+    parser.add_argument('--block-size', type=int, default=10_000)
+    parser.add_argument('--jobs', type=int, default=4)
+    args = parser.parse_args()
+    run_glm(args.bfile, args.pheno, args.out, args.pheno_name, args.block_size, args.jobs)
@@ -0,0 +1,360 @@
+import argparse
+import gzip
+import os
+import re
+import struct
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from gwas_cache import DEFAULT_GWAS_FILE, find_column, load_gwas
+from snp_annotation import ANNOTATION_COLUMNS, EMPTY_VALUE
+from snp_index import normalize_chrom
+from variant_matching import variant_positions
+
+# Окно линейного индекса tabix: 16 кб
+LINEAR_SHIFT = 14
+# Варианты ближе окна индекса читаются одним проходом; дальше — переход по индексу
+CLUSTER_GAP = 1 << LINEAR_SHIFT
+
+# Флаги функционального класса dbSNP VCF -> термины Sequence Ontology (как FXN_CLASS в esummary)
+FUNCTION_FLAGS = {
+    'NSF': 'frameshift_variant', 'NSM': 'missense_variant', 'NSN': 'stop_gained',
+    'SYN': 'synonymous_variant', 'U3': '3_prime_UTR_variant', 'U5': '5_prime_UTR_variant',
+    'ASS': 'splice_acceptor_variant', 'DSS': 'splice_donor_variant', 'INT': 'intron_variant',
+    'R3': 'downstream_gene_variant', 'R5': 'upstream_gene_variant',
+}
+
+# Контиги RefSeq в dbSNP VCF: NC_000001.11 -> 1, NC_000023 -> X, NC_012920 -> MT
+REFSEQ_PATTERN = re.compile(r'^NC_0000(\d\d)\.\d+$')
+REFSEQ_SPECIAL = {'23': 'X', '24': 'Y'}
+
+
+def contig_to_chrom(name):
+    match = REFSEQ_PATTERN.match(name)
+    if match:
+        number = match.group(1).lstrip('0')
+        return REFSEQ_SPECIAL.get(number, number)
+    if name.startswith('NC_012920'):
+        return 'MT'
+    return normalize_chrom([name]).iloc[0]
+
+
+class BgzfReader:
+    """
+    Произвольный доступ к bgzip-файлу: блоки BGZF (до 64 кб) распаковываются
+    по одному, начиная с виртуального смещения (смещение блока << 16 | смещение в блоке)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.handle = open(path, 'rb')
+
+    def read_block(self, coffset):
+        """
+        (распакованные данные, смещение следующего блока); b'' в конце файла
+        """
+        self.handle.seek(coffset)
+        header = self.handle.read(12)
+        if len(header) < 12:
+            return b'', coffset
+        if header[:4] != b'\x1f\x8b\x08\x04':
+            raise ValueError(f'{self.path}: не BGZF (смещение {coffset})')
+        xlen = struct.unpack('<H', header[10:12])[0]
+        extra = self.handle.read(xlen)
+        bsize = None
+        pos = 0
+        while pos < xlen:
+            si1, si2, slen = extra[pos], extra[pos + 1], struct.unpack('<H', extra[pos + 2:pos + 4])[0]
+            if si1 == 66 and si2 == 67:
+                bsize = struct.unpack('<H', extra[pos + 4:pos + 6])[0]
+            pos += 4 + slen
+        if bsize is None:
+            raise ValueError(f'{self.path}: блок без поля BSIZE (смещение {coffset})')
+        cdata = self.handle.read(bsize - xlen - 19)
+        return zlib.decompress(cdata, -15), coffset + bsize + 1
+
+    def iter_lines(self, voffset=0):
+        """
+        Строки начиная с виртуального смещения: (виртуальное смещение строки, байты строки)
+        """
+        coffset, start = voffset >> 16, voffset & 0xFFFF
+        pending, pending_voffset = None, None
+        while True:
+            data, next_offset = self.read_block(coffset)
+            if next_offset == coffset:
+                break
+            while True:
+                end = data.find(b'\n', start)
+                if end < 0:
+                    break
+                if pending is None:
+                    yield (coffset << 16) | start, data[start:end]
+                else:
+                    yield pending_voffset, pending + data[start:end]
+                    pending = None
+                start = end + 1
+            if start < len(data):
+                # Строка продолжается в следующем блоке
+                if pending is None:
+                    pending, pending_voffset = b'', (coffset << 16) | start
+                pending += data[start:]
+            coffset, start = next_offset, 0
+        if pending:
+            yield pending_voffset, pending
+
+    def close(self):
+        self.handle.close()
+
+
+def read_tabix_index(tbi_path):
+    """
+    Линейный индекс из .tbi: {контиг: массив минимальных виртуальных
+    смещений для окон по 16 кб}. Бины не нужны — файл отсортирован,
+    чтение идет от нижней границы до конца региона.
+    """
+    with gzip.open(tbi_path, 'rb') as f:
+        data = f.read()
+    if data[:4] != b'TBI\x01':
+        raise ValueError(f'{tbi_path}: не индекс tabix')
+    n_ref = struct.unpack_from('<i', data, 4)[0]
+    l_nm = struct.unpack_from('<i', data, 32)[0]
+    names = data[36:36 + l_nm].split(b'\x00')[:n_ref]
+    pos = 36 + l_nm
+    index = {}
+    for name in names:
+        n_bin = struct.unpack_from('<i', data, pos)[0]
+        pos += 4
+        for _ in range(n_bin):
+            n_chunk = struct.unpack_from('<i', data, pos + 4)[0]
+            pos += 8 + 16 * n_chunk
+        n_intv = struct.unpack_from('<i', data, pos)[0]
+        pos += 4
+        index[name.decode()] = np.frombuffer(data, dtype='<u8', count=n_intv, offset=pos)
+        pos += 8 * n_intv
+    return index
+
+
+def build_linear_index(vcf_path):
+    """
+    Линейный индекс того же вида без .tbi: один последовательный проход,
+    результат сохраняется в <vcf>.lidx.npz и переиспользуется
+    """
+    index_path = vcf_path + '.lidx.npz'
+    if os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(vcf_path):
+        with np.load(index_path) as saved:
+            return {name: saved[name] for name in saved.files}
+
+    print(f'Построение индекса {index_path} (однократно)...')
+    windows = {}
+    reader = BgzfReader(vcf_path)
+    for voffset, line in reader.iter_lines():
+        if line.startswith(b'#'):
+            continue
+        contig, pos = line.split(b'\t', 2)[:2]
+        contig_windows = windows.setdefault(contig.decode(), {})
+        contig_windows.setdefault((int(pos) - 1) >> LINEAR_SHIFT, voffset)
+    reader.close()
+
+    index = {}
+    for contig, contig_windows in windows.items():
+        offsets = np.zeros(max(contig_windows) + 1, dtype='uint64')
+        last = contig_windows[min(contig_windows)]
+        for window in range(len(offsets)):
+            # Пустые окна получают смещение предыдущего — нижняя граница сохраняется
+            last = contig_windows.get(window, last)
+            offsets[window] = last
+        index[contig] = offsets
+    np.savez(index_path, **index)
+    return index
+
+
+def load_vcf_index(vcf_path):
+    tbi_path = vcf_path + '.tbi'
+    if os.path.exists(tbi_path):
+        return read_tabix_index(tbi_path)
+    return build_linear_index(vcf_path)
+
+
+def parse_dbsnp_info(info):
+    fields = dict(item.split('=', 1) if '=' in item else (item, True) for item in info.split(';'))
+    gene = fields.get('GENEINFO')
+    freq = fields.get('FREQ')
+    functions = [term for flag, term in FUNCTION_FLAGS.items() if flag in fields]
+    return {
+        'Gene': gene.split(':', 1)[0] if isinstance(gene, str) else None,
+        'SNP Class': fields['VC'].lower() if isinstance(fields.get('VC'), str) else EMPTY_VALUE,
+        'Global MAF': freq if isinstance(freq, str) else EMPTY_VALUE,
+        'Function Class': ','.join(functions) or EMPTY_VALUE,
+    }
+
+
+class GeneIntervals:
+    """
+    Гены из BED (chrom, start, end, name) или GTF (записи gene, gene_name):
+    по хромосоме — массивы, отсортированные по началу, и префиксный
+    максимум концов для отсечения кандидатов бинарным поиском
+    """
+
+    def __init__(self, path):
+        if re.search(r'\.gtf(\.gz)?$', path):
+            gtf = pd.read_csv(path, sep='\t', comment='#', header=None, usecols=[0, 2, 3, 4, 8],
+                              names=['chrom', 'feature', 'start', 'end', 'attrs'], dtype={'chrom': str})
+            gtf = gtf[gtf['feature'] == 'gene']
+            names = gtf['attrs'].str.extract(r'gene_name "([^"]+)"')[0]
+            names = names.fillna(gtf['attrs'].str.extract(r'gene_id "([^"]+)"')[0])
+            genes = pd.DataFrame({'chrom': gtf['chrom'], 'start': gtf['start'],
+                                  'end': gtf['end'], 'name': names})
+        else:
+            bed = pd.read_csv(path, sep='\t', comment='#', header=None, usecols=[0, 1, 2, 3],
+                              names=['chrom', 'start', 'end', 'name'], dtype={'chrom': str})
+            # BED: начало с 0, полуоткрытый интервал
+            genes = bed.assign(start=bed['start'] + 1)
+        genes['chrom'] = normalize_chrom(genes['chrom']).to_numpy()
+        self.by_chrom = {}
+        for chrom, group in genes.sort_values(['chrom', 'start']).groupby('chrom'):
+            ends = group['end'].to_numpy()
+            self.by_chrom[chrom] = (group['start'].to_numpy(), ends,
+                                    np.maximum.accumulate(ends), group['name'].to_numpy(dtype=object))
+
+    def overlapping(self, chrom, positions):
+        """
+        Имена генов, перекрывающих каждую позицию ('GENE1,GENE2' или None)
+        """
+        result = np.full(len(positions), None, dtype=object)
+        if chrom not in self.by_chrom:
+            return result
+        starts, ends, max_ends, names = self.by_chrom[chrom]
+        lo = np.searchsorted(max_ends, positions, side='left')
+        hi = np.searchsorted(starts, positions, side='right')
+        for i in np.flatnonzero(hi > lo):
+            pos = positions[i]
+            hits = names[lo[i]:hi[i]][ends[lo[i]:hi[i]] >= pos]
+            if len(hits):
+                result[i] = ','.join(dict.fromkeys(hits))
+        return result
+
+
+def _clusters(positions, gap=CLUSTER_GAP):
+    """
+    Разбиение отсортированных позиций на группы, читаемые одним проходом
+    """
+    breaks = np.flatnonzero(np.diff(positions) > gap) + 1
+    return np.split(np.arange(len(positions)), breaks)
+
+
+def _pick_record(records, query_id, ref, alt):
+    """
+    Запись dbSNP для варианта: совпадение rsID, затем аллелей, затем первая на позиции
+    """
+    for rec in records:
+        if rec[0] == query_id:
+            return rec
+    if isinstance(ref, str) and isinstance(alt, str):
+        for rec in records:
+            alleles = {rec[1]} | set(rec[2].split(','))
+            if ref in alleles and alt in alleles:
+                return rec
+    return records[0]
+
+
+def annotate_variants(variants, vcf_path, gene_path=None, cluster_gap=CLUSTER_GAP):
+    """
+    Аннотация вариантов (колонки ID, CHROM, POS, REF?, ALT?) по локальному
+    dbSNP VCF: по каждой хромосоме позиции сортируются, близкие объединяются
+    в регионы, и каждый регион читается от смещения из линейного индекса
+    слиянием с отсортированными позициями. Gene без GENEINFO берется из
+    пересечения с генами BED/GTF. Результат — колонки snp_annotation.csv.
+    """
+    index = load_vcf_index(vcf_path)
+    contigs = {contig_to_chrom(name): name for name in index}
+    genes = GeneIntervals(gene_path) if gene_path else None
+
+    variants = variants.reset_index(drop=True)
+    chroms, positions = variant_positions(variants['ID'], variants.get('CHROM'), variants.get('POS'))
+    refs = variants['REF'].to_numpy(dtype=object) if 'REF' in variants else [None] * len(variants)
+    alts = variants['ALT'].to_numpy(dtype=object) if 'ALT' in variants else [None] * len(variants)
+    ids = variants['ID'].astype(str).to_numpy()
+
+    out = pd.DataFrame({'ID': ids, 'rsID': None, 'Chr': chroms.to_numpy(),
+                        'Position': None, 'Gene': None, 'SNP Class': None,
+                        'Global MAF': None, 'Alleles': None, 'Function Class': None})
+    out.loc[positions > 0, 'Position'] = (chroms[positions > 0] + ':'
+                                          + pd.Series(positions[positions > 0]).astype(str).to_numpy())
+
+    reader = BgzfReader(vcf_path)
+    found = 0
+    for chrom, rows in pd.Series(np.arange(len(ids))).groupby(chroms.to_numpy()):
+        rows = rows.to_numpy()
+        rows = rows[positions[rows] > 0]
+        if not len(rows):
+            continue
+        rows = rows[np.argsort(positions[rows], kind='stable')]
+        chrom_pos = positions[rows]
+        if genes is not None:
+            out.loc[rows, 'Gene'] = genes.overlapping(chrom, chrom_pos)
+        contig = contigs.get(chrom)
+        if contig is None:
+            continue
+        offsets = index[contig]
+        wanted = {}
+        for i, pos in zip(rows, chrom_pos):
+            wanted.setdefault(int(pos), []).append(i)
+
+        for cluster in _clusters(chrom_pos, cluster_gap):
+            start, end = int(chrom_pos[cluster[0]]), int(chrom_pos[cluster[-1]])
+            window = min((start - 1) >> LINEAR_SHIFT, len(offsets) - 1)
+            at_position = {}
+            for _, line in reader.iter_lines(int(offsets[window])):
+                fields = line.split(b'\t', 8)
+                if fields[0].decode() != contig:
+                    break
+                pos = int(fields[1])
+                if pos > end:
+                    break
+                if pos < start or pos not in wanted:
+                    continue
+                at_position.setdefault(pos, []).append(
+                    (fields[2].decode(), fields[3].decode(), fields[4].decode(), fields[7].decode()))
+            for pos, records in at_position.items():
+                for i in wanted[pos]:
+                    rs, ref, alt, info = _pick_record(records, ids[i], refs[i], alts[i])
+                    annotation = parse_dbsnp_info(info)
+                    if annotation['Gene'] is None:
+                        annotation['Gene'] = out.at[i, 'Gene'] or EMPTY_VALUE
+                    out.loc[i, ['rsID', 'Alleles']] = [rs, f'{ref}/{alt}']
+                    for column in ('Gene', 'SNP Class', 'Global MAF', 'Function Class'):
+                        out.at[i, column] = annotation[column]
+                    found += 1
+    reader.close()
+    print(f'Аннотировано по dbSNP: {found} из {len(ids)} вариантов')
+    return out[['ID'] + ANNOTATION_COLUMNS]
+
+
+def load_gwas_variants(gwas_file=DEFAULT_GWAS_FILE):
+    """
+    ID, хромосома, позиция и аллели всех вариантов GWAS (.assoc или .glm)
+    """
+    df = load_gwas(gwas_file)
+    roles = {'ID': 'id', 'CHROM': 'chrom', 'POS': 'pos', 'REF': 'ref', 'ALT': 'alt'}
+    variants = pd.DataFrame()
+    for name, role in roles.items():
+        column = find_column(df.columns, role)
+        if column is not None:
+            variants[name] = df[column].astype(object) if name in ('REF', 'ALT', 'CHROM') else df[column]
+    return variants
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Аннотация вариантов GWAS по локальному dbSNP VCF без сети')
+    parser.add_argument('--vcf', required=True, help='dbSNP VCF, сжатый bgzip (с .tbi или без)')
+    parser.add_argument('--genes', default=None, help='Гены в BED или GTF')
+    parser.add_argument('--gwas', default=DEFAULT_GWAS_FILE, help='Результаты GWAS (.assoc / .glm)')
+    parser.add_argument('--output', default='gwas_annotation.csv')
+    parser.add_argument('--cluster-gap', type=int, default=CLUSTER_GAP)
+    args = parser.parse_args()
+
+    result = annotate_variants(load_gwas_variants(args.gwas), args.vcf, args.genes, args.cluster_gap)
+    result.to_csv(args.output, index=False)
+    print(f'Сохранено: {args.output}')
@@ -0,0 +1,267 @@
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+
+from gwas_cache import find_column
+from logistic_gwas import association_block, read_binary_phenotype
+from plink_bed import BedReader
+
+DEFAULT_PERMUTATIONS = 10_000
+# Перестановок в одной задаче пула; перестановки задачи i определяются только (seed, i)
+CHUNK_PERMUTATIONS = 250
+# Адаптивный режим: решение об остановке — после каждого раунда из фиксированного
+# числа задач, поэтому результат не зависит от числа процессов
+ROUND_CHUNKS = 8
+ADAPTIVE_ALPHA = 0.05
+# Вариант останавливается, когда нижняя граница интервала (z = 3) для p выше alpha
+ADAPTIVE_Z = 3.0
+ADAPTIVE_MIN_PERMUTATIONS = 1000
+# Вариантов в одной задаче (выбранные варианты делятся на группы для пула)
+VARIANT_GROUP = 16
+BLOCK_SIZE = 10_000
+# Элементов (строки x образцы) в одном пакете association_block при переборе перестановок:
+# пакет остается в кэше процессора, крупные пакеты упираются в пропускную способность памяти
+BATCH_ELEMENTS = 1 << 16
+SEED = 20250601
+
+PERM_COLUMNS = ['#CHROM', 'POS', 'ID', 'A1', 'OBS_CT', 'OR', 'Z_STAT', 'P', 'EMP1', 'NP', 'EMP2']
+
+# Состояние процесса пула: генотипы и фенотип передаются один раз при запуске процесса
+_STATE = {}
+
+
+def _init_worker(bfile, rows, y, seed):
+    reader = BedReader(bfile)
+    _STATE.update(reader=reader, y=y, seed=seed, observed=np.flatnonzero(~np.isnan(y)),
+                  genotypes=reader.read(rows) if rows is not None else None)
+
+
+def permuted_phenotypes(chunk, n_perm):
+    """
+    Фенотипы n_perm перестановок задачи chunk (перемешиваются только
+    образцы с известным фенотипом; пропуски остаются на месте)
+    """
+    y = _STATE['y']
+    observed = _STATE['observed']
+    rng = np.random.default_rng(np.random.SeedSequence(_STATE['seed'], spawn_key=(chunk,)))
+    values = rng.permuted(np.tile(y[observed], (n_perm, 1)), axis=1)
+    perms = np.tile(y, (n_perm, 1))
+    perms[:, observed] = values
+    return perms
+
+
+def permutation_z(genotypes, perms):
+    """
+    |Z| всех пар (вариант, перестановка): матрица варианты x перестановки.
+    Пары складываются в один пакет association_block (строка — вариант с
+    фенотипом одной перестановки); пакет делится по BATCH_ELEMENTS, чтобы
+    память не росла с числом перестановок. NaN (вариант не оценивается) -> 0.
+    """
+    n_perm, n_samples = perms.shape
+    z = np.zeros((len(genotypes), n_perm))
+    step = max(1, BATCH_ELEMENTS // (n_perm * n_samples))
+    for start in range(0, len(genotypes), step):
+        block = genotypes[start:start + step]
+        stats = association_block(np.repeat(block, n_perm, axis=0), np.tile(perms, (len(block), 1)))
+        z[start:start + len(block)] = np.abs(stats['Z_STAT']).reshape(len(block), n_perm)
+    return np.nan_to_num(z, nan=0.0)
+
+
+def _selected_chunk(chunk, n_perm, variants, observed_z):
+    """
+    Перестановки одной задачи для группы выбранных вариантов: все пары
+    (вариант, перестановка) считаются пакетно, счетчики — по каждому варианту
+    """
+    z = permutation_z(_STATE['genotypes'][variants], permuted_phenotypes(chunk, n_perm))
+    hits = (z >= np.asarray(observed_z)[:, None]).sum(1)
+    return chunk, variants, hits, z.max(0)
+
+
+def _max_t_chunk(chunk, n_perm, block_size):
+    """
+    Максимум |Z| по всем вариантам генома для каждой перестановки задачи
+    (блок генотипов распаковывается один раз на задачу и считается сразу для всех перестановок)
+    """
+    perms = permuted_phenotypes(chunk, n_perm)
+    max_z = np.zeros(n_perm)
+    for _, genotypes in _STATE['reader'].iter_blocks(block_size):
+        np.maximum(max_z, permutation_z(genotypes, perms).max(0), out=max_z)
+    return chunk, max_z
+
+
+def read_variant_list(path):
+    """
+    ID вариантов из CSV с колонкой ID/SNP (выборки риск-SNP из ноутбука)
+    или из текстового файла по одному ID в строке
+    """
+    table = pd.read_csv(path, sep=None, engine='python', dtype=str)
+    column = find_column(table.columns, 'id')
+    if column is None:
+        return pd.read_csv(path, header=None, dtype=str)[0].str.strip().tolist()
+    return table[column].dropna().str.strip().tolist()
+
+
+def adaptive_stop(hits, n_done, alpha=ADAPTIVE_ALPHA, z=ADAPTIVE_Z, min_perm=ADAPTIVE_MIN_PERMUTATIONS):
+    """
+    Варианты, явно не значимые на уровне alpha: нижняя граница p выше alpha
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = (hits + 1) / (n_done + 1)
+        lower = p - z * np.sqrt(p * (1 - p) / n_done)
+    return (n_done >= min_perm) & (lower > alpha)
+
+
+def _executor(jobs, initargs):
+    return ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=_init_worker, initargs=initargs)
+
+
+def permutation_test(bfile, pheno_path, out_prefix, variants=None, pheno_name='PHENO',
+                     n_perm=DEFAULT_PERMUTATIONS, adaptive=True, alpha=ADAPTIVE_ALPHA, seed=SEED,
+                     jobs=4, chunk_size=CHUNK_PERMUTATIONS, max_t=False, block_size=BLOCK_SIZE):
+    """
+    Эмпирические p-value перестановками фенотипа (статистика — |Z| логистической
+    регрессии, как в logistic_gwas: Фирт при разделении).
+    variants — ID выбранных вариантов: EMP1 по каждому (с адаптивной остановкой
+    явно не значимых) и EMP2 — поправка max-T внутри выборки (без адаптивного режима).
+    max_t=True — max-T по всему геному: EMP2 для всех вариантов.
+    Перестановки разбиты на задачи по chunk_size с собственным потоком
+    случайных чисел (SeedSequence(seed, i)) — результат воспроизводим при
+    любом числе процессов. Пишет <out>.<pheno>.perm.tsv и <out>.perm_summary.json.
+    """
+    start = time.time()
+    reader = BedReader(bfile)
+    y = read_binary_phenotype(reader.fam, pheno_path, pheno_name)
+    n_chunks = -(-n_perm // chunk_size)
+    n_perm = n_chunks * chunk_size
+
+    if max_t:
+        rows = np.arange(reader.n_variants)
+    else:
+        present = reader.bim['SNP'].isin(variants).to_numpy()
+        missing = sorted(set(variants) - set(reader.bim['SNP'][present]))
+        if missing:
+            print(f"⚠️ Вариантов нет в .bim: {len(missing)} (например, {missing[:5]})")
+        rows = np.flatnonzero(present)
+    if not len(rows):
+        raise ValueError('Нет вариантов для перестановочного теста')
+
+    # Наблюдаемые статистики
+    parts = [association_block(g, y) for _, g in reader.iter_blocks(block_size, variants=rows)]
+    stats = {col: np.concatenate([p[col] for p in parts]) for col in ('OBS_CT', 'OR', 'Z_STAT', 'P')}
+    observed_z = np.abs(stats['Z_STAT'])
+    testable = np.isfinite(observed_z)
+    print(f"Перестановочный тест: {len(rows)} вариантов, до {n_perm} перестановок "
+          f"({n_chunks} задач по {chunk_size}), процессов {jobs}, seed {seed}"
+          + (', max-T по геному' if max_t else ', адаптивный режим' if adaptive else ''))
+
+    hits = np.zeros(len(rows), dtype='int64')
+    n_done = np.zeros(len(rows), dtype='int64')
+    max_z = np.full(n_perm, np.nan)
+    initargs = (bfile, None if max_t else rows, y, seed)
+    with _executor(jobs, initargs) as pool:
+        if max_t:
+            for chunk, chunk_max in pool.map(_max_t_chunk, range(n_chunks), [chunk_size] * n_chunks,
+                                             [block_size] * n_chunks):
+                max_z[chunk * chunk_size:(chunk + 1) * chunk_size] = chunk_max
+            n_done[:] = n_perm
+        else:
+            active = np.flatnonzero(testable)
+            round_chunks = ROUND_CHUNKS if adaptive else n_chunks
+            for first in range(0, n_chunks, round_chunks):
+                if not len(active):
+                    break
+                chunks = range(first, min(first + round_chunks, n_chunks))
+                groups = [active[i:i + VARIANT_GROUP] for i in range(0, len(active), VARIANT_GROUP)]
+                tasks = [(c, g) for c in chunks for g in groups]
+                results = pool.map(_selected_chunk, [c for c, _ in tasks], [chunk_size] * len(tasks),
+                                   [g for _, g in tasks], [observed_z[g] for _, g in tasks])
+                for chunk, group, group_hits, group_max in results:
+                    hits[group] += group_hits
+                    n_done[group] += chunk_size
+                    block = slice(chunk * chunk_size, (chunk + 1) * chunk_size)
+                    max_z[block] = np.fmax(max_z[block], group_max)
+                if adaptive:
+                    stopped = adaptive_stop(hits[active], n_done[active], alpha)
+                    active = active[~stopped]
+                    print(f"   {chunks[-1] + 1}/{n_chunks} задач: продолжают {len(active)} вариантов")
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        emp1 = np.where(testable & (n_done > 0), (hits + 1) / (n_done + 1), np.nan)
+    # max-T корректен, только если каждый вариант прошел все перестановки
+    complete = max_t or not adaptive
+    if complete:
+        maxima = np.sort(max_z)
+        exceed = len(maxima) - np.searchsorted(maxima, observed_z, side='left')
+        emp2 = np.where(testable, (exceed + 1) / (len(maxima) + 1), np.nan)
+    else:
+        emp2 = np.full(len(rows), np.nan)
+
+    bim = reader.bim.iloc[rows]
+    result = pd.DataFrame({
+        '#CHROM': bim['CHR'].to_numpy(), 'POS': bim['BP'].to_numpy(), 'ID': bim['SNP'].to_numpy(),
+        'A1': bim['A1'].to_numpy(), **stats, 'EMP1': emp1 if not max_t else np.nan,
+        'NP': n_done, 'EMP2': emp2,
+    })[PERM_COLUMNS]
+    out_file = f'{out_prefix}.{pheno_name}.perm.tsv'
+    tmp_path = out_file + '.tmp'
+    result.to_csv(tmp_path, sep='\t', index=False, na_rep='NA', float_format='%.6g')
+    os.replace(tmp_path, out_file)
+
+    summary = {
+        'analysis_date': datetime.now().isoformat(),
+        'bfile': bfile, 'pheno': pheno_path, 'pheno_name': pheno_name,
+        'mode': 'max_t' if max_t else 'adaptive' if adaptive else 'fixed',
+        'seed': seed, 'permutations': n_perm, 'chunk_permutations': chunk_size,
+        'adaptive': {'alpha': alpha, 'z': ADAPTIVE_Z, 'min_permutations': ADAPTIVE_MIN_PERMUTATIONS,
+                     'round_chunks': ROUND_CHUNKS} if adaptive and not max_t else None,
+        'n_variants': int(len(rows)),
+        'n_testable': int(testable.sum()),
+        'permutations_run': int(n_done.sum()),
+        'seconds': round(time.time() - start, 1),
+        'results_file': out_file,
+    }
+    if complete:
+        # Порог |Z| (и p) для FWER 5% по распределению максимумов
+        z_threshold = float(np.quantile(max_z, 0.95))
+        summary['fwer_0.05'] = {'abs_z': z_threshold, 'p': float(2 * norm.sf(z_threshold))}
+    with open(out_prefix + '.perm_summary.json', 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2, default=str)
+
+    print(f"Результаты: {out_file} ({summary['seconds']} с, перестановок всего: {summary['permutations_run']})")
+    if 'fwer_0.05' in summary:
+        print(f"   Порог FWER 5%: |Z| >= {summary['fwer_0.05']['abs_z']:.3f} (p < {summary['fwer_0.05']['p']:.3g})")
+    significant = result[result['EMP1'] < alpha] if not max_t else result[result['EMP2'] < 0.05]
+    print(f"   Значимых по перестановкам: {len(significant)} из {summary['n_testable']}")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Эмпирические p-value перестановками фенотипа')
+    parser.add_argument('--bfile', required=True, help='Префикс .bed/.bim/.fam')
+    parser.add_argument('--pheno', required=True, help='Файл фенотипов (FID IID PHENO)')
+    parser.add_argument('--pheno-name', default='PHENO')
+    parser.add_argument('--out', required=True, help='Префикс результатов')
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--extract', help='Выбранные варианты: CSV с колонкой ID/SNP или список ID')
+    target.add_argument('--max-t', action='store_true', help='max-T по всему геному')
+    parser.add_argument('--perm', type=int, default=DEFAULT_PERMUTATIONS, help='Число перестановок (максимум)')
+    parser.add_argument('--no-adaptive', action='store_true',
+                        help='Все перестановки для всех вариантов (дает EMP2 внутри выборки)')
+    parser.add_argument('--alpha', type=float, default=ADAPTIVE_ALPHA)
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--jobs', type=int, default=4)
+    parser.add_argument('--chunk', type=int, default=CHUNK_PERMUTATIONS, help='Перестановок в задаче')
+    args = parser.parse_args()
+    permutation_test(args.bfile, args.pheno, args.out,
+                     read_variant_list(args.extract) if args.extract else None, args.pheno_name,
+                     args.perm, not args.no_adaptive, args.alpha, args.seed, args.jobs, args.chunk,
+                     max_t=args.max_t)
@@ -0,0 +1,167 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# Первые три байта .bed: магическое число и режим SNP-major
+BED_MAGIC = bytes([0x6c, 0x1b, 0x01])
+
+# Пропущенный генотип (как -9 в .fam)
+MISSING_GENOTYPE = -9
+
+BIM_COLUMNS = ['CHR', 'SNP', 'CM', 'BP', 'A1', 'A2']
+FAM_COLUMNS = ['FID', 'IID', 'PAT', 'MAT', 'SEX', 'PHENO']
+
+# Коды PLINK: 00 — гомозигота A1, 01 — пропуск, 10 — гетерозигота, 11 — гомозигота A2.
+# Значение генотипа — число аллелей A1 (0, 1, 2)
+_CODE_TO_DOSAGE = np.array([2, MISSING_GENOTYPE, 1, 0], dtype='int8')
+
+# Таблица распаковки: байт -> 4 генотипа (младшие биты — первый образец)
+_BYTE_LUT = _CODE_TO_DOSAGE[(np.arange(256)[:, None] >> (2 * np.arange(4))) & 3]
+
+
+def read_bim(path):
+    return pd.read_csv(path, sep=r'\s+', header=None, names=BIM_COLUMNS,
+                       dtype={'CHR': str, 'SNP': str, 'A1': str, 'A2': str})
+
+
+def read_fam(path):
+    return pd.read_csv(path, sep=r'\s+', header=None, names=FAM_COLUMNS,
+                       dtype={'FID': str, 'IID': str})
+
+
+class BedReader:
+    """
+    Чтение генотипов PLINK .bed (SNP-major, 2 бита на генотип) через
+    отображение файла в память: декодируются только запрошенные варианты
+    и образцы, весь файл в память не загружается.
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.fam = read_fam(prefix + '.fam')
+        self.n_samples = len(self.fam)
+        self.bytes_per_variant = (self.n_samples + 3) // 4
+
+        bed_path = prefix + '.bed'
+        with open(bed_path, 'rb') as f:
+            magic = f.read(3)
+        if magic != BED_MAGIC:
+            raise ValueError(f'{bed_path}: не .bed в режиме SNP-major (заголовок {magic.hex()})')
+        data_size = os.path.getsize(bed_path) - 3
+        if data_size % self.bytes_per_variant:
+            raise ValueError(f'{bed_path}: размер не кратен {self.bytes_per_variant} байтам на вариант')
+        n_variants = data_size // self.bytes_per_variant
+
+        if os.path.exists(prefix + '.bim'):
+            self.bim = read_bim(prefix + '.bim')
+            if len(self.bim) != n_variants:
+                raise ValueError(f'{prefix}: в .bim {len(self.bim)} вариантов, в .bed {n_variants}')
+        else:
+            # Без .bim доступ возможен только по номеру варианта
+            print(f'⚠️ {prefix}.bim не найден: варианты доступны только по номеру')
+            self.bim = pd.DataFrame(index=pd.RangeIndex(n_variants), columns=BIM_COLUMNS)
+        self.n_variants = n_variants
+
+        self._bed = np.memmap(bed_path, dtype='uint8', mode='r', offset=3,
+                              shape=(n_variants, self.bytes_per_variant))
+        self._variant_lookup = None
+        self._sample_lookup = None
+
+    def variant_indices(self, ids):
+        """
+        Номера вариантов по ID из .bim (KeyError для отсутствующих)
+        """
+        if self._variant_lookup is None:
+            self._variant_lookup = pd.Index(self.bim['SNP'])
+        idx = self._variant_lookup.get_indexer(pd.Index(ids))
+        if (idx < 0).any():
+            missing = [i for i, k in zip(ids, idx) if k < 0]
+            raise KeyError(f'Варианты отсутствуют в .bim: {missing[:10]}')
+        return idx
+
+    def sample_indices(self, iids):
+        """
+        Номера образцов по IID из .fam
+        """
+        if self._sample_lookup is None:
+            self._sample_lookup = pd.Index(self.fam['IID'])
+        idx = self._sample_lookup.get_indexer(pd.Index(iids))
+        if (idx < 0).any():
+            missing = [i for i, k in zip(iids, idx) if k < 0]
+            raise KeyError(f'Образцы отсутствуют в .fam: {missing[:10]}')
+        return idx
+
+    def read(self, variants=None, samples=None):
+        """
+        Генотипы выбранных вариантов x образцов: int8, число аллелей A1,
+        MISSING_GENOTYPE для пропусков. variants / samples — номера
+        (или срез); None — все.
+        """
+        packed = self._bed[variants] if variants is not None else self._bed
+        packed = np.atleast_2d(np.asarray(packed))
+        if samples is None:
+            return decode_block(packed, self.n_samples)
+        samples = np.arange(self.n_samples)[samples]
+        codes = (packed[:, samples >> 2] >> ((samples & 3) * 2).astype('uint8')) & 3
+        return _CODE_TO_DOSAGE[codes]
+
+    def read_by_id(self, snp_ids, iids=None):
+        """
+        Генотипы по ID вариантов и IID образцов
+        """
+        samples = self.sample_indices(iids) if iids is not None else None
+        return self.read(self.variant_indices(snp_ids), samples)
+
+    def iter_blocks(self, block_size=10_000, samples=None, variants=None):
+        """
+        Последовательное декодирование блоками вариантов:
+        выдает (номера вариантов блока, генотипы блока)
+        """
+        variants = np.arange(self.n_variants) if variants is None else np.asarray(variants)
+        for start in range(0, len(variants), block_size):
+            block = variants[start:start + block_size]
+            if len(block) and block[-1] - block[0] == len(block) - 1:
+                # Непрерывный диапазон — срез без копирования индексов
+                yield block, self.read(slice(block[0], block[-1] + 1), samples)
+            else:
+                yield block, self.read(block, samples)
+
+    def iter_packed(self, block_size=10_000, variants=None):
+        """
+        Блоки вариантов без распаковки: (номера вариантов, байты .bed блока).
+        Для подсчетов по битам и копирования вариантов без перекодирования.
+        """
+        variants = np.arange(self.n_variants) if variants is None else np.asarray(variants)
+        for start in range(0, len(variants), block_size):
+            block = variants[start:start + block_size]
+            if len(block) and block[-1] - block[0] == len(block) - 1:
+                yield block, np.asarray(self._bed[block[0]:block[-1] + 1])
+            else:
+                yield block, np.asarray(self._bed[block])
+
+
+def decode_block(packed, n_samples):
+    """
+    Векторная распаковка блока .bed (варианты x байты) в int8 генотипы
+    """
+    return _BYTE_LUT[packed].reshape(packed.shape[0], -1)[:, :n_samples]
+
+
+def encode_block(genotypes):
+    """
+    Обратное преобразование: int8 генотипы (варианты x образцы) в байты .bed
+    """
+    genotypes = np.asarray(genotypes)
+    codes = np.full(genotypes.shape, 1, dtype='uint8')
+    for dosage, code in ((0, 3), (1, 2), (2, 0)):
+        codes[genotypes == dosage] = code
+    pad = (-genotypes.shape[1]) % 4
+    if pad:
+        codes = np.pad(codes, ((0, 0), (0, pad)), constant_values=0)
+    codes = codes.reshape(len(codes), -1, 4)
+    return codes[:, :, 0] | (codes[:, :, 1] << 2) | (codes[:, :, 2] << 4) | (codes[:, :, 3] << 6)
+
+
+def open_bed(prefix):
+    return BedReader(prefix)
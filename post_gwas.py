@@ -0,0 +1,227 @@
+import argparse
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from scipy.stats import chi2
+
+from gwas_cache import (COLUMN_ROLES, DEFAULT_GWAS_FILE, ensure_cache, find_column, load_cache,
+                        read_cache_meta)
+from variant_matching import variant_positions
+
+# Пороги как у plink --clump по умолчанию
+CLUMP_P1 = 1e-4
+CLUMP_P2 = 1e-2
+CLUMP_KB = 250
+CLUMP_R2 = 0.5
+FDR_LEVELS = (0.05, 0.1)
+
+LOCI_FILE = 'gwas_loci.csv'
+SUMMARY_FILE = 'post_gwas_summary.json'
+
+# Медиана chi2 с 1 степенью свободы
+CHI2_MEDIAN = chi2.ppf(0.5, 1)
+_CHROM_SHIFT = np.int64(1 << 32)
+
+
+def genomic_control_lambda(p_values):
+    """
+    Коэффициент геномной инфляции: медиана chi2 (из p-value) / 0.4549
+    """
+    p = np.asarray(p_values, dtype='float64')
+    p = p[np.isfinite(p) & (p > 0) & (p <= 1)]
+    if not len(p):
+        return None
+    # Медиана chi2 — это chi2 от медианы p (isf монотонна), без пересчета всех значений
+    return float(chi2.isf(np.median(p), 1) / CHI2_MEDIAN)
+
+
+def bh_qvalues(p_values):
+    """
+    q-values Бенджамини–Хохберга: одна сортировка и накопленный минимум с конца.
+    Пропуски остаются NaN и не входят в число тестов.
+    """
+    p = np.asarray(p_values, dtype='float64')
+    q = np.full(len(p), np.nan)
+    valid = np.flatnonzero(np.isfinite(p))
+    if not len(valid):
+        return q
+    order = valid[np.argsort(p[valid], kind='stable')]
+    ranked = p[order] * len(order) / np.arange(1, len(order) + 1)
+    q[order] = np.minimum(np.minimum.accumulate(ranked[::-1])[::-1], 1.0)
+    return q
+
+
+class GenotypeLD:
+    """
+    r² между вариантами по генотипам .bed (plink_bed), пропуски заменяются средним
+    """
+
+    def __init__(self, bfile):
+        from plink_bed import MISSING_GENOTYPE, BedReader
+        self.reader = BedReader(bfile)
+        self.missing = MISSING_GENOTYPE
+        self.lookup = pd.Index(self.reader.bim['SNP'])
+
+    def r2(self, index_id, other_ids):
+        """
+        r² варианта index_id с каждым из other_ids (NaN — нет в .bim)
+        """
+        rows = self.lookup.get_indexer(pd.Index([index_id, *other_ids]))
+        result = np.full(len(other_ids), np.nan)
+        if rows[0] < 0:
+            return result
+        present = np.flatnonzero(rows[1:] >= 0)
+        g = self.reader.read(rows[np.r_[0, present + 1]]).astype('float64')
+        g[g == self.missing] = np.nan
+        g = g - np.nanmean(g, axis=1, keepdims=True)
+        g = np.nan_to_num(g)
+        norms = np.sqrt((g * g).sum(1))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r = (g[1:] @ g[0]) / (norms[1:] * norms[0])
+        result[present] = r * r
+        return result
+
+
+def clump(chroms, positions, p_values, ids=None, p1=CLUMP_P1, p2=CLUMP_P2, kb=CLUMP_KB,
+          r2=None, ld=None):
+    """
+    Жадная кластеризация в независимые локусы (как plink --clump):
+    варианты с p < p1 в порядке возрастания p становятся ведущими и
+    забирают еще не занятые варианты с p < p2 в окне ±kb. Варианты
+    сортируются один раз по (хромосома, позиция); окно находится
+    бинарным поиском, а не перебором пар. С ld (GenotypeLD) и r2
+    вариант присоединяется, только если r² с ведущим >= r2.
+    Возвращает owner: номер ведущего варианта для каждой строки (-1 — вне локусов).
+    """
+    p = np.asarray(p_values, dtype='float64')
+    pos = np.asarray(positions, dtype='int64')
+    owner = np.full(len(p), -1, dtype='int64')
+
+    eligible = np.flatnonzero(np.isfinite(p) & (p < p2) & (pos > 0))
+    if not len(eligible):
+        return owner
+    codes = pd.factorize(pd.Series(chroms).iloc[eligible].astype(str))[0].astype('int64')
+    keys = codes * _CHROM_SHIFT + pos[eligible]
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    sorted_rows = eligible[order]
+    sorted_owner = np.full(len(order), -1, dtype='int64')
+    window = int(kb * 1000)
+
+    index_candidates = np.flatnonzero(p[sorted_rows] < p1)
+    for i in index_candidates[np.argsort(p[sorted_rows[index_candidates]], kind='stable')]:
+        if sorted_owner[i] >= 0:
+            continue
+        lo = np.searchsorted(sorted_keys, sorted_keys[i] - window, side='left')
+        hi = np.searchsorted(sorted_keys, sorted_keys[i] + window, side='right')
+        free = lo + np.flatnonzero(sorted_owner[lo:hi] < 0)
+        if ld is not None and r2 is not None:
+            others = free[free != i]
+            linked = ld.r2(ids[sorted_rows[i]], [ids[k] for k in sorted_rows[others]]) >= r2
+            free = np.r_[i, others[linked]]
+        sorted_owner[free] = sorted_rows[i]
+
+    owner[sorted_rows] = sorted_owner
+    return owner
+
+
+def loci_table(df, owner, q):
+    """
+    Таблица локусов: ведущий SNP, границы, число SNP и их список
+    """
+    assigned = np.flatnonzero(owner >= 0)
+    if not len(assigned):
+        return pd.DataFrame(columns=['LOCUS', 'CHR', 'LEAD_SNP', 'BP', 'P', 'Q', 'OR',
+                                     'START', 'END', 'N_SNPS', 'SNPS'])
+    members = pd.DataFrame({'lead': owner[assigned], 'row': assigned,
+                            'pos': df['POS'].to_numpy()[assigned],
+                            'id': df['ID'].to_numpy()[assigned]})
+    grouped = members.groupby('lead', sort=False)
+    leads = grouped.size().index.to_numpy()
+    table = pd.DataFrame({
+        'CHR': df['CHR'].to_numpy()[leads],
+        'LEAD_SNP': df['ID'].to_numpy()[leads],
+        'BP': df['POS'].to_numpy()[leads],
+        'P': df['P'].to_numpy()[leads],
+        'Q': q[leads],
+        'OR': df['OR'].to_numpy()[leads] if 'OR' in df else np.nan,
+        'START': grouped['pos'].min().to_numpy(),
+        'END': grouped['pos'].max().to_numpy(),
+        'N_SNPS': grouped.size().to_numpy(),
+        'SNPS': grouped['id'].agg(lambda s: ';'.join(s.astype(str))).to_numpy(),
+    }).sort_values('P', kind='stable').reset_index(drop=True)
+    table.insert(0, 'LOCUS', np.arange(1, len(table) + 1))
+    return table
+
+
+def post_gwas_report(gwas_file=DEFAULT_GWAS_FILE, output_dir='.', df=None, p1=CLUMP_P1,
+                     p2=CLUMP_P2, kb=CLUMP_KB, bfile=None, r2=CLUMP_R2):
+    """
+    Стадия после GWAS: lambda GC, q-values (BH), локусы с ведущими SNP.
+    Пишет gwas_loci.csv и post_gwas_summary.json в output_dir.
+    bfile — префикс .bed/.bim/.fam для LD-кластеризации по r².
+    """
+    if df is None:
+        # Из кэша читаются только нужные колонки
+        cache_dir = ensure_cache(gwas_file)
+        needed = {'P', 'OR'} | {c for role in ('chrom', 'pos', 'id') for c in COLUMN_ROLES[role]}
+        names = [c['name'] for c in read_cache_meta(cache_dir)['columns']]
+        df = load_cache(cache_dir, columns=[c for c in names if c in needed])
+    columns = {name: find_column(df.columns, role)
+               for name, role in [('CHR', 'chrom'), ('POS', 'pos'), ('ID', 'id')]}
+    chroms, positions = variant_positions(df[columns['ID']], df[columns['CHR']] if columns['CHR'] else None,
+                                          df[columns['POS']] if columns['POS'] else None)
+    table = pd.DataFrame({'CHR': chroms.to_numpy(), 'POS': positions,
+                          'ID': df[columns['ID']].astype(str).to_numpy(),
+                          'P': pd.to_numeric(df['P'], errors='coerce').to_numpy()})
+    if 'OR' in df.columns:
+        table['OR'] = pd.to_numeric(df['OR'], errors='coerce').to_numpy()
+
+    lam = genomic_control_lambda(table['P'])
+    q = bh_qvalues(table['P'])
+    ld = GenotypeLD(bfile) if bfile else None
+    owner = clump(table['CHR'], table['POS'], table['P'], table['ID'].to_numpy(),
+                  p1=p1, p2=p2, kb=kb, r2=r2 if ld else None, ld=ld)
+    loci = loci_table(table, owner, q)
+
+    summary = {
+        'analysis_date': datetime.now().isoformat(),
+        'gwas_file': gwas_file,
+        'n_variants': int(len(table)),
+        'n_tested': int(np.isfinite(table['P']).sum()),
+        'genomic_control_lambda': lam,
+        'fdr': {str(level): int((q < level).sum()) for level in FDR_LEVELS},
+        'clumping': {'p1': p1, 'p2': p2, 'kb': kb, 'r2': r2 if ld else None, 'bfile': bfile},
+        'n_loci': int(len(loci)),
+        'lead_snps': loci.head(20).drop(columns='SNPS').to_dict('records'),
+    }
+
+    os.makedirs(output_dir, exist_ok=True)
+    loci_file = os.path.join(output_dir, LOCI_FILE)
+    loci.to_csv(loci_file, index=False)
+    with open(os.path.join(output_dir, SUMMARY_FILE), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2, default=str)
+
+    print(f"   Lambda GC: {lam:.4f}" if lam is not None else "   Lambda GC: нет p-values")
+    for level, count in summary['fdr'].items():
+        print(f"   q < {level}: {count}")
+    print(f"   Локусов (p1={p1}, p2={p2}, ±{kb} кб{', r² >= ' + str(r2) if ld else ''}): {len(loci)}")
+    print(f"   Таблица локусов: {loci_file}")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Lambda GC, q-values и кластеризация локусов по результатам GWAS')
+    parser.add_argument('gwas_file', nargs='?', default=DEFAULT_GWAS_FILE)
+    parser.add_argument('--output-dir', default='.')
+    parser.add_argument('--p1', type=float, default=CLUMP_P1, help='Порог для ведущих SNP')
+    parser.add_argument('--p2', type=float, default=CLUMP_P2, help='Порог для SNP в локусе')
+    parser.add_argument('--kb', type=float, default=CLUMP_KB, help='Полуширина окна, кб')
+    parser.add_argument('--bfile', default=None, help='Генотипы .bed/.bim/.fam для кластеризации по r²')
+    parser.add_argument('--r2', type=float, default=CLUMP_R2)
+    args = parser.parse_args()
+    post_gwas_report(args.gwas_file, args.output_dir, p1=args.p1, p2=args.p2, kb=args.kb,
+                     bfile=args.bfile, r2=args.r2)
@@ -0,0 +1,262 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from gwas_cache import find_column
+from plink_bed import MISSING_GENOTYPE, BedReader
+
+# Генотипов (вариантов x образцов) в одном блоке: 10^5 образцов -> ~84 варианта.
+# score_block держит int8 генотипы, bool пропусков и две float32 матрицы
+# (дозы и пропуски) — ~10 байт на генотип, т.е. ~85 МБ на поток
+BLOCK_ELEMENTS = 1 << 23
+# Колонки весов, используемые как есть (log OR / beta); иначе берется log(OR)
+WEIGHT_COLUMNS = ['WEIGHT', 'BETA', 'LOG_OR', 'LOG(OR)']
+# Комплементарные аллели для выравнивания по другой цепи
+COMPLEMENT = {'A': 'T', 'T': 'A', 'C': 'G', 'G': 'C'}
+
+
+def load_weights(path, name=None, weight_column=None):
+    """
+    Таблица весов панели: ID, A1 (аллель эффекта), WEIGHT. Подходят выходы
+    фильтров (колонки plink2 ID, A1, OR, OMITTED) и любые таблицы с ID/SNP, A1
+    и колонкой веса (WEIGHT, BETA, LOG_OR) или OR (вес = log OR).
+    """
+    table = path if isinstance(path, pd.DataFrame) else pd.read_csv(path, sep=None, engine='python')
+    id_col = find_column(table.columns, 'id')
+    if id_col is None or 'A1' not in table.columns:
+        raise ValueError(f"{name or path}: нужны колонки ID (или SNP) и A1")
+    if weight_column is None:
+        weight_column = next((c for c in WEIGHT_COLUMNS if c in table.columns), None)
+    if weight_column is not None:
+        weight = pd.to_numeric(table[weight_column], errors='coerce')
+    elif 'OR' in table.columns:
+        weight = np.log(pd.to_numeric(table['OR'], errors='coerce'))
+    else:
+        raise ValueError(f"{name or path}: нет колонки веса ({', '.join(WEIGHT_COLUMNS)}) или OR")
+    other = next((c for c in ('OMITTED', 'A2') if c in table.columns), None)
+    weights = pd.DataFrame({
+        'ID': table[id_col].astype(str).str.strip(),
+        'A1': table['A1'].astype(str).str.upper(),
+        'A2': table[other].astype(str).str.upper() if other else None,
+        'WEIGHT': weight.to_numpy(),
+    })
+    weights = weights[np.isfinite(weights['WEIGHT'])].drop_duplicates('ID', keep='first')
+    return weights.reset_index(drop=True)
+
+
+def weights_from_candidates(excel_file, gwas_file):
+    """
+    Веса для списка кандидатов из Excel: строки GWAS найденных SNP (A1, OR) через индекс
+    """
+    from snp_index import query_excel_lists
+    result = next(iter(query_excel_lists([excel_file], gwas_file).values()))
+    return load_weights(result['data'], name=excel_file)
+
+
+def align_weights(panels, bim):
+    """
+    Выравнивание аллелей панелей по .bim. Генотип .bed — число аллелей A1
+    из .bim; если аллель эффекта — A2 из .bim, вклад равен w * (2 - g), что
+    записывается как вес -w и константа 2w. Несовпадение по прямой цепи
+    проверяется по комплементарной. Неоднозначные (A/T, C/G) варианты
+    исключаются всегда: по аллелям нельзя понять, на какой они цепи.
+    ID, встречающиеся в .bim несколько раз (бывает в объединенных наборах),
+    исключаются: неизвестно, какой из вариантов имелся в виду.
+    Возвращает (номера вариантов .bim, матрица весов варианты x панели,
+    константы панелей, отчет по панелям).
+    """
+    bim_ids = bim['SNP'].astype(str)
+    duplicated = bim_ids.duplicated(keep=False).to_numpy()
+    unique_rows = np.flatnonzero(~duplicated)
+    lookup = pd.Index(bim_ids.to_numpy()[unique_rows])
+    duplicate_ids = set(bim_ids[duplicated])
+    bim_a1 = bim['A1'].astype(str).str.upper().to_numpy()
+    bim_a2 = bim['A2'].astype(str).str.upper().to_numpy()
+
+    def bim_rows(ids):
+        idx = lookup.get_indexer(ids)
+        return np.where(idx >= 0, unique_rows[idx], -1)
+
+    rows = np.unique(np.concatenate([bim_rows(w['ID']) for w in panels.values()]))
+    rows = rows[rows >= 0]
+    position = pd.Series(np.arange(len(rows)), index=rows)
+    matrix = np.zeros((len(rows), len(panels)), dtype='float64')
+    constants = np.zeros(len(panels))
+    report = {}
+
+    for k, (name, weights) in enumerate(panels.items()):
+        idx = bim_rows(weights['ID'])
+        found = idx >= 0
+        w = weights[found]
+        idx = idx[found]
+        a1, ref_a1, ref_a2 = w['A1'].to_numpy(), bim_a1[idx], bim_a2[idx]
+        complement = pd.Series(a1).map(COMPLEMENT).to_numpy()
+        ambiguous = pd.Series(ref_a1).map(COMPLEMENT).to_numpy() == ref_a2
+        same = ~ambiguous & (a1 == ref_a1)
+        flipped = ~ambiguous & (a1 == ref_a2)
+        strand_same = ~same & ~flipped & ~ambiguous & (complement == ref_a1)
+        strand_flipped = ~same & ~flipped & ~ambiguous & (complement == ref_a2)
+        sign = np.select([same | strand_same, flipped | strand_flipped], [1.0, -1.0], 0.0)
+        used = sign != 0
+        values = w['WEIGHT'].to_numpy()
+        matrix[position[idx[used]].to_numpy(), k] = sign[used] * values[used]
+        constants[k] = 2 * values[sign < 0].sum()
+        duplicate = weights['ID'].isin(duplicate_ids).to_numpy()
+        report[name] = {
+            'weights': int(len(weights)), 'not_in_bim': int((~found & ~duplicate).sum()),
+            'duplicate_in_bim': int(duplicate.sum()), 'ambiguous': int(ambiguous.sum()),
+            'matched': int(same.sum()), 'flipped': int(flipped.sum()),
+            'strand_matched': int(strand_same.sum()), 'strand_flipped': int(strand_flipped.sum()),
+            'allele_mismatch': int((~used & ~ambiguous).sum()), 'used': int(used.sum()),
+        }
+    return rows, matrix, constants, report
+
+
+def read_psam(psam, fam):
+    """
+    Фенотип образцов .fam из .psam PLINK2: заголовок '#FID IID ...' или
+    '#IID ...' (без FID ключ — только IID). Без колонки PHENO* остается
+    фенотип .fam.
+    """
+    psam_table = pd.read_csv(psam, sep=r'\s+', dtype={'#FID': str, 'FID': str, '#IID': str, 'IID': str})
+    psam_table = psam_table.rename(columns={'FID': '#FID', '#IID': 'IID'})
+    if 'IID' not in psam_table:
+        raise ValueError(f'{psam}: нет колонки IID (ожидается заголовок #FID IID ... или #IID ...)')
+    keys = ['#FID', 'IID'] if '#FID' in psam_table else ['IID']
+    pheno_col = next((c for c in psam_table.columns if c.startswith('PHENO')), None)
+    if pheno_col is None:
+        print(f"⚠️ {psam}: нет колонки PHENO, фенотип берется из .fam")
+        return fam['PHENO']
+    samples = fam[['FID', 'IID']].rename(columns={'FID': '#FID'})
+    keyed = samples.merge(psam_table[keys + [pheno_col]].drop_duplicates(keys), on=keys, how='left')
+    if keyed[pheno_col].isna().any():
+        print(f"⚠️ {psam}: не для всех образцов .fam найден фенотип")
+    return keyed[pheno_col]
+
+
+def score_block(genotypes, weights):
+    """
+    Вклад блока вариантов в баллы образцов: пропуски заменяются средним
+    генотипом варианта. score = w' G0 + (w * mean)' M, где G0 — генотипы
+    с нулями вместо пропусков, M — индикатор пропуска. Возвращает
+    (баллы образцы x панели, число наблюдаемых аллелей образцы x панели).
+    """
+    missing = genotypes == MISSING_GENOTYPE
+    dosage = genotypes.astype('float32')
+    dosage[missing] = 0
+    observed = genotypes.shape[1] - missing.sum(1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(observed > 0, dosage.sum(1) / observed, 0.0)
+    weights = weights.astype('float32')
+    nonzero = (weights != 0).astype('float32')
+    # Одна float32 матрица пропусков на оба слагаемых: наблюдаемые аллели =
+    # все ненулевые веса минус пропущенные
+    missing = missing.T.astype('float32')
+    scores = dosage.T @ weights + missing @ (weights * mean[:, None].astype('float32'))
+    allele_ct = 2 * (nonzero.sum(0) - missing @ nonzero)
+    return scores.astype('float64'), np.rint(allele_ct).astype('int64')
+
+
+def prs_score(bfile, panels, out_file, psam=None, jobs=4, block_elements=BLOCK_ELEMENTS):
+    """
+    Полигенные баллы по панелям весов {имя: таблица load_weights} за один
+    проход по генотипам: блоки вариантов читаются потоково, вклад блока —
+    матричное произведение (варианты x образцы)' x (варианты x панели),
+    блоки считаются параллельно в потоках. Память ограничена размером блока
+    и числом потоков, а не числом вариантов. Результат — по образцу .fam
+    (FID, IID, фенотип из .psam при наличии) с SUM и AVG по каждой панели.
+    """
+    start = time.time()
+    reader = BedReader(bfile)
+    # .psam читается до прохода по генотипам: ошибка в нем не должна ждать расчета
+    pheno = read_psam(psam, reader.fam) if psam else reader.fam['PHENO']
+    rows, matrix, constants, report = align_weights(panels, reader.bim)
+    for name, item in report.items():
+        print(f"{name}: весов {item['weights']}, использовано {item['used']} "
+              f"(прямо {item['matched']}, обратный аллель {item['flipped']}, "
+              f"другая цепь {item['strand_matched'] + item['strand_flipped']}), "
+              f"нет в .bim {item['not_in_bim']}, повторы ID в .bim {item['duplicate_in_bim']}, "
+              f"A/T и C/G {item['ambiguous']}, несовпадение аллелей {item['allele_mismatch']}")
+    if not len(rows):
+        raise ValueError('Ни один вариант панелей не найден в .bim')
+
+    block_size = max(1, block_elements // max(reader.n_samples, 1))
+    print(f"PRS: {len(rows)} вариантов x {reader.n_samples} образцов, "
+          f"блоки по {block_size} вариантов, потоков {jobs}")
+    starts = list(range(0, len(rows), block_size))
+
+    def run_worker(worker):
+        # Каждый поток читает свои блоки (через один на jobs) и копит частные суммы:
+        # в памяти одновременно не больше jobs блоков генотипов
+        scores = np.zeros((reader.n_samples, matrix.shape[1]))
+        allele_ct = np.zeros(scores.shape, dtype='int64')
+        for start in starts[worker::jobs]:
+            block = slice(start, start + block_size)
+            variants = rows[block]
+            if variants[-1] - variants[0] == len(variants) - 1:
+                genotypes = reader.read(slice(variants[0], variants[-1] + 1))
+            else:
+                genotypes = reader.read(variants)
+            block_scores, block_ct = score_block(genotypes, matrix[block])
+            scores += block_scores
+            allele_ct += block_ct
+        return scores, allele_ct
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        partial = list(pool.map(run_worker, range(jobs)))
+    scores = sum(p[0] for p in partial) + constants
+    allele_ct = sum(p[1] for p in partial)
+    n_used = (matrix != 0).sum(0)
+
+    result = reader.fam[['FID', 'IID']].rename(columns={'FID': '#FID'}).copy()
+    result['PHENO'] = pheno.to_numpy()
+    for k, name in enumerate(panels):
+        result[f'{name}_ALLELE_CT'] = allele_ct[:, k]
+        result[f'{name}_SUM'] = scores[:, k]
+        result[f'{name}_AVG'] = scores[:, k] / max(2 * n_used[k], 1)
+
+    tmp_path = out_file + '.tmp'
+    result.to_csv(tmp_path, sep='\t', index=False, na_rep='NA', float_format='%.6g')
+    os.replace(tmp_path, out_file)
+
+    summary = {'bfile': bfile, 'samples': int(reader.n_samples), 'variants': int(len(rows)),
+               'block_size': int(block_size), 'jobs': jobs, 'panels': report,
+               'seconds': round(time.time() - start, 2)}
+    summary_path = os.path.splitext(out_file)[0] + '.prs_summary.json'
+    with open(summary_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    os.replace(summary_path + '.tmp', summary_path)
+    print(f"Баллы: {out_file} ({summary['seconds']:.1f} с)")
+    return result, report
+
+
+def panel_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Полигенные баллы риска по генотипам PLINK')
+    parser.add_argument('--bfile', required=True, help='Префикс .bed/.bim/.fam')
+    parser.add_argument('--weights', nargs='*', default=[],
+                        help='Таблицы весов (ID, A1, OR или WEIGHT/BETA): выходы фильтров SNP')
+    parser.add_argument('--candidates', nargs='*', default=[],
+                        help='Excel-списки кандидатов: веса берутся из строк GWAS (--gwas)')
+    parser.add_argument('--gwas', default=None, help='Результаты GWAS для --candidates')
+    parser.add_argument('--weight-column', default=None, help='Колонка веса (по умолчанию — log OR)')
+    parser.add_argument('--psam', default=None, help='.psam для ключей образцов и фенотипа')
+    parser.add_argument('--out', required=True, help='Файл баллов (TSV)')
+    parser.add_argument('--jobs', type=int, default=4)
+    args = parser.parse_args()
+
+    panels = {panel_name(p): load_weights(p, weight_column=args.weight_column) for p in args.weights}
+    if args.candidates and not args.gwas:
+        parser.error('--candidates требует --gwas')
+    panels.update({panel_name(p): weights_from_candidates(p, args.gwas) for p in args.candidates})
+    if not panels:
+        parser.error('Нужна хотя бы одна панель: --weights или --candidates')
+    prs_score(args.bfile, panels, args.out, args.psam, args.jobs)
@@ -0,0 +1,116 @@
+import contextlib
+import json
+import os
+import time
+
+import pandas as pd
+
+from instrumentation import span
+
+# Строк на блок при потоковой записи приложений
+SIDECAR_CHUNK_ROWS = 100_000
+
+
+class ReportWriter:
+    """
+    Отчет из двух частей: основной JSON только со сводкой и ссылками
+    и приложения (<отчет>.<раздел>.ndjson или .parquet) для больших
+    разделов — списков SNP и записей по вариантам. Приложения пишутся
+    потоково блоками, время записи каждого раздела попадает в отчет.
+    """
+
+    def __init__(self, report_path, sidecar_format='ndjson'):
+        if sidecar_format == 'parquet':
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                print("   ВНИМАНИЕ: pyarrow не установлен, приложения пишутся в NDJSON")
+                sidecar_format = 'ndjson'
+        self.report_path = report_path
+        self.base = os.path.splitext(report_path)[0]
+        self.sidecar_format = sidecar_format
+        self.timings = {}
+
+    @contextlib.contextmanager
+    def section(self, name):
+        # Раздел отчета — также участок трассы (instrumentation)
+        start = time.perf_counter()
+        try:
+            with span(f'report:{name}'):
+                yield
+        finally:
+            self.timings[name] = round(time.perf_counter() - start, 4)
+
+    def sidecar(self, name, data, column='SNP'):
+        """
+        Запись раздела в приложение. data — DataFrame, список записей
+        (словарей) или список значений (пишутся как {column: значение}).
+        Возвращает ссылку для основного отчета: файл, формат, число строк.
+        """
+        with self.section(name):
+            if not isinstance(data, pd.DataFrame):
+                data = list(data)
+                if data and isinstance(data[0], dict):
+                    data = pd.DataFrame.from_records(data)
+                else:
+                    data = pd.DataFrame({column: data})
+            path = f'{self.base}.{name}.{self.sidecar_format}'
+            tmp_path = path + '.tmp'
+            if self.sidecar_format == 'parquet':
+                _write_parquet(data, tmp_path)
+            else:
+                _write_ndjson(data, tmp_path)
+            os.replace(tmp_path, path)
+        return {'file': os.path.basename(path), 'format': self.sidecar_format, 'count': int(len(data))}
+
+    def write(self, report):
+        """
+        Основной JSON (атомарно) с временем записи по разделам
+        """
+        with self.section('report_json'):
+            report = dict(report, section_timings=self.timings)
+            tmp_path = self.report_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+            os.replace(tmp_path, self.report_path)
+        return self.report_path
+
+    def print_timings(self):
+        for name, seconds in self.timings.items():
+            print(f"   Раздел '{name}': {seconds:.3f} с")
+
+
+def _write_ndjson(df, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        for start in range(0, len(df), SIDECAR_CHUNK_ROWS):
+            chunk = df.iloc[start:start + SIDECAR_CHUNK_ROWS]
+            # lines=True завершает каждую запись переводом строки
+            f.write(chunk.to_json(orient='records', lines=True, force_ascii=False,
+                                  default_handler=str))
+
+
+def _write_parquet(df, path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    writer = None
+    try:
+        for start in range(0, max(len(df), 1), SIDECAR_CHUNK_ROWS):
+            table = pa.Table.from_pandas(df.iloc[start:start + SIDECAR_CHUNK_ROWS], preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def read_sidecar(report_path, reference):
+    """
+    Загрузка приложения по ссылке из основного отчета
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(report_path)), reference['file'])
+    if not reference['count']:
+        return pd.DataFrame()
+    if reference['format'] == 'parquet':
+        return pd.read_parquet(path)
+    return pd.read_json(path, orient='records', lines=True, dtype=False)
@@ -9,14 +9,10 @@ cd /home/esp/data_analyze/01.06.2025_v2
 # Создание директории для результатов
 mkdir -p results
 
-echo "1. Запуск основного анализа..."
-python complete_analysis.py
-
-echo "2. Создание визуализаций..."
-python create_visualizations.py
-
-echo "3. Анализ .assoc файла..."
-python analyze_assoc_file.py
+# Все стадии (основной анализ, визуализации, анализ .assoc) выполняются
+# в одном процессе над однажды загруженными данными; стадии с
+# неизменившимися входами пропускаются
+python run_pipeline.py --output-dir results "$@"
 
 echo "=== АНАЛИЗ ЗАВЕРШЕН ==="
 echo "Результаты сохранены в директории: results/"
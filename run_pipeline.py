@@ -0,0 +1,291 @@
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import resource
+import sys
+import time
+from datetime import datetime
+from graphlib import TopologicalSorter
+
+from gwas_cache import file_signature, load_gwas
+from gwas_streaming_stats import DEFAULT_CHUNKSIZE
+from instrumentation import TRACER, add_arguments, configure_from_args, span
+
+# Пути по умолчанию (как в run_analysis.sh)
+BASE_DIR = "/home/esp/data_analyze/01.06.2025_v2"
+GWAS_FILE = os.path.join(BASE_DIR, "data/init/gwas_results.assoc")
+EXCEL_FILE = os.path.join(BASE_DIR, "data/init/Аллели по болезни Альцгеймера .xlsx")
+OUTPUT_DIR = os.path.join(BASE_DIR, "results")
+
+STATE_FILE = 'pipeline_state.json'
+
+
+def stage_analysis(ctx):
+    """
+    Основной анализ: пересечение SNP из Excel с результатами GWAS
+    """
+    from complete_analysis import complete_snp_analysis
+    if ctx['chunksize']:
+        results = complete_snp_analysis(ctx['excel'], ctx['gwas'], ctx['output_dir'],
+                                        chunksize=ctx['chunksize'])
+    else:
+        results = complete_snp_analysis(ctx['excel'], ctx['gwas'], ctx['output_dir'],
+                                        df_gwas=get_gwas(ctx))
+    if results is None:
+        raise RuntimeError("complete_snp_analysis завершился с ошибкой")
+    return results
+
+
+def stage_plots(ctx):
+    """
+    Графики GWAS (Manhattan, QQ, гистограмма p-values, SNP по хромосомам)
+    """
+    from create_visualizations import create_gwas_visualizations
+    output_file = os.path.join(ctx['output_dir'], 'gwas_analysis_plots.pdf')
+    if create_gwas_visualizations(ctx['gwas'], output_file, df=get_gwas(ctx)) is None:
+        raise RuntimeError("create_gwas_visualizations завершился с ошибкой")
+    return output_file
+
+
+def stage_assoc_report(ctx):
+    """
+    Текстовая сводка по .assoc файлу (вывод analyze_assoc_file сохраняется в файл)
+    """
+    from analyze_assoc_file import analyze_assoc_file
+    output_file = os.path.join(ctx['output_dir'], 'assoc_summary.txt')
+    with open(output_file, 'w', encoding='utf-8') as f, contextlib.redirect_stdout(f):
+        if ctx['chunksize']:
+            df = analyze_assoc_file(ctx['gwas'], streaming=True, chunksize=ctx['chunksize'])
+        else:
+            df = analyze_assoc_file(ctx['gwas'], df=get_gwas(ctx))
+    if df is None:
+        raise RuntimeError("analyze_assoc_file завершился с ошибкой")
+    print(f"   Сводка по .assoc сохранена: {output_file}")
+    return output_file
+
+
+def stage_loci(ctx):
+    """
+    Lambda GC, q-values (BH) и независимые локусы с ведущими SNP
+    """
+    from post_gwas import post_gwas_report
+    # В потоковом режиме таблица целиком не загружается: берутся только нужные колонки кэша
+    df = None if ctx['chunksize'] else get_gwas(ctx)
+    return post_gwas_report(ctx['gwas'], ctx['output_dir'], df=df, bfile=ctx.get('bfile'))
+
+
+# Описание стадий: функция, зависимости от других стадий, входные файлы
+# (ключи контекста) и выходные файлы относительно output_dir
+STAGES = {
+    'analysis': {
+        'func': stage_analysis,
+        'deps': [],
+        'inputs': ['gwas', 'excel'],
+        'options': ['chunksize'],
+        'outputs': ['complete_analysis_report.json', 'analysis_summary.txt',
+                    'found_alzheimer_snps_detailed.csv'],
+    },
+    'plots': {
+        'func': stage_plots,
+        'deps': [],
+        'inputs': ['gwas'],
+        'outputs': ['gwas_analysis_plots.pdf'],
+    },
+    'assoc_report': {
+        'func': stage_assoc_report,
+        'deps': [],
+        'inputs': ['gwas'],
+        'options': ['chunksize'],
+        'outputs': ['assoc_summary.txt'],
+    },
+    'loci': {
+        'func': stage_loci,
+        'deps': [],
+        'inputs': ['gwas'],
+        'options': ['bfile', 'chunksize'],
+        'outputs': ['gwas_loci.csv', 'post_gwas_summary.json'],
+    },
+}
+
+
+def get_gwas(ctx):
+    """
+    Результаты GWAS загружаются один раз на весь запуск конвейера
+    """
+    if ctx.get('df_gwas') is None:
+        with span('load_gwas', file=ctx['gwas']) as s:
+            ctx['df_gwas'] = load_gwas(ctx['gwas'])
+            s.count(rows=len(ctx['df_gwas']))
+    return ctx['df_gwas']
+
+
+def resolve_stages(selected):
+    """
+    Выбранные стадии вместе со всеми их зависимостями в топологическом порядке
+    """
+    needed = set()
+    stack = list(selected)
+    while stack:
+        name = stack.pop()
+        if name in needed:
+            continue
+        if name not in STAGES:
+            raise ValueError(f"Неизвестная стадия: {name}")
+        needed.add(name)
+        stack.extend(STAGES[name]['deps'])
+    graph = {name: set(STAGES[name]['deps']) for name in needed}
+
+    # Среди готовых к запуску стадий сохраняется порядок объявления в STAGES
+    position = {name: i for i, name in enumerate(STAGES)}
+    sorter = TopologicalSorter(graph)
+    sorter.prepare()
+    order = []
+    while sorter.is_active():
+        ready = sorted(sorter.get_ready(), key=position.get)
+        order.extend(ready)
+        sorter.done(*ready)
+    return order
+
+
+def stage_key(name, ctx, dep_keys):
+    """
+    Ключ стадии: сигнатуры входных файлов + ключи зависимостей
+    """
+    spec = STAGES[name]
+    payload = {
+        'inputs': {k: [ctx[k], file_signature(ctx[k])] for k in spec['inputs']},
+        'deps': {d: dep_keys[d] for d in spec['deps']},
+        'options': {k: ctx.get(k) for k in spec.get('options', [])},
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def reset_peak_rss():
+    """
+    Сброс пикового RSS процесса (Linux: /proc/self/clear_refs), чтобы
+    пик считался отдельно для каждой стадии
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """
+    Пиковый RSS процесса в МБ (VmHWM, иначе ru_maxrss)
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def load_state(output_dir):
+    path = os.path.join(output_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_state(output_dir, state):
+    path = os.path.join(output_dir, STATE_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def run_pipeline(gwas_file=GWAS_FILE, excel_file=EXCEL_FILE, output_dir=OUTPUT_DIR,
+                 stages=None, force=False, chunksize=None, bfile=None):
+    """
+    Запуск стадий анализа в одном процессе над общим набором данных.
+    Стадии с неизменившимися входами и существующими выходами пропускаются.
+    chunksize — потоковый режим (анализ и сводка .assoc без загрузки всего файла);
+    bfile — генотипы .bed/.bim/.fam для кластеризации локусов по r²
+    """
+    print("=== ЗАПУСК КОНВЕЙЕРА АНАЛИЗА SNP ===")
+    print(f"Время начала: {datetime.now()}")
+
+    os.makedirs(output_dir, exist_ok=True)
+    ctx = {'gwas': gwas_file, 'excel': excel_file, 'output_dir': output_dir,
+           'chunksize': chunksize, 'bfile': bfile}
+    order = resolve_stages(stages or list(STAGES))
+    state = load_state(output_dir)
+    keys = {}
+    timings = []
+
+    for name in order:
+        spec = STAGES[name]
+        keys[name] = stage_key(name, ctx, keys)
+        outputs = [os.path.join(output_dir, o) for o in spec['outputs']]
+        up_to_date = (state.get(name, {}).get('key') == keys[name]
+                      and all(os.path.exists(o) for o in outputs))
+        if up_to_date and not force:
+            print(f"\n[{name}] входы не изменились — пропуск")
+            timings.append((name, 'skipped', 0.0, None))
+            continue
+
+        print(f"\n[{name}] {spec['func'].__doc__.strip()}")
+        reset_peak_rss()
+        start = time.perf_counter()
+        with span(f'stage:{name}'):
+            spec['func'](ctx)
+        elapsed = time.perf_counter() - start
+        peak = peak_rss_mb()
+        print(f"[{name}] время: {elapsed:.2f} с, пиковый RSS: {peak:.1f} МБ")
+        timings.append((name, 'done', elapsed, peak))
+
+        state[name] = {'key': keys[name], 'finished': datetime.now().isoformat()}
+        save_state(output_dir, state)
+
+    print("\n=== ИТОГИ ПО СТАДИЯМ ===")
+    for name, status, elapsed, peak in timings:
+        peak_text = f"{peak:.1f} МБ" if peak is not None else "—"
+        print(f"  {name:<14} {status:<8} {elapsed:8.2f} с   пиковый RSS: {peak_text}")
+    print(f"Время завершения: {datetime.now()}")
+    return timings
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Конвейер анализа SNP в одном процессе")
+    parser.add_argument('--gwas', default=GWAS_FILE,
+                        help="Результаты GWAS (.assoc или .glm.logistic.hybrid)")
+    parser.add_argument('--excel', default=EXCEL_FILE, help="Excel со списком SNP-кандидатов")
+    parser.add_argument('--output-dir', default=OUTPUT_DIR, help="Директория для результатов")
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), default=None,
+                        help="Запускаемые стадии (по умолчанию — все)")
+    parser.add_argument('--force', action='store_true',
+                        help="Перезапустить стадии даже при неизменных входах")
+    parser.add_argument('--streaming', action='store_true',
+                        help="Потоковое чтение GWAS блоками (файлы больше памяти)")
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE,
+                        help="Размер блока строк в потоковом режиме")
+    parser.add_argument('--bfile', default=None,
+                        help="Префикс .bed/.bim/.fam: кластеризация локусов по r² (стадия loci)")
+    add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    configure_from_args(args)
+    try:
+        run_pipeline(args.gwas, args.excel, args.output_dir, args.stages, args.force,
+                     chunksize=args.chunksize if args.streaming else None, bfile=args.bfile)
+    except Exception as e:
+        print(f"ОШИБКА при выполнении конвейера: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        TRACER.finish()
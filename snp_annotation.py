@@ -0,0 +1,272 @@
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import xml.etree.ElementTree as ET
+
+import pandas as pd
+
+from candidate_lists import load_candidates, read_table
+
+EUTILS_URL = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils'
+DEFAULT_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'data', 'output', 'dbsnp_cache.sqlite')
+
+# Колонки таблиц *_snp_annotation.csv из code/comparison.ipynb
+ANNOTATION_COLUMNS = ['rsID', 'Chr', 'Position', 'Gene', 'SNP Class',
+                      'Global MAF', 'Alleles', 'Function Class']
+EMPTY_VALUE = '—'
+
+DEFAULT_TTL_DAYS = 90
+DEFAULT_BATCH_SIZE = 200
+# Лимиты NCBI E-utilities: 3 запроса/с без ключа, 10 с API-ключом
+RATE_WITH_KEY = 10
+RATE_WITHOUT_KEY = 3
+
+
+class AnnotationCache:
+    """
+    Постоянный кэш аннотаций (SQLite, ключ — rsID). Хранятся и найденные,
+    и отсутствующие в dbSNP записи, чтобы не запрашивать их повторно.
+    Каждый пакет фиксируется сразу, поэтому прерванный запуск продолжается
+    с незапрошенных rsID.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE, ttl_days=DEFAULT_TTL_DAYS):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.ttl_seconds = ttl_days * 86400 if ttl_days else None
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS annotations ('
+                          'rsid TEXT PRIMARY KEY, data TEXT, fetched_at REAL)')
+        self.conn.commit()
+
+    def get_many(self, rsids):
+        """
+        Свежие записи кэша: {rsID: словарь колонок или None (нет в dbSNP)}
+        """
+        found = {}
+        min_time = time.time() - self.ttl_seconds if self.ttl_seconds else 0
+        rsids = list(rsids)
+        for start in range(0, len(rsids), 500):
+            part = rsids[start:start + 500]
+            rows = self.conn.execute(
+                f'SELECT rsid, data FROM annotations WHERE fetched_at >= ? '
+                f'AND rsid IN ({",".join("?" * len(part))})', [min_time] + part)
+            for rsid, data in rows:
+                found[rsid] = json.loads(data) if data else None
+        return found
+
+    def put_many(self, records, fetched_at=None):
+        fetched_at = fetched_at or time.time()
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO annotations (rsid, data, fetched_at) VALUES (?, ?, ?)',
+            [(rsid, json.dumps(rec, ensure_ascii=False) if rec else None, fetched_at)
+             for rsid, rec in records.items()])
+        self.conn.commit()
+
+    def import_csv(self, path):
+        """
+        Загрузка ранее сохраненной таблицы аннотаций (snp_annotation.csv и т.п.).
+        Строки без Chr/Gene (rsID не найден) не импортируются — их стоит перепроверить.
+        """
+        df = pd.read_csv(path, dtype=str)
+        df = df[df['rsID'].str.startswith('rs', na=False) & df['Chr'].notna()]
+        mtime = os.path.getmtime(path)
+        self.put_many({row['rsID']: {c: row[c] for c in ANNOTATION_COLUMNS[1:]}
+                       for _, row in df.iterrows()}, fetched_at=mtime)
+        return len(df)
+
+    def close(self):
+        self.conn.close()
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты для asyncio: не более rate запросов в секунду,
+    с запасом burst на старте
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class EutilsBackend:
+    """
+    Запросы к E-utilities: пакет rsID отправляется одним epost,
+    затем сводки забираются одним esummary (JSON). base_url можно
+    направить на локальный сервер-заглушку.
+    """
+
+    def __init__(self, base_url=EUTILS_URL, email=None, api_key=None,
+                 tool='gwas_snp_annotation', timeout=60, retries=3):
+        self.base_url = base_url.rstrip('/')
+        self.email = email or os.environ.get('NCBI_EMAIL')
+        self.api_key = api_key or os.environ.get('NCBI_API_KEY')
+        self.tool = tool
+        self.timeout = timeout
+        self.retries = retries
+
+    @property
+    def rate(self):
+        return RATE_WITH_KEY if self.api_key else RATE_WITHOUT_KEY
+
+    def _params(self, **params):
+        params.update({'tool': self.tool, 'email': self.email, 'api_key': self.api_key})
+        return urllib.parse.urlencode({k: v for k, v in params.items() if v})
+
+    def _post(self, endpoint, body):
+        request = urllib.request.Request(f'{self.base_url}/{endpoint}', data=body.encode('ascii'))
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return response.read()
+
+    async def _request(self, limiter, endpoint, body):
+        for attempt in range(self.retries + 1):
+            await limiter.acquire()
+            try:
+                return await asyncio.to_thread(self._post, endpoint, body)
+            except (urllib.error.URLError, TimeoutError) as e:
+                if attempt == self.retries:
+                    raise
+                print(f'⚠️ {endpoint}: {e}, повтор через {2 ** attempt} с')
+                await asyncio.sleep(2 ** attempt)
+
+    async def fetch(self, rsids, limiter):
+        """
+        Аннотации пакета: {rsID: словарь колонок или None}
+        """
+        uids = [rs[2:] for rs in rsids]
+        posted = ET.fromstring(await self._request(
+            limiter, 'epost.fcgi', self._params(db='snp', id=','.join(uids))))
+        web_env, query_key = posted.findtext('WebEnv'), posted.findtext('QueryKey')
+        if not web_env:
+            raise RuntimeError(f'epost без WebEnv: {ET.tostring(posted)[:300]!r}')
+        summary = json.loads(await self._request(
+            limiter, 'esummary.fcgi', self._params(db='snp', WebEnv=web_env, query_key=query_key,
+                                                   retmode='json', retmax=len(uids))))
+        result = summary.get('result', {})
+        return {rs: parse_docsum(result.get(uid)) for rs, uid in zip(rsids, uids)}
+
+
+def parse_docsum(doc):
+    """
+    Сводка esummary db=snp -> колонки таблицы аннотаций (None, если rsID не найден)
+    """
+    if not doc or 'error' in doc:
+        return None
+    genes = doc.get('genes') or []
+    mafs = doc.get('global_mafs') or []
+    return {
+        'Chr': doc.get('chr') or EMPTY_VALUE,
+        'Position': doc.get('chrpos') or EMPTY_VALUE,
+        'Gene': genes[0].get('name') if genes else EMPTY_VALUE,
+        'SNP Class': doc.get('snp_class') or EMPTY_VALUE,
+        'Global MAF': '|'.join(f"{m.get('study')}:{m.get('freq')}" for m in mafs) or EMPTY_VALUE,
+        'Alleles': doc.get('allele') or EMPTY_VALUE,
+        'Function Class': doc.get('fxn_class') or EMPTY_VALUE,
+    }
+
+
+async def _fetch_missing(rsids, cache, backend, batch_size, concurrency):
+    limiter = TokenBucket(backend.rate)
+    semaphore = asyncio.Semaphore(concurrency)
+    batches = [rsids[i:i + batch_size] for i in range(0, len(rsids), batch_size)]
+    done = 0
+
+    async def run_batch(batch):
+        nonlocal done
+        async with semaphore:
+            records = await backend.fetch(batch, limiter)
+        # Запись в кэш — в потоке цикла событий, сразу после пакета
+        cache.put_many(records)
+        done += len(batch)
+        print(f'🔍 Аннотировано {done}/{len(rsids)}')
+
+    results = await asyncio.gather(*(run_batch(b) for b in batches), return_exceptions=True)
+    errors = [r for r in results if isinstance(r, Exception)]
+    if errors:
+        raise RuntimeError(f'Не выполнено пакетов: {len(errors)} (повторный запуск продолжит '
+                           f'с незапрошенных rsID): {errors[0]}')
+
+
+def annotate_rsids(rsids, cache_path=DEFAULT_CACHE, backend=None, ttl_days=DEFAULT_TTL_DAYS,
+                   batch_size=DEFAULT_BATCH_SIZE, concurrency=3, refresh=False):
+    """
+    Таблица аннотаций в формате snp_annotation.csv. Запрашиваются только
+    rsID, которых нет в кэше (или запись старше ttl_days); ID не вида rs*
+    возвращаются пустыми без запроса.
+    """
+    rsids = list(dict.fromkeys(str(r) for r in rsids))
+    queryable = [r for r in rsids if r.startswith('rs') and r[2:].isdigit()]
+    cache = AnnotationCache(cache_path, ttl_days)
+    try:
+        cached = {} if refresh else cache.get_many(queryable)
+        missing = [r for r in queryable if r not in cached]
+        print(f'rsID: {len(rsids)}, в кэше: {len(cached)}, запрашивается: {len(missing)}')
+        if missing:
+            asyncio.run(_fetch_missing(missing, cache, backend or EutilsBackend(),
+                                       batch_size, concurrency))
+        records = cache.get_many(queryable) if missing or refresh else cached
+    finally:
+        cache.close()
+
+    rows = [{'rsID': r, **(records.get(r) or {})} for r in rsids]
+    return pd.DataFrame(rows, columns=ANNOTATION_COLUMNS)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Аннотация rsID через dbSNP с локальным кэшем')
+    parser.add_argument('input', help='CSV/Excel со списком SNP или текстовый файл по одному rsID')
+    parser.add_argument('output', help='CSV с аннотациями')
+    parser.add_argument('--column', default=None, help='Колонка с rsID (по умолчанию определяется по содержимому)')
+    parser.add_argument('--cache', default=DEFAULT_CACHE)
+    parser.add_argument('--ttl-days', type=float, default=DEFAULT_TTL_DAYS)
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--concurrency', type=int, default=3)
+    parser.add_argument('--refresh', action='store_true', help='Запросить заново, игнорируя кэш')
+    parser.add_argument('--import-csv', nargs='*', default=[],
+                        help='Сначала загрузить в кэш ранее сохраненные *_snp_annotation.csv')
+    parser.add_argument('--base-url', default=EUTILS_URL)
+    parser.add_argument('--email', default=None)
+    parser.add_argument('--api-key', default=None)
+    args = parser.parse_args()
+
+    if args.import_csv:
+        cache = AnnotationCache(args.cache, args.ttl_days)
+        for path in args.import_csv:
+            print(f'Импорт {path}: {cache.import_csv(path)} записей')
+        cache.close()
+
+    if args.column:
+        table = read_table(args.input)
+        snps = table[args.column].dropna()
+    elif args.input.endswith(('.xlsx', '.xls', '.csv')):
+        # Колонка SNP определяется по содержимому, разобранный список кэшируется
+        snps = load_candidates(args.input)['id']
+    else:
+        snps = pd.read_csv(args.input, header=None, names=['SNP'])['SNP'].dropna()
+    backend = EutilsBackend(args.base_url, email=args.email, api_key=args.api_key)
+    result = annotate_rsids(snps, args.cache, backend, args.ttl_days,
+                            args.batch_size, args.concurrency, args.refresh)
+    result.to_csv(args.output, index=False)
+    print(f'Сохранено: {args.output} ({len(result)} строк)')
@@ -0,0 +1,214 @@
+import argparse
+import itertools
+import json
+import operator
+import os
+import re
+import time
+from datetime import datetime
+
+import numpy as np
+
+from gwas_cache import DEFAULT_GWAS_FILE, ensure_cache, load_cache, read_cache_column, read_cache_meta
+
+# Наборы правил из code/comparison.ipynb
+NOTEBOOK_RULE_SETS = {
+    'significant_snps': 'P < 0.05',
+    'risk_snps_OR>8': 'P < 0.05 & LOG(OR)_SE < 0.165',
+    'pm5_lgl17_or1.5': "P < 0.05 & LOG(OR)_SE < 0.17 & OR > 1.5 & ID startswith 'rs'",
+}
+
+NUMERIC_OPS = {'<': operator.lt, '<=': operator.le, '>': operator.gt,
+               '>=': operator.ge, '==': operator.eq, '!=': operator.ne}
+STRING_OPS = ('startswith', 'endswith', 'contains', '==', '!=')
+
+CONDITION_PATTERN = re.compile(
+    r'^\s*(?P<column>[#\w()?.]+)\s*(?P<op><=|>=|==|!=|<|>|\s(?:startswith|endswith|contains)\s)'
+    r'\s*(?P<value>.+?)\s*$')
+SWEEP_PATTERN = re.compile(r'\{([^{}]+)\}')
+
+
+def parse_value(text):
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in '\'"':
+        return text[1:-1]
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+
+def parse_rule(expression):
+    """
+    Правило -> список дизъюнктов, каждый — список условий (колонка, операция, значение).
+    Синтаксис: условия через '&', альтернативы через '|' (приоритет у '&'):
+    "P < 0.05 & LOG(OR)_SE < 0.17 & OR > 1.5 & ID startswith 'rs'"
+    """
+    clauses = []
+    for part in expression.split('|'):
+        clause = []
+        for text in part.split('&'):
+            match = CONDITION_PATTERN.match(text)
+            if not match:
+                raise ValueError(f'Не удалось разобрать условие: {text.strip()!r} в {expression!r}')
+            clause.append((match['column'], match['op'].strip(), parse_value(match['value'])))
+        clauses.append(clause)
+    return clauses
+
+
+def expand_sweep(name, expression):
+    """
+    Перебор порогов: 'P < {0.05,0.01} & OR > {1.5,2}' -> 4 набора
+    с именами name_0.05_1.5, name_0.05_2, ...
+    """
+    options = [[v.strip() for v in group.split(',')] for group in SWEEP_PATTERN.findall(expression)]
+    if not options:
+        return {name: expression}
+    expanded = {}
+    for values in itertools.product(*options):
+        it = iter(values)
+        expanded['_'.join([name, *values])] = SWEEP_PATTERN.sub(lambda _: next(it), expression)
+    return expanded
+
+
+class ColumnEvaluator:
+    """
+    Вычисление условий прямо по массивам колонок кэша GWAS. Каждое
+    уникальное условие считается один раз и переиспользуется всеми
+    наборами правил; строковые условия по категориальным колонкам
+    считаются по словарю значений, а затем разворачиваются по кодам.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.meta = read_cache_meta(cache_dir)
+        self.n_rows = self.meta['n_rows']
+        self.columns = {}
+        self.masks = {}
+
+    def column(self, name):
+        if name not in self.columns:
+            self.columns[name] = read_cache_column(self.cache_dir, name, self.meta)
+        return self.columns[name]
+
+    def condition(self, column, op, value):
+        key = (column, op, value)
+        if key not in self.masks:
+            self.masks[key] = self._evaluate(column, op, value)
+        return self.masks[key]
+
+    def _evaluate(self, column, op, value):
+        kind, *arrays = self.column(column)
+        if kind == 'numeric':
+            if op not in NUMERIC_OPS or isinstance(value, str):
+                raise ValueError(f'Условие {column} {op} {value!r} не применимо к числовой колонке')
+            with np.errstate(invalid='ignore'):
+                return NUMERIC_OPS[op](np.asarray(arrays[0]), value)
+        if kind == 'category':
+            codes, categories = arrays
+            hits = self._compare_values(categories, op, value, column)
+            # Код -1 (пропуск) попадает на последний элемент — False
+            return np.append(hits, False)[codes]
+        values = np.asarray(arrays[0])
+        return self._compare_values(values, op, value, column, encoded=True)
+
+    @staticmethod
+    def _compare_values(values, op, value, column, encoded=False):
+        if op in NUMERIC_OPS and op not in STRING_OPS:
+            if values.dtype.kind in 'iuf' and not isinstance(value, str):
+                return NUMERIC_OPS[op](values, value)
+            raise ValueError(f'Условие {column} {op} {value!r} не применимо к строковой колонке')
+        if values.dtype.kind in 'iuf':
+            values = values.astype(str)
+        text = str(int(value) if isinstance(value, float) and value.is_integer() else value)
+        target = text.encode('utf-8') if encoded else text
+        if op == 'startswith':
+            return np.char.startswith(values, target)
+        if op == 'endswith':
+            return np.char.endswith(values, target)
+        if op == 'contains':
+            return np.char.find(values, target) >= 0
+        return (values == target) if op == '==' else (values != target)
+
+    def rule_mask(self, clauses):
+        mask = np.zeros(self.n_rows, dtype=bool)
+        for clause in clauses:
+            clause_mask = np.ones(self.n_rows, dtype=bool)
+            for condition in clause:
+                clause_mask &= self.condition(*condition)
+            mask |= clause_mask
+        return mask
+
+
+def run_filters(rule_sets, gwas_file=DEFAULT_GWAS_FILE, output_dir=None, columns=None):
+    """
+    Все наборы правил за один проход по колоночному кэшу. Возвращает
+    {имя: DataFrame отобранных строк}; при output_dir каждый набор
+    пишется в <имя>.csv вместе с <имя>.provenance.json (правило,
+    источник и его хэш, число строк).
+    """
+    start = time.time()
+    cache_dir = ensure_cache(gwas_file)
+    evaluator = ColumnEvaluator(cache_dir)
+    expanded = {}
+    for name, expression in rule_sets.items():
+        expanded.update(expand_sweep(name, expression))
+    parsed = {name: parse_rule(expression) for name, expression in expanded.items()}
+
+    results = {}
+    for name, clauses in parsed.items():
+        rows = np.flatnonzero(evaluator.rule_mask(clauses))
+        results[name] = load_cache(cache_dir, columns=columns, rows=rows)
+        print(f'{name}: {len(rows)} из {evaluator.n_rows}  [{expanded[name]}]')
+    print(f'Уникальных условий: {len(evaluator.masks)}, наборов: {len(parsed)}, '
+          f'{time.time() - start:.2f} с')
+
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        for name, df in results.items():
+            base = os.path.join(output_dir, name.replace(os.sep, '_'))
+            df.to_csv(base + '.csv', index=False)
+            provenance = {
+                'rule_set': name,
+                'expression': expanded[name],
+                'conditions': [[list(c) for c in clause] for clause in parsed[name]],
+                'source': evaluator.meta['source'],
+                'source_sha256': evaluator.meta['source_sha256'],
+                'total_rows': evaluator.n_rows,
+                'selected_rows': int(len(df)),
+                'created': datetime.now().isoformat(),
+            }
+            with open(base + '.provenance.json', 'w', encoding='utf-8') as f:
+                json.dump(provenance, f, ensure_ascii=False, indent=2)
+    return results
+
+
+def load_rule_sets(path):
+    """
+    Наборы правил из JSON: {"имя": "выражение"} или {"имя": ["условие", ...]}
+    """
+    with open(path, encoding='utf-8') as f:
+        rules = json.load(f)
+    return {name: ' & '.join(rule) if isinstance(rule, list) else rule for name, rule in rules.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Отбор SNP по именованным наборам правил за один проход')
+    parser.add_argument('--gwas', default=DEFAULT_GWAS_FILE, help='Результаты GWAS (.assoc / .glm)')
+    parser.add_argument('--rules', default=None, help='JSON с наборами правил')
+    parser.add_argument('--rule', action='append', default=[], metavar='ИМЯ=ВЫРАЖЕНИЕ',
+                        help="Например: risk='P < 0.05 & OR > {1.5,2}' (в фигурных скобках — перебор)")
+    parser.add_argument('--notebook-rules', action='store_true',
+                        help='Наборы significant_snps, risk_snps_OR>8, pm5_lgl17_or1.5 из comparison.ipynb')
+    parser.add_argument('--output-dir', default='filters')
+    parser.add_argument('--columns', nargs='*', default=None, help='Сохраняемые колонки (по умолчанию все)')
+    args = parser.parse_args()
+
+    rule_sets = dict(NOTEBOOK_RULE_SETS) if args.notebook_rules else {}
+    if args.rules:
+        rule_sets.update(load_rule_sets(args.rules))
+    for item in args.rule:
+        name, _, expression = item.partition('=')
+        rule_sets[name.strip()] = expression
+    if not rule_sets:
+        parser.error('Не заданы правила (--rules, --rule или --notebook-rules)')
+    run_filters(rule_sets, args.gwas, args.output_dir, args.columns)
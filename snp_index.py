@@ -0,0 +1,281 @@
+import io
+import json
+import mmap
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from gwas_cache import (DEFAULT_GWAS_FILE, cache_is_fresh, file_hash, file_signature,
+                        find_column, read_cache_meta, read_gwas_text)
+
+# Версия формата индекса
+INDEX_VERSION = 1
+
+# Позиция, закодированная в ID массива: 1kg_1_159759291, imm_9_34822919,
+# chr1:12345, 1:12345:A:G
+ID_POSITION_PATTERN = r'^(?:[a-z0-9]+_)?(?:chr)?([0-9]{1,2}|x|y|xy|mt|m)[:_](\d+)(?:[:_].*)?$'
+
+
+def default_index_dir(path):
+    """
+    Директория индекса рядом с файлом GWAS: <файл>.snpidx
+    """
+    return os.path.abspath(path) + '.snpidx'
+
+
+def normalize_chrom(values):
+    """
+    Хромосома в едином виде: без префикса 'chr', верхний регистр, 'M' -> 'MT'
+    """
+    # Нормализуются только уникальные значения (их десятки), затем разворачиваются по кодам
+    values = pd.Series(values)
+    codes, uniques = pd.factorize(values)
+    chrom = pd.Series(uniques).astype(str).str.strip().str.upper().str.replace(r'^CHR', '', regex=True)
+    chrom = chrom.str.replace(r'\.0$', '', regex=True)
+    chrom = chrom.replace({'M': 'MT', '23': 'X', '24': 'Y', '25': 'XY', '26': 'MT'})
+    chrom = np.append(chrom.to_numpy(dtype=object), '0')
+    return pd.Series(chrom[codes], index=values.index)
+
+
+def id_keys(ids):
+    """
+    Ключи поиска по идентификатору (регистр и пробелы не учитываются)
+    """
+    return 'id:' + pd.Series(ids).astype(str).str.strip().str.lower()
+
+
+def position_keys(chroms, positions):
+    """
+    Ключи поиска по позиции 'pos:<CHR>:<BP>'; для CHR=0 или BP<=0 — None
+    """
+    chrom = normalize_chrom(chroms)
+    pos = pd.to_numeric(pd.Series(positions), errors='coerce')
+    valid = pos.gt(0).to_numpy() & chrom.ne('0').to_numpy()
+    keys = pd.Series(None, index=chrom.index, dtype=object)
+    keys[valid] = 'pos:' + chrom[valid] + ':' + pos[valid].astype('int64').astype(str)
+    return keys
+
+
+def id_position_keys(ids):
+    """
+    Ключи позиции, извлеченные из ID вида 1kg_1_159759291 / imm_9_34822919 / 1:12345
+    """
+    parts = pd.Series(ids).astype(str).str.strip().str.lower().str.extract(ID_POSITION_PATTERN)
+    return position_keys(parts[0].fillna('0'), parts[1])
+
+
+def _line_offsets(path, block_size=64 << 20):
+    """
+    Байтовые смещения начала каждой строки данных (без заголовка)
+    """
+    size = os.path.getsize(path)
+    starts = [np.zeros(1, dtype='int64')]
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for begin in range(0, size, block_size):
+            block = np.frombuffer(mm[begin:begin + block_size], dtype='uint8')
+            starts.append(np.flatnonzero(block == ord('\n')).astype('int64') + begin + 1)
+    starts = np.concatenate(starts)
+    starts = starts[starts < size]
+    return starts[1:]
+
+
+def build_index(path, index_dir=None):
+    """
+    Построение индекса ID / CHR:BP / позиций из ID массива -> номер строки
+    и байтовое смещение строки в файле результатов. Выполняется один раз
+    на каждый запуск GWAS.
+    """
+    index_dir = index_dir or default_index_dir(path)
+    header = read_gwas_text(path, chunksize=1).get_chunk(1).columns
+    id_col = find_column(header, 'id')
+    chrom_col = find_column(header, 'chrom')
+    pos_col = find_column(header, 'pos')
+    if id_col is None:
+        raise ValueError(f"В файле GWAS нет колонки с ID варианта: {path}")
+    usecols = [c for c in (chrom_col, id_col, pos_col) if c is not None]
+    df = read_gwas_text(path, usecols=usecols)
+
+    offsets = _line_offsets(path)
+    if len(offsets) != len(df):
+        raise ValueError(f"Число строк ({len(offsets)}) не совпадает с разобранным ({len(df)}): {path}")
+
+    rows = np.arange(len(df), dtype='int64')
+    parts = [pd.DataFrame({'key': id_keys(df[id_col]), 'row': rows}),
+             pd.DataFrame({'key': id_position_keys(df[id_col]), 'row': rows})]
+    if chrom_col is not None and pos_col is not None:
+        parts.append(pd.DataFrame({'key': position_keys(df[chrom_col], df[pos_col]), 'row': rows}))
+    entries = pd.concat(parts, ignore_index=True).dropna().drop_duplicates()
+
+    keys = entries['key'].str.encode('utf-8').to_numpy(dtype='S')
+    entry_rows = entries['row'].to_numpy(dtype='int64')
+    order = np.argsort(keys, kind='stable')
+
+    parent = os.path.dirname(os.path.abspath(index_dir))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix='.snpidx_', dir=parent)
+    try:
+        np.save(os.path.join(tmp_dir, 'keys.npy'), keys[order])
+        np.save(os.path.join(tmp_dir, 'rows.npy'), entry_rows[order])
+        np.save(os.path.join(tmp_dir, 'offsets.npy'), offsets)
+        meta = {'version': INDEX_VERSION, 'source': os.path.abspath(path),
+                'source_sha256': file_hash(path), 'n_rows': int(len(df)),
+                'n_keys': int(len(keys))}
+        meta.update(file_signature(path))
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        if os.path.isdir(index_dir):
+            shutil.rmtree(index_dir)
+        os.replace(tmp_dir, index_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return index_dir
+
+
+class SnpIndex:
+    """
+    Постоянный индекс вариантов файла GWAS. Массивы отображаются в память,
+    поиск — бинарный (np.searchsorted) по отсортированным ключам.
+    """
+
+    def __init__(self, path=DEFAULT_GWAS_FILE, index_dir=None):
+        self.path = path
+        self.index_dir = index_dir or default_index_dir(path)
+        if not cache_is_fresh(path, self.index_dir, version=INDEX_VERSION):
+            print(f"   Построение индекса SNP: {self.index_dir}")
+            build_index(path, self.index_dir)
+        self.meta = read_cache_meta(self.index_dir)
+        self.keys = np.load(os.path.join(self.index_dir, 'keys.npy'), mmap_mode='r')
+        self.rows = np.load(os.path.join(self.index_dir, 'rows.npy'), mmap_mode='r')
+        self.offsets = np.load(os.path.join(self.index_dir, 'offsets.npy'), mmap_mode='r')
+
+    @property
+    def n_rows(self):
+        return self.meta['n_rows']
+
+    def _search(self, keys):
+        encoded = pd.Series(keys).fillna('').str.encode('utf-8').to_numpy(dtype='S')
+        left = np.searchsorted(self.keys, encoded, side='left')
+        right = np.searchsorted(self.keys, encoded, side='right')
+        return left, right
+
+    def lookup(self, queries, chroms=None, positions=None):
+        """
+        Поиск списка идентификаторов (rsID, CHR:BP, 1kg_*, imm_*).
+        Сначала точное совпадение ID, затем совпадение по позиции: из
+        chroms/positions кандидатов (колонки CHR/POS списка), а где их
+        нет — из самого ID.
+        Возвращает DataFrame: query, match ('id' / 'position' / None), rows.
+        """
+        queries = pd.Series(list(queries), dtype=object).astype(str).str.strip()
+        result = pd.DataFrame({'query': queries, 'match': None, 'rows': [[] for _ in queries]})
+        pos_keys = id_position_keys(queries)
+        if chroms is not None and positions is not None:
+            explicit = position_keys(pd.Series(list(chroms), dtype=object), pd.Series(list(positions)))
+            pos_keys = explicit.where(explicit.notna(), pos_keys)
+
+        for match, keys in (('id', id_keys(queries)), ('position', pos_keys)):
+            pending = result['match'].isna().to_numpy() & keys.notna().to_numpy()
+            if not pending.any():
+                continue
+            left, right = self._search(keys[pending])
+            hits = right > left
+            matched = np.flatnonzero(pending)[hits]
+            for i, lo, hi in zip(matched, left[hits], right[hits]):
+                result.at[i, 'match'] = match
+                result.at[i, 'rows'] = sorted(int(r) for r in self.rows[lo:hi])
+        return result
+
+    def fetch_rows(self, rows):
+        """
+        Чтение только указанных строк файла GWAS по байтовым смещениям
+        """
+        rows = np.unique(np.asarray(list(rows), dtype='int64'))
+        with open(self.path, 'rb') as f:
+            lines = [f.readline()]
+            for row in rows:
+                f.seek(int(self.offsets[row]))
+                lines.append(f.readline().rstrip(b'\r\n') + b'\n')
+        df = read_gwas_text(io.BytesIO(b''.join(lines)))
+        df.index = rows
+        return df
+
+    def query_candidate_lists(self, candidate_lists):
+        """
+        Пакетный запрос нескольких списков кандидатов: {имя: список ID или
+        DataFrame candidate_lists.load_candidates (id, chrom, pos)}.
+        Все уникальные ID разрешаются одним поиском; возвращается
+        {имя: {'matches': DataFrame, 'found': [...], 'not_found': [...], 'data': DataFrame}}.
+        """
+        frames = {name: _candidate_frame(ids) for name, ids in candidate_lists.items()}
+        all_candidates = pd.concat(frames.values(), ignore_index=True).drop_duplicates('id')
+        matches = self.lookup(all_candidates['id'], all_candidates['chrom'],
+                              all_candidates['pos']).set_index('query')
+        all_rows = sorted({r for rows in matches['rows'] for r in rows})
+        data = self.fetch_rows(all_rows) if all_rows else pd.DataFrame()
+
+        results = {}
+        for name, frame in frames.items():
+            part = matches.loc[frame['id'].tolist()].reset_index()
+            found = part[part['match'].notna()]
+            rows = sorted({r for rs in found['rows'] for r in rs})
+            results[name] = {
+                'matches': part,
+                'found': found['query'].tolist(),
+                'not_found': part.loc[part['match'].isna(), 'query'].tolist(),
+                'data': data.loc[rows] if rows else data.iloc[0:0],
+            }
+        return results
+
+
+def _candidate_frame(candidates):
+    """
+    Список кандидатов в виде таблицы id / chrom / pos (для простого списка ID позиций нет)
+    """
+    if isinstance(candidates, pd.DataFrame):
+        frame = candidates.reindex(columns=['id', 'chrom', 'pos'])
+    else:
+        frame = pd.DataFrame({'id': list(candidates), 'chrom': None, 'pos': None})
+    frame = frame.assign(id=frame['id'].astype(str).str.strip())
+    return frame.drop_duplicates('id').reset_index(drop=True)
+
+
+def read_candidate_ids(excel_file):
+    """
+    Список SNP из Excel (разбор и кэш — candidate_lists.load_candidates)
+    """
+    from candidate_lists import candidate_ids
+    return candidate_ids(excel_file)
+
+
+def query_excel_lists(excel_files, gwas_file=DEFAULT_GWAS_FILE):
+    """
+    Пакетное пересечение нескольких Excel-списков с результатами GWAS через индекс
+    """
+    from candidate_lists import load_candidates
+    index = SnpIndex(gwas_file)
+    lists = {os.path.basename(path): load_candidates(path) for path in excel_files}
+    return index.query_candidate_lists(lists)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Поиск SNP-кандидатов через индекс файла GWAS")
+    parser.add_argument('excel_files', nargs='+', help="Excel-файлы со списками SNP")
+    parser.add_argument('--gwas', default=DEFAULT_GWAS_FILE)
+    parser.add_argument('--output-dir', default=None,
+                        help="Сохранить найденные строки GWAS по каждому списку в CSV")
+    args = parser.parse_args()
+
+    for name, res in query_excel_lists(args.excel_files, args.gwas).items():
+        total = len(res['found']) + len(res['not_found'])
+        print(f"{name}: найдено {len(res['found'])} из {total}")
+        print(res['matches']['match'].value_counts().to_string())
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+            out = os.path.join(args.output_dir, os.path.splitext(name)[0] + '_gwas.csv')
+            res['data'].to_csv(out, index=False)
+            print(f"   Сохранено: {out}")
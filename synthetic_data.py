@@ -0,0 +1,167 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+
+from logistic_gwas import GLM_COLUMNS
+from plink_bed import BED_MAGIC, encode_block
+
+# Строк на блок при записи: память генератора не зависит от размера файла
+CHUNK_ROWS = 1_000_000
+GENOME_LENGTH = 3_000_000_000
+N_CHROM = 22
+# Доля вариантов с истинной ассоциацией (сдвиг Z-статистики)
+SIGNAL_FRACTION = 1e-4
+ALLELE_PAIRS = np.array([['A', 'G'], ['C', 'T'], ['G', 'A'], ['T', 'C'], ['A', 'C'], ['G', 'T']])
+ASSOC_COLUMNS = ['CHR', 'SNP', 'BP', 'A1', 'F_A', 'F_U', 'A2', 'CHISQ', 'P', 'OR']
+
+
+def variant_layout(start, stop, n_variants, n_chrom=N_CHROM):
+    """
+    Детерминированные хромосома, позиция и ID вариантов [start, stop):
+    ID зависят только от номера, поэтому кандидатов можно выбрать без
+    чтения сгенерированного файла. Смесь ID как в реальных данных:
+    70% rs*, 20% 1kg_<chr>_<pos>, 10% imm_<chr>_<pos>.
+    """
+    idx = np.arange(start, stop, dtype='int64')
+    per_chrom = -(-n_variants // n_chrom)
+    spacing = max(1, GENOME_LENGTH // n_chrom // per_chrom)
+    chrom = idx // per_chrom + 1
+    pos = (idx % per_chrom) * spacing + 1 + (idx * 7919) % max(1, spacing // 2)
+    kind = idx % 10
+    chrom_text = pd.Series(chrom).astype(str)
+    pos_text = pd.Series(pos).astype(str)
+    ids = np.where(kind < 7, 'rs' + pd.Series(idx + 1000).astype(str),
+                   np.where(kind < 9, '1kg_' + chrom_text + '_' + pos_text,
+                            'imm_' + chrom_text + '_' + pos_text))
+    alleles = ALLELE_PAIRS[idx % len(ALLELE_PAIRS)]
+    return pd.DataFrame({'chrom': chrom, 'pos': pos, 'id': ids,
+                         'a1': alleles[:, 0], 'a2': alleles[:, 1], 'kind': kind})
+
+
+def _association_stats(rng, n):
+    z = rng.standard_normal(n)
+    signal = rng.random(n) < SIGNAL_FRACTION
+    z[signal] += rng.choice([-1, 1], signal.sum()) * rng.uniform(4, 8, signal.sum())
+    se = rng.uniform(0.1, 0.3, n)
+    return z, se, 2 * norm.sf(np.abs(z))
+
+
+def generate_gwas(path, n_variants, fmt='assoc', seed=0, n_samples=300):
+    """
+    Синтетические результаты GWAS: .assoc (PLINK 1.9) или .glm.logistic.hybrid
+    (PLINK 2.0). Как в реальном .assoc, у части 1kg_* вариантов CHR/BP равны 0.
+    """
+    rng = np.random.default_rng(seed)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        for start in range(0, n_variants, CHUNK_ROWS):
+            stop = min(start + CHUNK_ROWS, n_variants)
+            layout = variant_layout(start, stop, n_variants)
+            z, se, p = _association_stats(rng, stop - start)
+            freq = rng.uniform(0.05, 0.5, stop - start)
+            if fmt == 'assoc':
+                unplaced = layout['kind'].to_numpy() == 8
+                chunk = pd.DataFrame({
+                    'CHR': np.where(unplaced, 0, layout['chrom']),
+                    'SNP': layout['id'],
+                    'BP': np.where(unplaced, 0, layout['pos']),
+                    'A1': layout['a1'],
+                    'F_A': np.round(np.clip(freq * np.exp(z * se / 4), 0, 1), 4),
+                    'F_U': np.round(freq, 4),
+                    'A2': layout['a2'],
+                    'CHISQ': z * z,
+                    'P': p,
+                    'OR': np.exp(z * se),
+                })[ASSOC_COLUMNS]
+                chunk.to_csv(f, sep=' ', index=False, header=start == 0, float_format='%.6g')
+            else:
+                obs = rng.integers(int(n_samples * 0.95), n_samples + 1, stop - start)
+                chunk = pd.DataFrame({
+                    '#CHROM': layout['chrom'], 'POS': layout['pos'], 'ID': layout['id'],
+                    'REF': layout['a2'], 'ALT': layout['a1'], 'PROVISIONAL_REF?': 'Y',
+                    'A1': layout['a1'], 'OMITTED': layout['a2'], 'A1_FREQ': np.round(freq, 6),
+                    'FIRTH?': 'N', 'TEST': 'ADD', 'OBS_CT': obs, 'OR': np.exp(z * se),
+                    'LOG(OR)_SE': se, 'Z_STAT': z, 'P': p, 'ERRCODE': '.',
+                })[GLM_COLUMNS]
+                chunk.to_csv(f, sep='\t', index=False, header=start == 0, float_format='%.6g')
+    os.replace(tmp_path, path)
+    return path
+
+
+def generate_bfile(prefix, n_variants, n_samples, seed=0, missing_rate=0.01, chunk_rows=None):
+    """
+    Синтетический набор .bed/.bim/.fam и файл фенотипов <prefix>.phenotype
+    (FID IID PHENO, 1 — контроль, 2 — случай). .bed пишется блоками вариантов.
+    """
+    rng = np.random.default_rng(seed)
+    samples = pd.DataFrame({'FID': 1, 'IID': [f'S{i:06d}' for i in range(n_samples)],
+                            'PAT': 0, 'MAT': 0, 'SEX': rng.integers(1, 3, n_samples), 'PHENO': -9})
+    samples.to_csv(prefix + '.fam', sep=' ', header=False, index=False)
+    pheno = samples[['FID', 'IID']].assign(PHENO=rng.integers(1, 3, n_samples))
+    pheno.to_csv(prefix + '.phenotype', sep=' ', index=False)
+
+    # Блок ограничен ~256 МБ генотипов в памяти
+    chunk_rows = chunk_rows or max(1, min(CHUNK_ROWS, (256 << 20) // max(n_samples, 1)))
+    with open(prefix + '.bed', 'wb') as bed, open(prefix + '.bim', 'w') as bim:
+        bed.write(BED_MAGIC)
+        for start in range(0, n_variants, chunk_rows):
+            stop = min(start + chunk_rows, n_variants)
+            layout = variant_layout(start, stop, n_variants)
+            freq = rng.uniform(0.02, 0.5, stop - start)
+            genotypes = rng.binomial(2, freq[:, None], (stop - start, n_samples)).astype('int8')
+            genotypes[rng.random(genotypes.shape) < missing_rate] = -9
+            bed.write(encode_block(genotypes).tobytes())
+            layout.assign(cm=0)[['chrom', 'id', 'cm', 'pos', 'a1', 'a2']].to_csv(
+                bim, sep='\t', header=False, index=False)
+    return prefix
+
+
+def generate_candidates(path, n_variants, n_candidates, hit_rate=0.3, seed=0):
+    """
+    Excel со списком кандидатов (колонка SNP): доля hit_rate — ID из
+    сгенерированного GWAS, остальные — rsID, которых там нет
+    """
+    rng = np.random.default_rng(seed)
+    n_hits = min(int(round(n_candidates * hit_rate)), n_variants)
+    hits = np.sort(rng.choice(n_variants, n_hits, replace=False))
+    hit_ids = _ids_by_index(hits, n_variants) if n_hits else np.array([], dtype=object)
+    misses = [f'rs{n_variants + 1000 + k}' for k in range(n_candidates - n_hits)]
+    snps = np.concatenate([hit_ids, misses])
+    rng.shuffle(snps)
+    pd.DataFrame({'SNP': snps}).to_excel(path, index=False)
+    return path
+
+
+def _ids_by_index(indices, n_variants):
+    parts = []
+    for start in range(0, n_variants, CHUNK_ROWS):
+        chosen = indices[(indices >= start) & (indices < start + CHUNK_ROWS)]
+        if len(chosen):
+            layout = variant_layout(start, min(start + CHUNK_ROWS, n_variants), n_variants)
+            parts.append(layout['id'].to_numpy()[chosen - start])
+    return np.concatenate(parts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Генерация синтетических данных GWAS для бенчмарков')
+    parser.add_argument('--output-dir', default='synthetic')
+    parser.add_argument('--variants', type=float, default=1e5)
+    parser.add_argument('--samples', type=float, default=300)
+    parser.add_argument('--candidates', type=int, default=100)
+    parser.add_argument('--hit-rate', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-bfile', action='store_true', help='Не генерировать .bed/.bim/.fam')
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    n_variants, n_samples = int(args.variants), int(args.samples)
+    base = os.path.join(args.output_dir, f'synthetic_{n_variants}')
+    print(generate_gwas(base + '.assoc', n_variants, 'assoc', args.seed, n_samples))
+    print(generate_gwas(base + '.PHENO.glm.logistic.hybrid', n_variants, 'glm', args.seed, n_samples))
+    print(generate_candidates(base + '_candidates.xlsx', n_variants, args.candidates,
+                              args.hit_rate, args.seed))
+    if not args.no_bfile:
+        print(generate_bfile(f'{base}_{n_samples}', n_variants, n_samples, args.seed))
@@ -0,0 +1,44 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from complete_analysis import complete_snp_analysis  # noqa: E402
+from gwas_cache import load_gwas  # noqa: E402
+
+ASSOC = """ CHR        SNP         BP   A1      F_A      F_U   A2        CHISQ            P           OR
+   1  rs1000001      10000    A      0.3      0.2    G        4.1      0.043        1.7
+   1  rs1000002      20000    C      0.4      0.4    T        0.1       0.75        1.0
+   2  rs1000003      30000    G      0.1      0.3    A         12     0.0005       0.26
+   3  rs1000004      40000    T      0.2      0.2    C       0.01       0.92        1.0
+   5  rs1000005      50000    A      0.5      0.3    C        8.2     0.0042        2.3
+   7  rs1000006      60000    G      0.2      0.1    T        3.9      0.048        2.2
+"""
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    gwas = tmp_path / 'gwas.assoc'
+    gwas.write_text(ASSOC)
+    # ID, которых нет в GWAS, но с верными CHR/BP: находятся только по позиции
+    excel = tmp_path / 'candidates.xlsx'
+    pd.DataFrame({'Marker': [f'Affx-{i}' for i in range(5)],
+                  'Chromosome': ['1', '1', '2', '3', '5'],
+                  'Position': [10000, 20000, 30000, 40000, 50000]}).to_excel(excel, index=False)
+    return str(gwas), str(excel)
+
+
+def test_in_memory_index_and_streaming_paths_agree(inputs, tmp_path):
+    gwas, excel = inputs
+    summaries = {
+        'in_memory': complete_snp_analysis(excel, gwas, str(tmp_path / 'mem'), df_gwas=load_gwas(gwas)),
+        'index': complete_snp_analysis(excel, gwas, str(tmp_path / 'idx')),
+        'streaming': complete_snp_analysis(excel, gwas, str(tmp_path / 'stream'), chunksize=2),
+    }
+    for name, results in summaries.items():
+        assert results is not None, name
+        assert results['summary']['found_snps_count'] == 5, name
+        assert results['summary']['match_types'] == {'position': 5}, name
@@ -0,0 +1,197 @@
+import numpy as np
+import pandas as pd
+
+from gwas_cache import find_column
+from snp_index import ID_POSITION_PATTERN, normalize_chrom
+
+# Типы совпадений в порядке убывания надежности
+MATCH_TYPES = ['id', 'position_alleles', 'position_alleles_flip',
+               'position_alleles_ambiguous', 'position', 'window']
+
+COMPLEMENT = str.maketrans('ACGT', 'TGCA')
+
+# Сдвиг кода хромосомы в составном ключе (код << 32 | позиция)
+_CHROM_SHIFT = np.int64(1 << 32)
+
+
+def variant_positions(ids, chroms=None, positions=None):
+    """
+    Хромосома и позиция варианта: из колонок CHR/BP, а если там 0 или
+    пропуск — из ID вида 1kg_1_159759291 / imm_9_34822919 / 1:12345.
+    Возвращает (chrom: Series[str], pos: ndarray[int64], 0 — позиция неизвестна).
+    """
+    ids = pd.Series(ids).reset_index(drop=True)
+    if chroms is not None and positions is not None:
+        chrom = normalize_chrom(pd.Series(chroms).reset_index(drop=True)).to_numpy(dtype=object)
+        pos = pd.to_numeric(pd.Series(positions).reset_index(drop=True),
+                            errors='coerce').fillna(0).to_numpy(dtype='int64')
+        missing = np.flatnonzero((pos <= 0) | (chrom == '0'))
+    else:
+        chrom = np.full(len(ids), '0', dtype=object)
+        pos = np.zeros(len(ids), dtype='int64')
+        missing = np.arange(len(ids))
+
+    # Разбор ID только там, где колонки CHR/BP не дают позицию
+    if len(missing):
+        parsed = ids.iloc[missing].astype(str).str.strip().str.lower().str.extract(ID_POSITION_PATTERN)
+        chrom[missing] = normalize_chrom(parsed[0].fillna('0')).to_numpy(dtype=object)
+        pos[missing] = pd.to_numeric(parsed[1], errors='coerce').fillna(0).to_numpy(dtype='int64')
+    return pd.Series(chrom), pos
+
+
+def _expand_ranges(left, right):
+    """
+    Развертывание диапазонов [left, right) в пары (номер запроса, номер элемента)
+    """
+    counts = right - left
+    query = np.repeat(np.arange(len(left)), counts)
+    starts = np.repeat(left, counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return query, starts + offsets
+
+
+def _allele_sets(first, second):
+    first = pd.Series(first).astype(str).str.upper().str.strip()
+    second = pd.Series(second).astype(str).str.upper().str.strip()
+    known = ~first.isin(['', 'NAN', 'NONE', '0', '.', 'N']) & ~second.isin(['', 'NAN', 'NONE', '0', '.', 'N'])
+    lo = np.where(first <= second, first, second)
+    hi = np.where(first <= second, second, first)
+    return lo, hi, known.to_numpy()
+
+
+def _compare_alleles(c_first, c_second, g_first, g_second):
+    """
+    Сравнение пар аллелей без учета порядка (REF/ALT или A1/A2 могут быть
+    переставлены), с учетом смены цепи. Возвращает массив меток:
+    'same', 'flip', 'ambiguous' (палиндромные A/T, C/G), 'mismatch', 'unknown'.
+    """
+    c_lo, c_hi, c_known = _allele_sets(c_first, c_second)
+    g_lo, g_hi, g_known = _allele_sets(g_first, g_second)
+    f_first = pd.Series(c_first).astype(str).str.upper().str.translate(COMPLEMENT)
+    f_second = pd.Series(c_second).astype(str).str.upper().str.translate(COMPLEMENT)
+    f_lo, f_hi, _ = _allele_sets(f_first, f_second)
+
+    same = (c_lo == g_lo) & (c_hi == g_hi)
+    flip = (f_lo == g_lo) & (f_hi == g_hi)
+    palindromic = (c_lo == f_lo) & (c_hi == f_hi)
+
+    status = np.full(len(c_lo), 'mismatch', dtype=object)
+    status[flip] = 'flip'
+    status[same] = 'same'
+    status[same & palindromic] = 'ambiguous'
+    status[~(c_known & g_known)] = 'unknown'
+    return status
+
+
+def _gwas_alleles(gwas):
+    if 'REF' in gwas.columns and 'ALT' in gwas.columns:
+        return gwas['REF'], gwas['ALT']
+    if 'A1' in gwas.columns and 'A2' in gwas.columns:
+        return gwas['A1'], gwas['A2']
+    return None, None
+
+
+def match_variants(candidates, gwas, window=0, check_alleles=True):
+    """
+    Сопоставление списка кандидатов с результатами GWAS.
+    candidates — DataFrame с колонкой 'id' и необязательными 'chrom', 'pos',
+    'ref', 'alt'; gwas — таблица .assoc / .glm (колонки определяются автоматически).
+
+    1) точное совпадение ID (без учета регистра) — бинарный поиск по
+       отсортированному массиву ID;
+    2) для оставшихся — совпадение по (CHR, BP) через отсортированный массив
+       составных ключей хромосома/позиция (с окном ±window п.н.), с проверкой
+       аллелей, включая перестановку REF/ALT и смену цепи.
+
+    Возвращает DataFrame: candidate (номер строки кандидата), query, gwas_row
+    (позиционный номер строки gwas), gwas_id, match_type, distance.
+    """
+    candidates = candidates.reset_index(drop=True)
+    id_col = find_column(gwas.columns, 'id')
+    if id_col is None:
+        raise ValueError("В таблице GWAS нет колонки с ID варианта")
+    gwas_ids = gwas[id_col].astype(str).str.strip().str.lower().to_numpy(dtype=object)
+    cand_ids = candidates['id'].astype(str).str.strip().str.lower().to_numpy(dtype=object)
+    parts = []
+
+    # 1. ID: отсортированный массив ID GWAS и бинарный поиск
+    order = np.argsort(gwas_ids, kind='stable')
+    sorted_ids = gwas_ids[order]
+    left = np.searchsorted(sorted_ids, cand_ids, side='left')
+    right = np.searchsorted(sorted_ids, cand_ids, side='right')
+    q, r = _expand_ranges(left, right)
+    parts.append(pd.DataFrame({'candidate': q, 'gwas_row': order[r], 'match_type': 'id',
+                               'distance': 0}))
+    matched = np.zeros(len(candidates), dtype=bool)
+    matched[q] = True
+
+    # 2. Позиция: составной ключ (код хромосомы << 32) + позиция
+    pending = np.flatnonzero(~matched)
+    chrom_col = find_column(gwas.columns, 'chrom')
+    pos_col = find_column(gwas.columns, 'pos')
+    g_chrom, g_pos = variant_positions(gwas[id_col],
+                                       gwas[chrom_col] if chrom_col else None,
+                                       gwas[pos_col] if pos_col else None)
+    c_chrom, c_pos = variant_positions(candidates['id'], candidates.get('chrom'),
+                                       candidates.get('pos'))
+    c_chrom, c_pos = c_chrom.iloc[pending].reset_index(drop=True), c_pos[pending]
+    cand_valid = c_pos > 0
+    if len(pending) and cand_valid.any():
+        categories = pd.Index(pd.unique(pd.concat([g_chrom, c_chrom], ignore_index=True)))
+        g_key = categories.get_indexer(g_chrom).astype('int64') * _CHROM_SHIFT + g_pos
+        c_key = categories.get_indexer(c_chrom).astype('int64') * _CHROM_SHIFT + c_pos
+        g_valid = np.flatnonzero(g_pos > 0)
+        g_order = g_valid[np.argsort(g_key[g_valid], kind='stable')]
+        g_sorted = g_key[g_order]
+
+        sel = np.flatnonzero(cand_valid)
+        left = np.searchsorted(g_sorted, c_key[sel] - window, side='left')
+        right = np.searchsorted(g_sorted, c_key[sel] + window, side='right')
+        q, r = _expand_ranges(left, right)
+        cand_rows = pending[sel[q]]
+        gwas_rows = g_order[r]
+        distance = np.abs(g_pos[gwas_rows] - c_pos[sel[q]])
+        match_type = np.where(distance == 0, 'position', 'window').astype(object)
+
+        g_first, g_second = _gwas_alleles(gwas)
+        has_alleles = 'ref' in candidates.columns and 'alt' in candidates.columns
+        if check_alleles and has_alleles and g_first is not None and len(cand_rows):
+            status = _compare_alleles(candidates['ref'].to_numpy()[cand_rows],
+                                      candidates['alt'].to_numpy()[cand_rows],
+                                      g_first.to_numpy()[gwas_rows],
+                                      g_second.to_numpy()[gwas_rows])
+            exact = distance == 0
+            match_type[exact & (status == 'same')] = 'position_alleles'
+            match_type[exact & (status == 'flip')] = 'position_alleles_flip'
+            match_type[exact & (status == 'ambiguous')] = 'position_alleles_ambiguous'
+            keep = status != 'mismatch'
+            cand_rows, gwas_rows = cand_rows[keep], gwas_rows[keep]
+            distance, match_type = distance[keep], match_type[keep]
+
+        parts.append(pd.DataFrame({'candidate': cand_rows, 'gwas_row': gwas_rows,
+                                   'match_type': match_type, 'distance': distance}))
+
+    result = pd.concat(parts, ignore_index=True)
+    result['match_type'] = pd.Categorical(result['match_type'], categories=MATCH_TYPES, ordered=True)
+
+    # Для каждого кандидата остаются совпадения только лучшего типа
+    best = result.groupby('candidate', observed=True)['match_type'].transform('min')
+    result = result[result['match_type'] == best]
+    result = result.sort_values(['candidate', 'distance', 'gwas_row'], kind='stable')
+
+    result.insert(1, 'query', candidates['id'].to_numpy()[result['candidate'].to_numpy()])
+    result.insert(3, 'gwas_id', gwas[id_col].to_numpy()[result['gwas_row'].to_numpy()])
+    return result.reset_index(drop=True)
+
+
+def summarize_matches(candidates, matches):
+    """
+    Найденные и ненайденные кандидаты (в исходном порядке) и счетчики по типам совпадений
+    """
+    ids = candidates['id'].astype(str).tolist()
+    hit = set(matches['candidate'].tolist())
+    found = [s for i, s in enumerate(ids) if i in hit]
+    not_found = [s for i, s in enumerate(ids) if i not in hit]
+    first = matches.drop_duplicates('candidate')
+    counts = first['match_type'].value_counts()
+    return found, not_found, {str(k): int(v) for k, v in counts.items() if v}